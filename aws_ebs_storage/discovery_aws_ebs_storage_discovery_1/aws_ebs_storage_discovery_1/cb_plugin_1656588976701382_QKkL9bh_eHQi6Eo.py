@@ -1,96 +1,689 @@
+import bisect
+import fcntl
+import hashlib
+import inspect
+import json
+import os
+import re
+import sys
+import threading
+import time
+import types
+from collections import OrderedDict
+from collections.abc import Mapping
+from contextlib import contextmanager
+from functools import wraps
+
+from botocore.exceptions import BotoCoreError, ClientError
 from common.methods import set_progress
 from resourcehandlers.aws.models import AWSHandler
+from resources.models import Resource
 from infrastructure.models import CustomField
+from utilities.logger import ThreadLogger
+
+logger = ThreadLogger(__name__)
+
+# BEGIN AWS client pool constants, synced from "Shared Plug-in Code/aws_client_pool.py"
+# boto3 clients and resources are shared by every AWS plug-in in this process.
+# They are built by the resource handler, so its IAM role, proxy and partition
+# settings apply, and the pool keeps at most CLIENT_POOL_MAX_SIZE of them,
+# evicting the least recently used. The first plug-in to run registers the pool
+# under CLIENT_POOL_MODULE and every later one uses it, so the version in the
+# name must be bumped whenever this section or the pool code changes.
+CLIENT_POOL_MODULE = 'cloudbolt_aws_client_pool_v4'
+CLIENT_POOL_MAX_SIZE = 256
+
+# Every AWS call made through the pool first takes a token from a bucket shared
+# by all CloudBolt worker processes on this host. There is one bucket per
+# handler, region, service and API family, stored in RATE_LIMIT_DIR and guarded
+# by a file lock. RATE_LIMITS gives the calls per second and burst size of each
+# family. Background calls leave RATE_LIMIT_INTERACTIVE_RESERVE tokens in the
+# bucket so order form calls, made in the priority lane, are not queued behind them.
+RATE_LIMIT_DIR = '/var/tmp/cloudbolt_aws_rate_limits'
+RATE_LIMITS = {'read': (10, 40), 'write': (2, 10)}
+RATE_LIMIT_INTERACTIVE_RESERVE = 5
+RATE_LIMIT_READ_PREFIXES = ('Describe', 'List', 'Get')
+
+# Set API_TRACE_ENABLED to time every AWS call made while run() or
+# discover_resources() executes, per operation and region, with retries,
+# throttles and rate limiter waits. A summary is added to the job progress at
+# the end and, when API_TRACE_DIR is set, every call is written there as JSON.
+API_TRACE_ENABLED = False
+API_TRACE_DIR = ''
+THROTTLE_ERROR_CODES = ['Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException',
+                        'RequestThrottled', 'SlowDown']
+# END AWS client pool constants
 
 RESOURCE_IDENTIFIER = 'ebs_volume_id'
 
+# Discovery returns only the volumes that are new, changed or gone since the
+# last sync. Set to True to return every volume, e.g. after editing resources
+# by hand.
+FORCE_FULL_RESYNC = False
+
+# Fingerprint stored on a volume that has been reported as gone, so it is
+# reported only once
+VANISHED_FINGERPRINT = 'vanished'
+
+# Custom fields used by the AWS EBS blueprints, created on first use
+CUSTOM_FIELDS = [
+    {'name': 'aws_rh_id', 'type': 'STR', 'label': 'AWS RH ID', 'description': 'Used by the AWS blueprints'},
+    {'name': 'aws_region', 'type': 'STR', 'label': 'AWS Region', 'description': 'Used by the AWS blueprints', 'show_as_attribute': True, 'show_on_servers': True},
+    {'name': 'ebs_volume_id', 'type': 'STR', 'label': 'AWS Volume ID', 'description': 'Used by the AWS blueprints', 'show_as_attribute': True},
+    {'name': 'ebs_volume_size', 'type': 'INT', 'label': 'Volume Size (GB)', 'description': 'Used by the AWS blueprints', 'show_as_attribute': True},
+    {'name': 'volume_encrypted', 'type': 'BOOL', 'label': 'Encrypted', 'description': 'Whether this volume is encrypted or not', 'show_as_attribute': True},
+    {'name': 'volume_state', 'type': 'STR', 'label': 'Volume status', 'description': 'Current state of the volume.', 'show_as_attribute': True},
+    {'name': 'instance_id', 'type': 'STR', 'label': 'Instance attached to', 'description': 'The instance this volume is attached to', 'show_as_attribute': True},
+    {'name': 'device_name', 'type': 'STR', 'label': 'Device name', 'description': 'The name of the device this volume is attached to', 'show_as_attribute': True},
+    {'name': 'discovery_fingerprint', 'type': 'STR', 'label': 'Discovery Fingerprint', 'description': 'Used by the AWS blueprints'},
+]
+
+# Values that must outlive a job are kept in a module registered under this
+# name, shared by the CloudBolt plug-ins of this worker process
+PROCESS_STATE_MODULE = 'cloudbolt_plugin_process_state_v1'
+
+# Names of the custom fields known to exist, kept in the process state so later
+# jobs skip the custom field setup entirely
+ENSURED_CUSTOM_FIELDS_STATE = 'aws_ebs_discovery.ensured_custom_fields'
+
+# BEGIN AWS client pool, synced from "Shared Plug-in Code/aws_client_pool.py"
+class APITrace(object):
+    """
+    The API calls made during one job: per operation and region counts,
+    time, retries, throttles and a latency histogram, plus every single call
+    when the trace is written to a file.
+    """
+    # upper bounds, in seconds, of the latency histogram buckets
+    HISTOGRAM_BOUNDS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+    def __init__(self, name, keep_calls=False):
+        self.name = name
+        self.started = time.time()
+        self.elapsed_started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.operations = {}
+        self.calls = [] if keep_calls else None
+
+    def record(self, operation, location, duration, retries=0, throttles=0, waited=0, error=None):
+        with self.lock:
+            stats = self.operations.get((operation, location))
+            if stats is None:
+                stats = self.operations[(operation, location)] = dict(
+                    calls=0, seconds=0, max_seconds=0, retries=0, throttles=0, errors=0, waited_seconds=0,
+                    histogram=[0] * (len(self.HISTOGRAM_BOUNDS) + 1))
+            stats['calls'] += 1
+            stats['seconds'] += duration
+            stats['max_seconds'] = max(stats['max_seconds'], duration)
+            stats['retries'] += retries
+            stats['throttles'] += throttles
+            stats['errors'] += 1 if error else 0
+            stats['waited_seconds'] += waited
+            stats['histogram'][bisect.bisect_left(self.HISTOGRAM_BOUNDS, duration)] += 1
+
+            if self.calls is not None:
+                self.calls.append(dict(at=round(time.time() - self.started, 4), operation=operation,
+                                       location=location, seconds=round(duration, 4), retries=retries,
+                                       throttles=throttles, waited_seconds=round(waited, 4), error=error))
+
+    def percentile(self, histogram, fraction):
+        """
+        Return the upper bound of the histogram bucket holding the given
+        fraction of the calls, or None when it is past the last bound.
+        """
+        target, seen = fraction * sum(histogram), 0
+        for bound, count in zip(self.HISTOGRAM_BOUNDS, histogram):
+            seen += count
+            if seen >= target:
+                return bound
+        return None
+
+    def summary(self, max_operations=10):
+        """
+        Return a few lines describing the trace, slowest operations first.
+        """
+        operations = sorted(self.operations.items(), key=lambda item: -item[1]['seconds'])
+        totals = {key: sum(stats[key] for _, stats in operations)
+                  for key in ['calls', 'seconds', 'retries', 'throttles', 'errors', 'waited_seconds']}
+
+        lines = ['{0}: {1} API call(s) taking {2:.1f}s{3}, {4} retries, {5} throttled, {6} failed, '
+                 'in {7:.1f}s elapsed'.format(
+                     self.name, totals['calls'], totals['seconds'],
+                     ', {0:.1f}s waiting on the rate limiter'.format(totals['waited_seconds'])
+                     if totals['waited_seconds'] else '',
+                     totals['retries'], totals['throttles'], totals['errors'],
+                     time.perf_counter() - self.elapsed_started)]
+
+        for (operation, location), stats in operations[:max_operations]:
+            p95 = self.percentile(stats['histogram'], 0.95)
+            lines.append('  {0} ({1}): {2} call(s), {3:.2f}s, avg {4:.0f}ms, p95 {5}, max {6:.0f}ms{7}{8}'.format(
+                operation, location, stats['calls'], stats['seconds'], stats['seconds'] / stats['calls'] * 1000,
+                '<{0:g}ms'.format(p95 * 1000) if p95 is not None else '>10s', stats['max_seconds'] * 1000,
+                ', {0} retries'.format(stats['retries']) if stats['retries'] else '',
+                ', {0} throttled'.format(stats['throttles']) if stats['throttles'] else ''))
+
+        return lines
+
+    def write(self, directory):
+        """
+        Write the whole trace as JSON to a new file in directory and return its path.
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, '{0}-{1}-{2}.json'.format(
+            re.sub(r'[^\w.-]+', '_', self.name), time.strftime('%Y%m%d%H%M%S', time.localtime(self.started)),
+            os.getpid()))
+
+        with open(path, 'w') as trace_file:
+            json.dump({
+                'name': self.name,
+                'started': self.started,
+                'elapsed_seconds': time.perf_counter() - self.elapsed_started,
+                'histogram_bounds': self.HISTOGRAM_BOUNDS,
+                'operations': [dict(stats, operation=operation, location=location)
+                               for (operation, location), stats in sorted(self.operations.items())],
+                'calls': self.calls or [],
+            }, trace_file)
+
+        return path
+
+
+class APITracer(object):
+    """
+    Routes API call timings to the traces of the jobs running in this process.
+
+    A call made by a thread that started a trace goes to that trace. Calls from
+    other threads, such as a job's worker pool, go to every active trace.
+    Without an active trace, recording costs one attribute check.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = []
+        self.local = threading.local()
+
+    def start(self, name, keep_calls=False):
+        trace = APITrace(name, keep_calls)
+        with self.lock:
+            self.active = self.active + [trace]
+        self.local.trace = trace
+        return trace
+
+    def finish(self, trace):
+        with self.lock:
+            self.active = [active for active in self.active if active is not trace]
+        if getattr(self.local, 'trace', None) is trace:
+            self.local.trace = None
+
+    def record(self, *args, **kwargs):
+        if not self.active:
+            return
+        trace = getattr(self.local, 'trace', None)
+        for trace in [trace] if trace is not None else self.active:
+            trace.record(*args, **kwargs)
+
+
+def register_trace_hooks(tracer, client, region, service_name):
+    """
+    Time every API call of a boto3 client into the tracer's active traces.
+    Retries and throttles are counted from botocore's needs-retry checks.
+    """
+    def before_call(model, context, **kwargs):
+        if tracer.active:
+            context['trace_operation'] = '{0}.{1}'.format(service_name, model.name)
+            context['trace_started'] = time.perf_counter()
+
+    def after_call(context, parsed=None, exception=None, **kwargs):
+        started = context.pop('trace_started', None)
+        if started is None:
+            return
+        parsed = parsed or {}
+        error = parsed.get('Error', {}).get('Code') or (exception is not None and type(exception).__name__) or None
+        tracer.record(context['trace_operation'], region, time.perf_counter() - started,
+                      retries=parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0),
+                      throttles=context.pop('trace_throttles', 0), waited=context.get('rate_limit_wait', 0),
+                      error=error)
+
+    def needs_retry(response=None, request_dict=None, **kwargs):
+        if response is None or request_dict is None or 'trace_started' not in request_dict.get('context', {}):
+            return
+        if response[1].get('Error', {}).get('Code') in THROTTLE_ERROR_CODES:
+            context = request_dict['context']
+            context['trace_throttles'] = context.get('trace_throttles', 0) + 1
+
+    client.meta.events.register('before-call', before_call)
+    client.meta.events.register('after-call', after_call)
+    client.meta.events.register('after-call-error', after_call)
+    client.meta.events.register('needs-retry', needs_retry)
+
+
+
+class AWSRateLimiter(object):
+    """
+    Token buckets shared between processes through files under RATE_LIMIT_DIR.
+
+    Each bucket file holds the token count and the time it was last updated;
+    a caller refills it for the time elapsed, takes a token if one is free and
+    otherwise sleeps for as long as the next token takes to arrive.
+    """
+    def __init__(self, directory=RATE_LIMIT_DIR):
+        self.directory = directory
+        self.local = threading.local()
+
+    @contextmanager
+    def interactive(self):
+        """
+        Run the calls made by this thread inside the block in the priority lane.
+        """
+        previous = getattr(self.local, 'interactive', False)
+        self.local.interactive = True
+        try:
+            yield
+        finally:
+            self.local.interactive = previous
+
+    def take(self, path, rate, burst, reserve):
+        """
+        Take one token from the bucket at path. Returns 0, or the seconds to
+        wait before trying again when the bucket is empty.
+        """
+        with open(path, 'a+') as bucket:
+            # the lock is released when the file is closed
+            fcntl.flock(bucket, fcntl.LOCK_EX)
+            bucket.seek(0)
+            state = bucket.read().split()
+            now = time.time()
+
+            tokens = burst
+            if len(state) == 2:
+                tokens = min(burst, float(state[0]) + max(now - float(state[1]), 0) * rate)
+
+            wait = 0
+            if tokens >= reserve + 1:
+                tokens -= 1
+            else:
+                wait = (reserve + 1 - tokens) / rate
+
+            bucket.seek(0)
+            bucket.truncate()
+            bucket.write('{0} {1}'.format(tokens, now))
+
+        return wait
+
+    def acquire(self, handler_id, region, service_name, operation_name):
+        """
+        Wait for a token and return the seconds spent waiting.
+        """
+        family = 'read' if operation_name.startswith(RATE_LIMIT_READ_PREFIXES) else 'write'
+        rate, burst = RATE_LIMITS[family]
+        reserve = 0 if getattr(self.local, 'interactive', False) else min(RATE_LIMIT_INTERACTIVE_RESERVE, burst - 1)
+        path = os.path.join(self.directory, '{0}-{1}-{2}-{3}'.format(handler_id, region, service_name, family))
+
+        waited = 0
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            wait = self.take(path, rate, burst, reserve)
+            while wait:
+                time.sleep(wait)
+                waited += wait
+                wait = self.take(path, rate, burst, reserve)
+        except OSError as err:
+            # never fail an AWS call because the buckets cannot be read
+            logger.warning('AWS rate limiter unavailable, not limiting {0}: {1}'.format(path, err))
+
+        return waited
+
+    def register(self, client, handler_id, region, service_name):
+        """
+        Make every API call of a boto3 client wait for a token first.
+        """
+        def before_call(model, context, **kwargs):
+            context['rate_limit_wait'] = self.acquire(handler_id, region, service_name, model.name)
+
+        client.meta.events.register('before-call', before_call)
+
+
+class AWSClientPool(object):
+    """
+    Process-wide LRU pool of boto3 clients and resources.
+
+    Entries are keyed by (handler id, credentials version, region, service,
+    kind). Clients are thread safe and shared by every thread; resources are
+    not, so they are also keyed by thread. Changing a handler's credentials
+    changes its version, which drops every entry built with the old ones.
+    """
+    def __init__(self, max_size=CLIENT_POOL_MAX_SIZE):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.build_locks = {}
+        self.versions = {}
+        self.limiter = AWSRateLimiter()
+        self.tracer = APITracer()
+
+    @staticmethod
+    def get_credentials_version(handler):
+        credentials = '{0}:{1}'.format(handler.serviceaccount, handler.servicepasswd)
+        return hashlib.sha1(credentials.encode('utf-8')).hexdigest()[:16]
+
+    def get_build_lock(self, handler, version):
+        """
+        Return the lock serializing builds for one handler and credentials
+        version. Must be called with self.lock held.
+        """
+        if self.versions.get(handler.id) != version:
+            # the credentials were rotated, forget everything built with the old ones
+            for key in [key for key in self.entries if key[0] == handler.id]:
+                del self.entries[key]
+            self.build_locks.pop((handler.id, self.versions.get(handler.id)), None)
+            self.versions[handler.id] = version
+
+        return self.build_locks.setdefault((handler.id, version), threading.Lock())
+
+    @staticmethod
+    def build(handler, region, service_name, kind):
+        """
+        Build a client or resource with the handler's own boto3 factories, which
+        apply its IAM role, proxy and partition endpoint settings.
+        """
+        if kind == 'resource':
+            return handler.get_api_wrapper().get_boto3_resource(
+                handler.serviceaccount, handler.servicepasswd, region, service_name)
+        return handler.get_boto3_client(region, service_name)
+
+    def get(self, handler, region, service_name, kind='client'):
+        version = self.get_credentials_version(handler)
+        key = (handler.id, version, region, service_name, kind)
+        if kind == 'resource':
+            key += (threading.get_ident(),)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry
+            build_lock = self.get_build_lock(handler, version)
+
+        # boto3 sessions are not thread safe, build one client at a time per handler
+        with build_lock:
+            entry = self.build(handler, region, service_name, kind)
+            client = entry.meta.client if kind == 'resource' else entry
+            self.limiter.register(client, handler.id, region, service_name)
+            register_trace_hooks(self.tracer, client, region, service_name)
+
+        with self.lock:
+            entry = self.entries.setdefault(key, entry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+        return entry
+
+
+def get_client_pool():
+    """
+    Return the AWS client pool shared by every AWS plug-in in this process.
+    Plug-ins are loaded as separate modules, so the pool is registered under a
+    well-known module name that the first plug-in to run creates.
+    """
+    module = sys.modules.get(CLIENT_POOL_MODULE)
+    if module is None:
+        module = types.ModuleType(CLIENT_POOL_MODULE)
+        module.pool = AWSClientPool()
+        # setdefault is atomic, if two plug-ins race only one pool survives
+        module = sys.modules.setdefault(CLIENT_POOL_MODULE, module)
+
+    return module.pool
+
+
+def get_aws_client(handler, region, service_name):
+    """
+    Return a pooled boto3 client for the handler's credentials in region.
+    """
+    return get_client_pool().get(handler, region, service_name, 'client')
+
+
+def get_aws_resource(handler, region, service_name):
+    """
+    Return a pooled boto3 resource, private to the calling thread, for the
+    handler's credentials in region.
+    """
+    return get_client_pool().get(handler, region, service_name, 'resource')
+
+
+def interactive_aws_calls():
+    """
+    Put the AWS calls made inside the block, or the decorated function, in the
+    rate limiter's priority lane so order forms do not wait on background jobs.
+    """
+    return get_client_pool().limiter.interactive()
+
+
+def trace_api_calls(function):
+    """
+    When API_TRACE_ENABLED is set, trace the AWS calls made while function
+    runs and report them when it returns. Generator functions, such as
+    discover_resources, are traced until they are exhausted.
+    """
+    def start():
+        return get_client_pool().tracer.start('{0}.{1}'.format(function.__module__, function.__name__),
+                                keep_calls=bool(API_TRACE_DIR))
+
+    def finish(trace):
+        get_client_pool().tracer.finish(trace)
+        for line in trace.summary():
+            set_progress(line)
+        if API_TRACE_DIR:
+            try:
+                set_progress('API trace written to {0}'.format(trace.write(API_TRACE_DIR)))
+            except OSError as err:
+                set_progress('Could not write the API trace: {0}'.format(err))
+
+    if inspect.isgeneratorfunction(function):
+        @wraps(function)
+        def traced_generator(*args, **kwargs):
+            if not API_TRACE_ENABLED:
+                return (yield from function(*args, **kwargs))
+            trace = start()
+            try:
+                return (yield from function(*args, **kwargs))
+            finally:
+                finish(trace)
+
+        return traced_generator
+
+    @wraps(function)
+    def traced(*args, **kwargs):
+        if not API_TRACE_ENABLED:
+            return function(*args, **kwargs)
+        trace = start()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            finish(trace)
+
+    return traced
+# END AWS client pool
+
+
+def get_process_state(key, default_factory):
+    """
+    Return the value kept under key for the life of this worker process,
+    creating it with default_factory() on first use. CloudBolt executes the
+    plug-in afresh for every job, so module globals are lost between jobs;
+    the state lives in a module registered under PROCESS_STATE_MODULE instead.
+    """
+    module = sys.modules.get(PROCESS_STATE_MODULE)
+    if module is None:
+        # setdefault is atomic, if two plug-ins race only one module survives
+        module = sys.modules.setdefault(PROCESS_STATE_MODULE, types.ModuleType(PROCESS_STATE_MODULE))
+
+    state = module.__dict__
+    if key not in state:
+        state.setdefault(key, default_factory())
+    return state[key]
+
+
 def create_custom_fields():
     """
     create custom fields
+
+    Fields that already exist are found with one query and the rest are
+    created with one bulk insert. aws_region predates show_on_servers, so an
+    existing one is switched on here.
     """
-    CustomField.objects.get_or_create(
-        name='aws_rh_id', type='STR',
-        defaults={'label':'AWS RH ID', 'description':'Used by the AWS blueprints'}
-    )
-    aws_region, _ = CustomField.objects.get_or_create(
-        name='aws_region', type='STR',
-        defaults={'label':'AWS Region', 'description':'Used by the AWS blueprints', 'show_as_attribute':True, 'show_on_servers':True}
-    )
-    if aws_region.show_on_servers == False:
-        aws_region.show_on_servers = True
-        aws_region.show_as_attribute = True
-        aws_region.save()
-    CustomField.objects.get_or_create(
-        name='ebs_volume_id', type='STR',
-        defaults={'label':'AWS Volume ID', 'description':'Used by the AWS blueprints', 'show_as_attribute':True}
-    )
-    CustomField.objects.get_or_create(
-        name='ebs_volume_size', type='INT',
-        defaults={'label':'Volume Size (GB)', 'description':'Used by the AWS blueprints', 'show_as_attribute':True}
-    )
-    CustomField.objects.get_or_create(
-        name='volume_encrypted', type='BOOL',
-        defaults={'label':'Encrypted', 'description':'Whether this volume is encrypted or not', 'show_as_attribute':True}
-    )
-    CustomField.objects.get_or_create(
-        name='volume_state', type='STR',
-        defaults={'label': 'Volume status', 'description': 'Current state of the volume.',
-                  'show_as_attribute': True}
-    )
-    CustomField.objects.get_or_create(
-        name='instance_id', type='STR',
-        defaults={'label': 'Instance attached to', 'description': 'The instance this volume is attached to',
-                  'show_as_attribute': True}
-    )
-    CustomField.objects.get_or_create(
-        name='device_name', type='STR',
-        defaults={'label': 'Device name', 'description': 'The name of the device this volume is attached to',
-                  'show_as_attribute': True}
+    ensured = get_process_state(ENSURED_CUSTOM_FIELDS_STATE, set)
+    missing = [field for field in CUSTOM_FIELDS if field['name'] not in ensured]
+    if not missing:
+        return
+
+    existing = {field.name: field for field in CustomField.objects.filter(name__in=[field['name'] for field in missing])}
+
+    # ignore_conflicts lets concurrent jobs race on the same new field safely
+    CustomField.objects.bulk_create(
+        [CustomField(**field) for field in missing if field['name'] not in existing],
+        ignore_conflicts=True,
     )
 
+    aws_region = existing.get('aws_region')
+    if aws_region and aws_region.show_on_servers == False:
+        CustomField.objects.filter(id=aws_region.id).update(show_on_servers=True, show_as_attribute=True)
+
+    ensured.update(field['name'] for field in missing)
+
+class DiscoveredVolume(Mapping):
+    """
+    Read-only dict-like record of one discovered volume.
+
+    Slots replace the per-record dict, and values that repeat across the
+    estate (region, state, device name) are interned, so a large sweep holds
+    one copy of each instead of one per volume.
+    """
+    __slots__ = ('name', 'ebs_volume_id', 'aws_rh_id', 'aws_region', 'volume_state', 'ebs_volume_size',
+                 'volume_encrypted', 'instance_id', 'device_name', 'discovery_fingerprint')
+
+    INTERNED = frozenset(['aws_region', 'volume_state', 'device_name'])
+
+    def __init__(self, **values):
+        for key, value in values.items():
+            if key in self.INTERNED and isinstance(value, str):
+                value = sys.intern(value)
+            setattr(self, key, value)
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __iter__(self):
+        return (key for key in self.__slots__ if hasattr(self, key))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({dict(self)!r})'
+
 def get_boto3_service_resource(rh, aws_region, service_name="ec2"):
     """
     Return boto connection to the EC2 in the specified environment's region.
     """
  
-    # get aws wrapper object
-    wrapper = rh.get_api_wrapper()
-
     # get aws client object
-    client = wrapper.get_boto3_resource(rh.serviceaccount, rh.servicepasswd, aws_region, service_name)
+    client = get_aws_resource(rh, aws_region, service_name)
     
     return client
 
+def get_fingerprint(record):
+    """
+    Return a stable hash of a discovered volume dict.
+    """
+    return hashlib.sha1(json.dumps(record, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def get_stored_fingerprints():
+    """
+    Return the fingerprints stored by earlier syncs, keyed by
+    (aws_rh_id, aws_region, ebs_volume_id).
+    """
+    resources = Resource.objects.filter(
+        lifecycle='ACTIVE', attributes__field__name='discovery_fingerprint',
+    ).distinct().prefetch_related('attributes__field')
+
+    fingerprints = {}
+    for resource in resources:
+        values = {cfv.field.name: cfv.value for cfv in resource.attributes.all()}
+        if values.get('ebs_volume_id'):
+            key = (str(values.get('aws_rh_id')), values.get('aws_region'), values['ebs_volume_id'])
+            fingerprints[key] = values['discovery_fingerprint']
+
+    return fingerprints
+
+@trace_api_calls
 def discover_resources(**kwargs):
-    discovered_volumes = []
+    """
+    Yield the new, changed and vanished volumes region by region, so records
+    can be reconciled while later regions are still being swept.
+    """
     create_custom_fields()
+
+    # fingerprints of the volumes as they were last synced. Every volume found
+    # is removed, so what remains at the end has vanished.
+    stored = get_stored_fingerprints()
+    swept, discovered, unchanged = set(), 0, 0
+
     for handler in AWSHandler.objects.all():
         set_progress('Connecting to Amazon EC2 for handler: {}'.format(handler))
         for region in handler.current_regions():
             ec2 = get_boto3_service_resource(handler, region)
             try:
-                for volume in ec2.volumes.all():
-                    if len(volume.attachments) > 0:
-                        instance_id = volume.attachments[0].get('InstanceId')
-                        device_name = volume.attachments[0].get('Device')
-                    else:
-                        instance_id = "N/A"
-                        device_name = "N/A"
-
-                    discovered_volumes.append({
-                        'name': f"EBS Volume - {volume.volume_id}",
-                        'ebs_volume_id': volume.volume_id,
-                        "aws_rh_id": handler.id,
-                        "aws_region": region,
-                        "volume_state": volume.state,
-                        "ebs_volume_size": volume.size,
-                        "volume_encrypted": volume.encrypted,
-                        "instance_id": instance_id,
-                        "device_name": device_name,
-                    })
-
-            except Exception as e:
+                # the collection pages through describe_volumes lazily, so read the region up front
+                volumes = list(ec2.volumes.all())
+            except (ClientError, BotoCoreError) as e:
                 set_progress('AWS ClientError: {}'.format(e))
                 continue
 
-    return discovered_volumes
\ No newline at end of file
+            for volume in volumes:
+                if len(volume.attachments) > 0:
+                    instance_id = volume.attachments[0].get('InstanceId')
+                    device_name = volume.attachments[0].get('Device')
+                else:
+                    instance_id = "N/A"
+                    device_name = "N/A"
+
+                record = {
+                    'name': f"EBS Volume - {volume.volume_id}",
+                    'ebs_volume_id': volume.volume_id,
+                    "aws_rh_id": handler.id,
+                    "aws_region": region,
+                    "volume_state": volume.state,
+                    "ebs_volume_size": volume.size,
+                    "volume_encrypted": volume.encrypted,
+                    "instance_id": instance_id,
+                    "device_name": device_name,
+                }
+                key = (str(handler.id), region, volume.volume_id)
+
+                fingerprint = get_fingerprint(record)
+                if stored.pop(key, None) == fingerprint and not FORCE_FULL_RESYNC:
+                    unchanged += 1
+                    continue
+
+                discovered += 1
+                yield DiscoveredVolume(discovery_fingerprint=fingerprint, **record)
+
+            swept.add((str(handler.id), region))
+
+    # volumes synced before but missing from a complete sweep of their region
+    for (rh_id, region, volume_id), fingerprint in sorted(stored.items()):
+        if (rh_id, region) in swept and fingerprint != VANISHED_FINGERPRINT:
+            discovered += 1
+            yield DiscoveredVolume(
+                name=f"EBS Volume - {volume_id}",
+                ebs_volume_id=volume_id,
+                aws_rh_id=rh_id,
+                aws_region=region,
+                volume_state='deleted',
+                discovery_fingerprint=VANISHED_FINGERPRINT,
+            )
+
+    set_progress('Discovered {} new, changed or deleted volume(s), {} unchanged.'.format(discovered, unchanged))
\ No newline at end of file
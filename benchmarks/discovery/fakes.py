@@ -0,0 +1,368 @@
+"""
+Generated cloud inventories and the stub boto3/googleapiclient objects that
+serve them to the discovery plug-ins.
+
+Inventories are never held in memory: every page is generated on demand from
+the estate size, region/project count and a seed, so the benchmark process
+itself stays small and the plug-in dominates the measured peak RSS. Every stub
+call sleeps for the configured latency and is counted by operation name.
+"""
+import random
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+RDS_ENGINES = ['mysql', 'postgres']
+RDS_PAGE_SIZE = 100
+EC2_PAGE_SIZE = 500
+GCE_PAGE_SIZE = 500
+
+ZONE_SUFFIXES = ['a', 'b', 'c']
+GCP_ZONES = ['us-central1-a', 'us-central1-b', 'us-east1-b', 'europe-west1-c', 'asia-east1-a']
+GKE_NODES_PER_CLUSTER = 10
+
+AWS_REGIONS = [
+    'us-east-1', 'us-east-2', 'us-west-1', 'us-west-2', 'ca-central-1', 'sa-east-1', 'eu-west-1', 'eu-west-2',
+    'eu-west-3', 'eu-central-1', 'eu-central-2', 'eu-north-1', 'eu-south-1', 'eu-south-2', 'ap-south-1',
+    'ap-south-2', 'ap-northeast-1', 'ap-northeast-2', 'ap-northeast-3', 'ap-southeast-1', 'ap-southeast-2',
+    'ap-southeast-3', 'ap-southeast-4', 'ap-east-1', 'me-south-1', 'me-central-1', 'af-south-1', 'il-central-1',
+    'us-gov-east-1', 'us-gov-west-1',
+]
+
+
+class CallCounter(object):
+    """
+    Thread-safe count of the stubbed API calls, with the simulated latency.
+    """
+    def __init__(self, latency):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = Counter()
+
+    def call(self, operation):
+        with self.lock:
+            self.calls[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+
+def split_evenly(total, parts):
+    """
+    Return the sizes of parts slices of total, the first ones one larger.
+    """
+    return [total // parts + (1 if index < total % parts else 0) for index in range(parts)]
+
+
+class Estate(object):
+    """
+    A generated estate of size items spread evenly over a number of
+    regions (AWS) or projects (GCP).
+    """
+    def __init__(self, size, locations, seed=0):
+        if locations > len(AWS_REGIONS):
+            raise ValueError('at most {0} regions are supported'.format(len(AWS_REGIONS)))
+        self.size = size
+        self.seed = seed
+        self.regions = AWS_REGIONS[:locations]
+        self.projects = ['bench-project-{0:02d}'.format(index) for index in range(locations)]
+        self.counts = split_evenly(size, locations)
+
+    def rng(self, *key):
+        return random.Random('{0}:{1}'.format(self.seed, ':'.join(str(part) for part in key)))
+
+    def region_count(self, region):
+        return self.counts[self.regions.index(region)] if region in self.regions else 0
+
+    def db_instance(self, region, index):
+        rng = self.rng('rds', region, index)
+        identifier = 'bench-db-{0}-{1:06d}'.format(region, index)
+        zone = region + rng.choice(ZONE_SUFFIXES)
+        subnet_group = 'bench-subnets-{0}'.format(rng.randrange(4))
+        return {
+            'DBInstanceIdentifier': identifier,
+            'Engine': RDS_ENGINES[index % len(RDS_ENGINES)],
+            'DBInstanceStatus': 'available' if rng.random() > 0.05 else 'stopped',
+            'MasterUsername': 'admin',
+            'PubliclyAccessible': rng.random() > 0.8,
+            'AvailabilityZone': zone,
+            'Endpoint': {'Address': '{0}.bench.{1}.rds.amazonaws.com'.format(identifier, region), 'Port': 3306},
+            'DBSubnetGroup': {
+                'DBSubnetGroupName': subnet_group,
+                'Subnets': [{'SubnetIdentifier': 'subnet-{0}{1}'.format(subnet_group[-1], suffix)}
+                            for suffix in ZONE_SUFFIXES],
+            },
+        }
+
+    def volume(self, region, index):
+        rng = self.rng('ebs', region, index)
+        attachments = []
+        if rng.random() > 0.3:
+            attachments = [{'InstanceId': 'i-{0:017x}'.format(rng.getrandbits(64)),
+                            'Device': rng.choice(['/dev/xvda', '/dev/sdf', '/dev/sdg'])}]
+        return SimpleNamespace(
+            volume_id='vol-{0:017x}'.format(rng.getrandbits(64)),
+            attachments=attachments,
+            state='in-use' if attachments else 'available',
+            size=rng.choice([8, 20, 100, 500]),
+            encrypted=rng.random() > 0.5,
+        )
+
+    def project_clusters(self, project):
+        """
+        Return the clusters of one project, GKE_NODES_PER_CLUSTER nodes each.
+        """
+        nodes = self.counts[self.projects.index(project)] if project in self.projects else 0
+        clusters = []
+        for index, node_count in enumerate(split_evenly(nodes, max(1, -(-nodes // GKE_NODES_PER_CLUSTER)))):
+            rng = self.rng('gke', project, index)
+            zone = rng.choice(GCP_ZONES)
+            clusters.append({
+                'name': 'bench-cluster-{0:05d}'.format(index),
+                'zone': zone,
+                'location': zone,
+                'createTime': '2024-01-01T00:00:00+00:00',
+                'initialClusterVersion': '1.29.1-gke.1589000',
+                'currentNodeCount': node_count,
+                'endpoint': '10.{0}.{1}.{2}'.format(rng.randrange(256), rng.randrange(256), rng.randrange(256)),
+                'status': 'RUNNING',
+            })
+        return clusters
+
+    def cluster_nodes(self, project, cluster):
+        rng = self.rng('gke', project, cluster['name'])
+        return [{
+            'id': str(rng.getrandbits(63)),
+            'name': 'gke-{0}-default-pool-{1:08x}-{2:04d}'.format(cluster['name'], rng.getrandbits(32), index),
+            'zone': cluster['zone'],
+            'status': 'RUNNING',
+            'labels': {'goog-k8s-cluster-name': cluster['name'], 'goog-k8s-node-pool-name': 'default-pool'},
+        } for index in range(cluster['currentNodeCount'])]
+
+
+class FakePaginator(object):
+    def __init__(self, pages):
+        self.pages = pages
+
+    def paginate(self, **kwargs):
+        return self.pages(**kwargs)
+
+
+class FakeRDSClient(object):
+    """
+    Serves describe_db_instances, filtered on engine and db-instance-id.
+    """
+    def __init__(self, estate, region, counter):
+        self.estate = estate
+        self.region = region
+        self.counter = counter
+
+    def get_paginator(self, operation_name):
+        return FakePaginator(getattr(self, 'paginate_' + operation_name))
+
+    def paginate_describe_db_instances(self, Filters=(), **kwargs):
+        filters = {item['Name']: set(item['Values']) for item in Filters}
+        count = self.estate.region_count(self.region)
+
+        for start in range(0, max(count, 1), RDS_PAGE_SIZE):
+            self.counter.call('rds.DescribeDBInstances')
+            db_instances = [self.estate.db_instance(self.region, index)
+                            for index in range(start, min(start + RDS_PAGE_SIZE, count))]
+            yield {'DBInstances': [db_instance for db_instance in db_instances
+                                   if db_instance['Engine'] in filters.get('engine', [db_instance['Engine']])
+                                   and db_instance['DBInstanceIdentifier'] in filters.get(
+                                       'db-instance-id', [db_instance['DBInstanceIdentifier']])]}
+
+    def describe_db_instances(self, **kwargs):
+        return {'DBInstances': [db for page in self.paginate_describe_db_instances(**kwargs)
+                                for db in page['DBInstances']]}
+
+
+class FakeVolumeCollection(object):
+    def __init__(self, estate, region, counter):
+        self.estate = estate
+        self.region = region
+        self.counter = counter
+
+    def all(self):
+        count = self.estate.region_count(self.region)
+        for start in range(0, max(count, 1), EC2_PAGE_SIZE):
+            self.counter.call('ec2.DescribeVolumes')
+            for index in range(start, min(start + EC2_PAGE_SIZE, count)):
+                yield self.estate.volume(self.region, index)
+
+
+class FakeEC2Resource(object):
+    def __init__(self, estate, region, counter):
+        self.volumes = FakeVolumeCollection(estate, region, counter)
+
+
+class FakeRequest(object):
+    def __init__(self, counter, operation, response):
+        self.counter = counter
+        self.operation = operation
+        self.response = response
+
+    def execute(self, **kwargs):
+        self.counter.call(self.operation)
+        return self.response()
+
+
+class FakeGKEClusters(object):
+    def __init__(self, estate, counter):
+        self.estate = estate
+        self.counter = counter
+
+    def list(self, projectId=None, zone=None, parent=None, **kwargs):
+        project = projectId or parent.split('/')[1]
+        return FakeRequest(self.counter, 'container.clusters.list',
+                           lambda: {'clusters': self.estate.project_clusters(project)})
+
+
+class FakeContainerService(object):
+    """
+    Serves projects().zones().clusters().list and projects().locations().clusters().list.
+    """
+    def __init__(self, estate, counter):
+        self.clusters_api = FakeGKEClusters(estate, counter)
+
+    def projects(self):
+        return self
+
+    def zones(self):
+        return self
+
+    def locations(self):
+        return self
+
+    def clusters(self):
+        return self.clusters_api
+
+
+class FakeGCEInstances(object):
+    """
+    Serves instances().list for one zone and instances().aggregatedList for a
+    whole project. Filters on the node name prefix or the cluster name label.
+    """
+    def __init__(self, estate, counter):
+        self.estate = estate
+        self.counter = counter
+
+    @staticmethod
+    def matches(node, filter):
+        if not filter:
+            return True
+        if filter.startswith('name:'):
+            return node['name'].startswith(filter[len('name:'):].rstrip('*'))
+        if 'goog-k8s-cluster-name' in filter:
+            return 'goog-k8s-cluster-name' in node['labels']
+        return True
+
+    def project_nodes(self, project, zone=None, filter=None):
+        for cluster in self.estate.project_clusters(project):
+            if zone and cluster['zone'] != zone:
+                continue
+            for node in self.estate.cluster_nodes(project, cluster):
+                if self.matches(node, filter):
+                    yield node
+
+    def list(self, project, zone, filter=None, **kwargs):
+        return FakeRequest(self.counter, 'compute.instances.list',
+                           lambda: {'items': list(self.project_nodes(project, zone, filter))})
+
+    def aggregatedList(self, project, filter=None, pageToken=None, **kwargs):
+        def response():
+            nodes = list(self.project_nodes(project, filter=filter))
+            start = int(pageToken or 0)
+            items = {}
+            for node in nodes[start:start + GCE_PAGE_SIZE]:
+                items.setdefault('zones/' + node['zone'], {'instances': []})['instances'].append(node)
+            page = {'items': items}
+            if start + GCE_PAGE_SIZE < len(nodes):
+                page['nextPageToken'] = str(start + GCE_PAGE_SIZE)
+            return page
+
+        request = FakeRequest(self.counter, 'compute.instances.aggregatedList', response)
+        request.arguments = dict(project=project, filter=filter, **kwargs)
+        return request
+
+    def aggregatedList_next(self, previous_request, previous_response):
+        if 'nextPageToken' not in previous_response:
+            return None
+        return self.aggregatedList(pageToken=previous_response['nextPageToken'], **previous_request.arguments)
+
+
+class FakeComputeService(object):
+    def __init__(self, estate, counter):
+        self.instances_api = FakeGCEInstances(estate, counter)
+
+    def instances(self):
+        return self.instances_api
+
+
+def fake_build(estate, counter):
+    """
+    Return a stand-in for googleapiclient.discovery.build serving the estate.
+    """
+    def build(service_name, version, **kwargs):
+        counter.call('discovery.build')
+        if service_name == 'container':
+            return FakeContainerService(estate, counter)
+        if service_name == 'compute':
+            return FakeComputeService(estate, counter)
+        raise ValueError('no fake for the {0} API'.format(service_name))
+
+    return build
+
+
+class FakeQuerySet(list):
+    """
+    Just enough of a queryset over in-memory objects for the plug-ins'
+    handler and environment lookups. Keyword filters compare attributes and
+    ignore lookups that cross relations.
+    """
+    def filter(self, **kwargs):
+        kwargs = {key: value for key, value in kwargs.items() if '__' not in key}
+        return FakeQuerySet(item for item in self
+                            if all(getattr(item, key, value) == value for key, value in kwargs.items()))
+
+    def exclude(self, **kwargs):
+        kept = self.filter(**kwargs)
+        return FakeQuerySet(item for item in self if item not in kept)
+
+    def get(self, **kwargs):
+        return self.filter(**kwargs)[0]
+
+    def first(self):
+        return self[0] if self else None
+
+    def all(self):
+        return self
+
+    def order_by(self, *fields):
+        return self
+
+    def select_related(self, *fields):
+        return self
+
+    def prefetch_related(self, *fields):
+        return self
+
+    def iterator(self, *args, **kwargs):
+        return iter(self)
+
+
+class FakeModel(object):
+    def __init__(self, objects):
+        self.objects = FakeQuerySet(objects)
+
+
+class FakeHandler(SimpleNamespace):
+    """
+    Stand-in resource handler, with the regions an AWS handler reports.
+    """
+    def current_regions(self):
+        return list(self.regions)
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,372 @@
+"""
+Benchmark the discover_resources() of the AWS MySQL, AWS PostgreSQL, AWS EBS
+and GKE discovery plug-ins against generated estates.
+
+The real plug-in code runs against the CloudBolt database, so the benchmark
+runs on a CloudBolt appliance (or a development install). Only the cloud side
+is stubbed: AWS handlers, boto3 clients and googleapiclient services are
+replaced by the fakes in fakes.py, which generate the inventory on demand and
+sleep for --latency seconds per API call. The GKE plug-in writes clusters and
+nodes as it discovers them, so each case runs in a transaction that is rolled
+back, and needs an existing GCP environment (--gcp-environment) for the
+generated nodes to point at.
+
+    python run_discovery_benchmark.py --sizes 1000 10000 --locations 1 30 --save-baseline baseline.json
+    python run_discovery_benchmark.py --sizes 1000 10000 --locations 1 30 --compare baseline.json
+
+Every case runs in its own process so that its peak RSS is its own. For each
+case the benchmark reports wall time, stubbed API calls, ORM queries and peak
+RSS. The AWS plug-ins skip records unchanged since the last sync, so they are
+measured twice: "cold" with nothing stored, and "warm" with the fingerprints
+of a cold pass stored. That cold pass runs in a process of its own and hands
+the fingerprints over in a file, so it does not count towards the warm peak.
+The RDS shared inventory snapshot is turned off so every case sweeps its
+regions.
+
+baseline.json next to this file holds the records and API calls of the AWS
+cases at the default sizes and locations, which are the same on every
+machine. Metrics missing from a baseline are not compared; save a baseline on
+the appliance to also compare wall time, ORM queries and peak RSS.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import fakes
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PLUGINS = {
+    'rds-mysql': {
+        'path': 'blueprints/AWS MySQL/Discovery Item Discover AWS MySQL/Discover AWS MySQL Script.py',
+        'cloud': 'aws',
+        'identifier': 'db_identifier',
+    },
+    'rds-postgresql': {
+        'path': 'blueprints/AWS PostgreSQL/Discovery Item Sync AWS PostgreSQL Database/'
+                'Sync AWS PostgreSQL Database Script.py',
+        'cloud': 'aws',
+        'identifier': 'db_identifier',
+    },
+    'ebs': {
+        'path': 'aws_ebs_storage/discovery_aws_ebs_storage_discovery_1/aws_ebs_storage_discovery_1/'
+                'cb_plugin_1656588976701382_QKkL9bh_eHQi6Eo.py',
+        'cloud': 'aws',
+        'identifier': 'ebs_volume_id',
+    },
+    'gke': {
+        'path': 'blueprints/Google Kubernetes Engine Cluster/Discovery Item sync gke cluster/'
+                'sync gke cluster Script.py',
+        'cloud': 'gcp',
+    },
+}
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_LOCATIONS = [1, 30]
+
+# Relative increase over the baseline reported as a regression, per metric.
+# API calls are deterministic for a given estate, so any increase counts.
+TOLERANCES = {
+    'wall_seconds': 0.20,
+    'api_calls': 0.0,
+    'orm_queries': 0.10,
+    'peak_rss_mb': 0.20,
+}
+
+# Fake AWS handler ids start here so they never match the fingerprints that
+# real handlers stored in the CloudBolt database
+FAKE_HANDLER_ID = 900000
+
+
+def setup_django(cloudbolt_home):
+    sys.path.insert(0, cloudbolt_home)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+
+    import django
+    django.setup()
+
+
+def install_query_counter(queries):
+    """
+    Count the ORM queries of every thread, including connections the plug-in
+    opens from worker threads after this is called.
+    """
+    from django.db import connections
+    from django.db.backends.signals import connection_created
+
+    lock = threading.Lock()
+
+    def count(execute, sql, params, many, context):
+        with lock:
+            queries[sql.split(None, 1)[0].upper()] += 1
+        return execute(sql, params, many, context)
+
+    def on_connection_created(sender, connection, **kwargs):
+        if count not in connection.execute_wrappers:
+            connection.execute_wrappers.append(count)
+
+    connection_created.connect(on_connection_created, weak=False)
+    for connection in connections.all():
+        on_connection_created(None, connection)
+
+
+def load_plugin(name):
+    path = os.path.join(REPO_ROOT, PLUGINS[name]['path'])
+    spec = importlib.util.spec_from_file_location('benchmark_' + name.replace('-', '_'), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def stub_aws(module, estate, counter):
+    handler = fakes.FakeHandler(id=FAKE_HANDLER_ID, name='Benchmark AWS', regions=estate.regions)
+    module.AWSHandler = fakes.FakeModel([handler])
+
+    def get_aws_client(handler, region, service_name):
+        if service_name != 'rds':
+            raise ValueError('no fake for the {0} client'.format(service_name))
+        return fakes.FakeRDSClient(estate, region, counter)
+
+    def get_aws_resource(handler, region, service_name):
+        if service_name != 'ec2':
+            raise ValueError('no fake for the {0} resource'.format(service_name))
+        return fakes.FakeEC2Resource(estate, region, counter)
+
+    module.get_aws_client = get_aws_client
+    module.get_aws_resource = get_aws_resource
+
+    # sweep every region rather than reading another run's snapshot
+    if hasattr(module, 'INVENTORY_SNAPSHOT_TTL'):
+        module.INVENTORY_SNAPSHOT_TTL = 0
+
+
+def stub_gcp(module, estate, counter, environment_id):
+    import copy
+    from infrastructure.models import Environment
+
+    # every generated project is served through a copy of one real environment
+    # so that the servers created for the nodes have valid foreign keys
+    environment = Environment.objects.select_related('resource_handler').get(id=environment_id)
+    environments = []
+    for project in estate.projects:
+        project_environment = copy.copy(environment)
+        project_environment.gcp_project = project
+        environments.append(project_environment)
+
+    handler = fakes.FakeHandler(
+        id=environment.resource_handler_id,
+        name='Benchmark GCP',
+        gcp_api_credentials='{}',
+        gcp_projects=fakes.FakeQuerySet(fakes.SimpleNamespace(id=project, gcp_id=project)
+                                        for project in estate.projects),
+    )
+
+    module.GCPHandler = fakes.FakeModel([handler])
+    module.Environment = fakes.FakeModel(environments)
+    module.build = fakes.fake_build(estate, counter)
+    module.Credentials = lambda **kwargs: object()
+
+
+def consume(module, identifier_field=None):
+    """
+    Run discover_resources and return how many records it produced and, when
+    identifier_field is given, their fingerprints keyed like the stored ones.
+    """
+    records = module.discover_resources()
+    fingerprints = {}
+    count = 0
+    for record in records or []:
+        count += 1
+        if identifier_field and record.get('discovery_fingerprint'):
+            key = (str(record['aws_rh_id']), record['aws_region'], record[identifier_field])
+            fingerprints[key] = record['discovery_fingerprint']
+    return count, fingerprints
+
+
+def run_case(case, options):
+    """
+    Run one case in this process and return its measurements.
+    """
+    setup_django(options.cloudbolt_home)
+    from django.db import transaction
+
+    plugin = PLUGINS[case['plugin']]
+    estate = fakes.Estate(case['size'], case['locations'], seed=options.seed)
+    counter = fakes.CallCounter(options.latency)
+    queries = Counter()
+
+    module = load_plugin(case['plugin'])
+    module.set_progress = lambda *args, **kwargs: None
+    if plugin['cloud'] == 'aws':
+        stub_aws(module, estate, counter)
+    else:
+        if options.gcp_environment is None:
+            raise SystemExit('--gcp-environment is required to benchmark the gke plug-in')
+        stub_gcp(module, estate, counter, options.gcp_environment)
+
+    with transaction.atomic():
+        if case['phase'] == 'seed':
+            # what a cold sync would have stored, for the warm case to read
+            _, stored = consume(module, plugin['identifier'])
+            transaction.set_rollback(True)
+            write_fingerprints(options.fingerprints, stored)
+            return {}
+        if case['phase'] == 'warm':
+            stored = read_fingerprints(options.fingerprints)
+            module.get_stored_fingerprints = lambda: dict(stored)
+
+        install_query_counter(queries)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        records, _ = consume(module)
+        wall_seconds = time.perf_counter() - started
+
+        transaction.set_rollback(True)
+
+    return dict(
+        case,
+        records=records,
+        wall_seconds=round(wall_seconds, 3),
+        api_calls=sum(counter.calls.values()),
+        api_calls_by_operation=dict(sorted(counter.calls.items())),
+        orm_queries=sum(queries.values()),
+        orm_queries_by_statement=dict(sorted(queries.items())),
+        # ru_maxrss is in KiB on Linux
+        peak_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        rss_before_mb=round(rss_before / 1024, 1),
+    )
+
+
+def write_fingerprints(path, fingerprints):
+    with open(path, 'w') as output:
+        json.dump([list(key) + [fingerprint] for key, fingerprint in fingerprints.items()], output)
+
+
+def read_fingerprints(path):
+    with open(path) as stored:
+        return {tuple(row[:-1]): row[-1] for row in json.load(stored)}
+
+
+def get_cases(options):
+    for plugin in options.plugins:
+        phases = ['cold', 'warm'] if PLUGINS[plugin]['cloud'] == 'aws' else ['cold']
+        for size in options.sizes:
+            for locations in options.locations:
+                for phase in phases:
+                    yield {'plugin': plugin, 'size': size, 'locations': locations, 'phase': phase}
+
+
+def case_key(case):
+    return '{plugin}/{size}/{locations}/{phase}'.format(**case)
+
+
+def spawn_case(case, argv):
+    """
+    Run one case in a child process and return its measurements. A warm case
+    is seeded by a cold pass in another child process first.
+    """
+    if case['phase'] != 'warm':
+        return run_child(case, argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        argv = argv + ['--fingerprints', os.path.join(directory, 'fingerprints.json')]
+        run_child(dict(case, phase='seed'), argv)
+        return run_child(case, argv)
+
+
+def run_child(case, argv):
+    command = [sys.executable, os.path.abspath(__file__), '--case', json.dumps(case)] + argv
+    output = subprocess.run(command, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def compare(results, baseline):
+    """
+    Return a line for every metric of every case that regressed past its
+    tolerance against the baseline.
+    """
+    previous = {case_key(case): case for case in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get(case_key(result))
+        if old is None:
+            continue
+        for metric, tolerance in TOLERANCES.items():
+            if metric not in old:
+                continue
+            if result[metric] > old[metric] * (1 + tolerance) and result[metric] - old[metric] > 0.001:
+                regressions.append('{0} {1}: {2} -> {3} (+{4:.0%}, tolerance {5:.0%})'.format(
+                    case_key(result), metric, old[metric], result[metric],
+                    (result[metric] - old[metric]) / old[metric] if old[metric] else 1, tolerance))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--plugins', nargs='+', choices=sorted(PLUGINS), default=sorted(PLUGINS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES,
+                        help='databases, volumes or GKE nodes in the estate')
+    parser.add_argument('--locations', nargs='+', type=int, default=DEFAULT_LOCATIONS,
+                        help='AWS regions or GCP projects the estate is spread over')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds each stubbed API call takes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--gcp-environment', type=int, help='id of the GCP environment the GKE nodes use')
+    parser.add_argument('--cloudbolt-home', default='/opt/cloudbolt')
+    parser.add_argument('--save-baseline', help='write the results to this file')
+    parser.add_argument('--compare', help='baseline file to check the results against')
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    parser.add_argument('--fingerprints', help=argparse.SUPPRESS)
+    options, _ = parser.parse_known_args()
+
+    if options.case:
+        print(json.dumps(run_case(json.loads(options.case), options)))
+        return 0
+
+    # children get the options that change what they measure
+    child_argv = ['--latency', str(options.latency), '--seed', str(options.seed),
+                  '--cloudbolt-home', options.cloudbolt_home]
+    if options.gcp_environment is not None:
+        child_argv += ['--gcp-environment', str(options.gcp_environment)]
+
+    results = []
+    for case in get_cases(options):
+        result = spawn_case(case, child_argv)
+        results.append(result)
+        print('{0:40} {1:>8} records {2:>9.2f}s {3:>7} API calls {4:>7} queries {5:>8.1f} MiB'.format(
+            case_key(result), result['records'], result['wall_seconds'], result['api_calls'],
+            result['orm_queries'], result['peak_rss_mb']))
+
+    if options.save_baseline:
+        with open(options.save_baseline, 'w') as baseline:
+            json.dump({
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'latency': options.latency,
+                'seed': options.seed,
+                'results': results,
+            }, baseline, indent=2, sort_keys=True)
+        print('Wrote baseline to {0}'.format(options.save_baseline))
+
+    if options.compare:
+        with open(options.compare) as baseline:
+            regressions = compare(results, json.load(baseline))
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            return 1
+        print('No regressions against {0}'.format(options.compare))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
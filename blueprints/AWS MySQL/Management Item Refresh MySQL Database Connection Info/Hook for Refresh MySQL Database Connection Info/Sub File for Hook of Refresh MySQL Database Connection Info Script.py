@@ -4,24 +4,676 @@ MySQL database Instance blueprint. Importing the blueprint from the CloudBolt Co
 Library will automatically import this action.
 """
 
+import bisect
+import fcntl
+import hashlib
+import inspect
+import json
+import operator
+import os
+import re
+import sys
+import threading
+import time
+import types
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+from functools import reduce, wraps
+
+from django.db.models import Q, prefetch_related_objects
+
+from botocore.exceptions import BotoCoreError, ClientError
 from common.methods import set_progress
-from infrastructure.models import Environment
+from infrastructure.models import CustomField, Environment
+from orders.models import CustomFieldValue
 from resourcehandlers.aws.models import AWSHandler
+from resources.models import Resource
 from utilities.logger import ThreadLogger
 
 logger = ThreadLogger(__name__)
 
+# BEGIN AWS client pool constants, synced from "Shared Plug-in Code/aws_client_pool.py"
+# boto3 clients and resources are shared by every AWS plug-in in this process.
+# They are built by the resource handler, so its IAM role, proxy and partition
+# settings apply, and the pool keeps at most CLIENT_POOL_MAX_SIZE of them,
+# evicting the least recently used. The first plug-in to run registers the pool
+# under CLIENT_POOL_MODULE and every later one uses it, so the version in the
+# name must be bumped whenever this section or the pool code changes.
+CLIENT_POOL_MODULE = 'cloudbolt_aws_client_pool_v4'
+CLIENT_POOL_MAX_SIZE = 256
+
+# Every AWS call made through the pool first takes a token from a bucket shared
+# by all CloudBolt worker processes on this host. There is one bucket per
+# handler, region, service and API family, stored in RATE_LIMIT_DIR and guarded
+# by a file lock. RATE_LIMITS gives the calls per second and burst size of each
+# family. Background calls leave RATE_LIMIT_INTERACTIVE_RESERVE tokens in the
+# bucket so order form calls, made in the priority lane, are not queued behind them.
+RATE_LIMIT_DIR = '/var/tmp/cloudbolt_aws_rate_limits'
+RATE_LIMITS = {'read': (10, 40), 'write': (2, 10)}
+RATE_LIMIT_INTERACTIVE_RESERVE = 5
+RATE_LIMIT_READ_PREFIXES = ('Describe', 'List', 'Get')
+
+# Set API_TRACE_ENABLED to time every AWS call made while run() or
+# discover_resources() executes, per operation and region, with retries,
+# throttles and rate limiter waits. A summary is added to the job progress at
+# the end and, when API_TRACE_DIR is set, every call is written there as JSON.
+API_TRACE_ENABLED = False
+API_TRACE_DIR = ''
+THROTTLE_ERROR_CODES = ['Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException',
+                        'RequestThrottled', 'SlowDown']
+# END AWS client pool constants
+
+# Leave blank to refresh the databases this action was run on, or set to "all"
+# to refresh every active database of this blueprint in one pass.
+REFRESH_SCOPE = '{{ refresh_scope }}'
+
+# Maximum number of identifiers sent in one db-instance-id filter
+DESCRIBE_BATCH_SIZE = 100
+
+# BEGIN resource attribute writer constants, synced from "Shared Plug-in Code/resource_attributes.py"
+# Attributes written to the resource row itself rather than as custom field values
+RESOURCE_COLUMNS = ['name']
+
+# Rows per IN clause and per bulk statement when writing resource attributes
+WRITE_BATCH_SIZE = 500
+
+# Attribute in which discovery keeps the state it last synced for a resource.
+# Any other write that changes the resource empties it, so the next sync
+# rewrites the resource instead of skipping it as unchanged.
+DISCOVERY_FINGERPRINT = 'discovery_fingerprint'
+
+# CustomFieldValue column holding the value of each custom field type, with the
+# conversion applied before a value is compared or stored. Other types are
+# looked up one value at a time through CustomFieldValue.value.
+VALUE_COLUMNS = {
+    'STR': ('str_value', str),
+    'INT': ('int_value', int),
+    'BOOL': ('boolean_value', lambda value: value if isinstance(value, bool) else str(value).lower() == 'true'),
+}
+# END resource attribute writer constants
+
+# Custom fields used by this blueprint, created on first use
+CUSTOM_FIELDS = [
+    {'name': 'aws_rh_id', 'label': 'AWS RH ID', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint'},
+    {'name': 'db_identifier', 'label': 'AWS database identifier', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint'},
+    {'name': 'db_endpoint_address', 'label': 'Endpoint Address', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint', 'show_on_servers': True},
+    {'name': 'db_endpoint_port', 'label': 'Endpoint Port', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint', 'show_on_servers': True},
+    {'name': 'db_availability_zone', 'label': 'Availability Zone', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint'},
+    {'name': 'db_publicly_accessible', 'label': 'Publicly Accessible', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint'},
+    {'name': 'db_engine', 'label': 'Engine', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint'},
+    {'name': 'db_status', 'label': 'Status', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint', 'show_on_servers': True},
+    {'name': 'db_username', 'label': 'Username', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint', 'show_on_servers': True},
+    {'name': 'db_subnet_group', 'label': 'Subnet group', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint'},
+    {'name': 'db_subnets', 'label': 'Subnets', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint'},
+    {'name': 'aws_region', 'label': 'Region', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint'},
+    {'name': 'db_provisioning_state', 'label': 'Provisioning State', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint'},
+]
+
+# Values that must outlive a job are kept in a module registered under this
+# name, shared by the CloudBolt plug-ins of this worker process
+PROCESS_STATE_MODULE = 'cloudbolt_plugin_process_state_v1'
+
+# Names of the custom fields known to exist, kept in the process state so later
+# jobs skip the custom field setup entirely
+ENSURED_CUSTOM_FIELDS_STATE = 'aws_mysql_refresh_connection_info.ensured_custom_fields'
+
+
+# BEGIN AWS client pool, synced from "Shared Plug-in Code/aws_client_pool.py"
+class APITrace(object):
+    """
+    The API calls made during one job: per operation and region counts,
+    time, retries, throttles and a latency histogram, plus every single call
+    when the trace is written to a file.
+    """
+    # upper bounds, in seconds, of the latency histogram buckets
+    HISTOGRAM_BOUNDS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+    def __init__(self, name, keep_calls=False):
+        self.name = name
+        self.started = time.time()
+        self.elapsed_started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.operations = {}
+        self.calls = [] if keep_calls else None
+
+    def record(self, operation, location, duration, retries=0, throttles=0, waited=0, error=None):
+        with self.lock:
+            stats = self.operations.get((operation, location))
+            if stats is None:
+                stats = self.operations[(operation, location)] = dict(
+                    calls=0, seconds=0, max_seconds=0, retries=0, throttles=0, errors=0, waited_seconds=0,
+                    histogram=[0] * (len(self.HISTOGRAM_BOUNDS) + 1))
+            stats['calls'] += 1
+            stats['seconds'] += duration
+            stats['max_seconds'] = max(stats['max_seconds'], duration)
+            stats['retries'] += retries
+            stats['throttles'] += throttles
+            stats['errors'] += 1 if error else 0
+            stats['waited_seconds'] += waited
+            stats['histogram'][bisect.bisect_left(self.HISTOGRAM_BOUNDS, duration)] += 1
+
+            if self.calls is not None:
+                self.calls.append(dict(at=round(time.time() - self.started, 4), operation=operation,
+                                       location=location, seconds=round(duration, 4), retries=retries,
+                                       throttles=throttles, waited_seconds=round(waited, 4), error=error))
+
+    def percentile(self, histogram, fraction):
+        """
+        Return the upper bound of the histogram bucket holding the given
+        fraction of the calls, or None when it is past the last bound.
+        """
+        target, seen = fraction * sum(histogram), 0
+        for bound, count in zip(self.HISTOGRAM_BOUNDS, histogram):
+            seen += count
+            if seen >= target:
+                return bound
+        return None
+
+    def summary(self, max_operations=10):
+        """
+        Return a few lines describing the trace, slowest operations first.
+        """
+        operations = sorted(self.operations.items(), key=lambda item: -item[1]['seconds'])
+        totals = {key: sum(stats[key] for _, stats in operations)
+                  for key in ['calls', 'seconds', 'retries', 'throttles', 'errors', 'waited_seconds']}
+
+        lines = ['{0}: {1} API call(s) taking {2:.1f}s{3}, {4} retries, {5} throttled, {6} failed, '
+                 'in {7:.1f}s elapsed'.format(
+                     self.name, totals['calls'], totals['seconds'],
+                     ', {0:.1f}s waiting on the rate limiter'.format(totals['waited_seconds'])
+                     if totals['waited_seconds'] else '',
+                     totals['retries'], totals['throttles'], totals['errors'],
+                     time.perf_counter() - self.elapsed_started)]
+
+        for (operation, location), stats in operations[:max_operations]:
+            p95 = self.percentile(stats['histogram'], 0.95)
+            lines.append('  {0} ({1}): {2} call(s), {3:.2f}s, avg {4:.0f}ms, p95 {5}, max {6:.0f}ms{7}{8}'.format(
+                operation, location, stats['calls'], stats['seconds'], stats['seconds'] / stats['calls'] * 1000,
+                '<{0:g}ms'.format(p95 * 1000) if p95 is not None else '>10s', stats['max_seconds'] * 1000,
+                ', {0} retries'.format(stats['retries']) if stats['retries'] else '',
+                ', {0} throttled'.format(stats['throttles']) if stats['throttles'] else ''))
+
+        return lines
+
+    def write(self, directory):
+        """
+        Write the whole trace as JSON to a new file in directory and return its path.
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, '{0}-{1}-{2}.json'.format(
+            re.sub(r'[^\w.-]+', '_', self.name), time.strftime('%Y%m%d%H%M%S', time.localtime(self.started)),
+            os.getpid()))
+
+        with open(path, 'w') as trace_file:
+            json.dump({
+                'name': self.name,
+                'started': self.started,
+                'elapsed_seconds': time.perf_counter() - self.elapsed_started,
+                'histogram_bounds': self.HISTOGRAM_BOUNDS,
+                'operations': [dict(stats, operation=operation, location=location)
+                               for (operation, location), stats in sorted(self.operations.items())],
+                'calls': self.calls or [],
+            }, trace_file)
+
+        return path
+
+
+class APITracer(object):
+    """
+    Routes API call timings to the traces of the jobs running in this process.
+
+    A call made by a thread that started a trace goes to that trace. Calls from
+    other threads, such as a job's worker pool, go to every active trace.
+    Without an active trace, recording costs one attribute check.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = []
+        self.local = threading.local()
+
+    def start(self, name, keep_calls=False):
+        trace = APITrace(name, keep_calls)
+        with self.lock:
+            self.active = self.active + [trace]
+        self.local.trace = trace
+        return trace
+
+    def finish(self, trace):
+        with self.lock:
+            self.active = [active for active in self.active if active is not trace]
+        if getattr(self.local, 'trace', None) is trace:
+            self.local.trace = None
+
+    def record(self, *args, **kwargs):
+        if not self.active:
+            return
+        trace = getattr(self.local, 'trace', None)
+        for trace in [trace] if trace is not None else self.active:
+            trace.record(*args, **kwargs)
+
+
+def register_trace_hooks(tracer, client, region, service_name):
+    """
+    Time every API call of a boto3 client into the tracer's active traces.
+    Retries and throttles are counted from botocore's needs-retry checks.
+    """
+    def before_call(model, context, **kwargs):
+        if tracer.active:
+            context['trace_operation'] = '{0}.{1}'.format(service_name, model.name)
+            context['trace_started'] = time.perf_counter()
+
+    def after_call(context, parsed=None, exception=None, **kwargs):
+        started = context.pop('trace_started', None)
+        if started is None:
+            return
+        parsed = parsed or {}
+        error = parsed.get('Error', {}).get('Code') or (exception is not None and type(exception).__name__) or None
+        tracer.record(context['trace_operation'], region, time.perf_counter() - started,
+                      retries=parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0),
+                      throttles=context.pop('trace_throttles', 0), waited=context.get('rate_limit_wait', 0),
+                      error=error)
+
+    def needs_retry(response=None, request_dict=None, **kwargs):
+        if response is None or request_dict is None or 'trace_started' not in request_dict.get('context', {}):
+            return
+        if response[1].get('Error', {}).get('Code') in THROTTLE_ERROR_CODES:
+            context = request_dict['context']
+            context['trace_throttles'] = context.get('trace_throttles', 0) + 1
+
+    client.meta.events.register('before-call', before_call)
+    client.meta.events.register('after-call', after_call)
+    client.meta.events.register('after-call-error', after_call)
+    client.meta.events.register('needs-retry', needs_retry)
+
+
+
+class AWSRateLimiter(object):
+    """
+    Token buckets shared between processes through files under RATE_LIMIT_DIR.
+
+    Each bucket file holds the token count and the time it was last updated;
+    a caller refills it for the time elapsed, takes a token if one is free and
+    otherwise sleeps for as long as the next token takes to arrive.
+    """
+    def __init__(self, directory=RATE_LIMIT_DIR):
+        self.directory = directory
+        self.local = threading.local()
+
+    @contextmanager
+    def interactive(self):
+        """
+        Run the calls made by this thread inside the block in the priority lane.
+        """
+        previous = getattr(self.local, 'interactive', False)
+        self.local.interactive = True
+        try:
+            yield
+        finally:
+            self.local.interactive = previous
+
+    def take(self, path, rate, burst, reserve):
+        """
+        Take one token from the bucket at path. Returns 0, or the seconds to
+        wait before trying again when the bucket is empty.
+        """
+        with open(path, 'a+') as bucket:
+            # the lock is released when the file is closed
+            fcntl.flock(bucket, fcntl.LOCK_EX)
+            bucket.seek(0)
+            state = bucket.read().split()
+            now = time.time()
+
+            tokens = burst
+            if len(state) == 2:
+                tokens = min(burst, float(state[0]) + max(now - float(state[1]), 0) * rate)
+
+            wait = 0
+            if tokens >= reserve + 1:
+                tokens -= 1
+            else:
+                wait = (reserve + 1 - tokens) / rate
+
+            bucket.seek(0)
+            bucket.truncate()
+            bucket.write('{0} {1}'.format(tokens, now))
+
+        return wait
+
+    def acquire(self, handler_id, region, service_name, operation_name):
+        """
+        Wait for a token and return the seconds spent waiting.
+        """
+        family = 'read' if operation_name.startswith(RATE_LIMIT_READ_PREFIXES) else 'write'
+        rate, burst = RATE_LIMITS[family]
+        reserve = 0 if getattr(self.local, 'interactive', False) else min(RATE_LIMIT_INTERACTIVE_RESERVE, burst - 1)
+        path = os.path.join(self.directory, '{0}-{1}-{2}-{3}'.format(handler_id, region, service_name, family))
+
+        waited = 0
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            wait = self.take(path, rate, burst, reserve)
+            while wait:
+                time.sleep(wait)
+                waited += wait
+                wait = self.take(path, rate, burst, reserve)
+        except OSError as err:
+            # never fail an AWS call because the buckets cannot be read
+            logger.warning('AWS rate limiter unavailable, not limiting {0}: {1}'.format(path, err))
+
+        return waited
+
+    def register(self, client, handler_id, region, service_name):
+        """
+        Make every API call of a boto3 client wait for a token first.
+        """
+        def before_call(model, context, **kwargs):
+            context['rate_limit_wait'] = self.acquire(handler_id, region, service_name, model.name)
+
+        client.meta.events.register('before-call', before_call)
+
+
+class AWSClientPool(object):
+    """
+    Process-wide LRU pool of boto3 clients and resources.
+
+    Entries are keyed by (handler id, credentials version, region, service,
+    kind). Clients are thread safe and shared by every thread; resources are
+    not, so they are also keyed by thread. Changing a handler's credentials
+    changes its version, which drops every entry built with the old ones.
+    """
+    def __init__(self, max_size=CLIENT_POOL_MAX_SIZE):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.build_locks = {}
+        self.versions = {}
+        self.limiter = AWSRateLimiter()
+        self.tracer = APITracer()
+
+    @staticmethod
+    def get_credentials_version(handler):
+        credentials = '{0}:{1}'.format(handler.serviceaccount, handler.servicepasswd)
+        return hashlib.sha1(credentials.encode('utf-8')).hexdigest()[:16]
+
+    def get_build_lock(self, handler, version):
+        """
+        Return the lock serializing builds for one handler and credentials
+        version. Must be called with self.lock held.
+        """
+        if self.versions.get(handler.id) != version:
+            # the credentials were rotated, forget everything built with the old ones
+            for key in [key for key in self.entries if key[0] == handler.id]:
+                del self.entries[key]
+            self.build_locks.pop((handler.id, self.versions.get(handler.id)), None)
+            self.versions[handler.id] = version
+
+        return self.build_locks.setdefault((handler.id, version), threading.Lock())
+
+    @staticmethod
+    def build(handler, region, service_name, kind):
+        """
+        Build a client or resource with the handler's own boto3 factories, which
+        apply its IAM role, proxy and partition endpoint settings.
+        """
+        if kind == 'resource':
+            return handler.get_api_wrapper().get_boto3_resource(
+                handler.serviceaccount, handler.servicepasswd, region, service_name)
+        return handler.get_boto3_client(region, service_name)
+
+    def get(self, handler, region, service_name, kind='client'):
+        version = self.get_credentials_version(handler)
+        key = (handler.id, version, region, service_name, kind)
+        if kind == 'resource':
+            key += (threading.get_ident(),)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry
+            build_lock = self.get_build_lock(handler, version)
+
+        # boto3 sessions are not thread safe, build one client at a time per handler
+        with build_lock:
+            entry = self.build(handler, region, service_name, kind)
+            client = entry.meta.client if kind == 'resource' else entry
+            self.limiter.register(client, handler.id, region, service_name)
+            register_trace_hooks(self.tracer, client, region, service_name)
+
+        with self.lock:
+            entry = self.entries.setdefault(key, entry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+        return entry
+
+
+def get_client_pool():
+    """
+    Return the AWS client pool shared by every AWS plug-in in this process.
+    Plug-ins are loaded as separate modules, so the pool is registered under a
+    well-known module name that the first plug-in to run creates.
+    """
+    module = sys.modules.get(CLIENT_POOL_MODULE)
+    if module is None:
+        module = types.ModuleType(CLIENT_POOL_MODULE)
+        module.pool = AWSClientPool()
+        # setdefault is atomic, if two plug-ins race only one pool survives
+        module = sys.modules.setdefault(CLIENT_POOL_MODULE, module)
+
+    return module.pool
+
+
+def get_aws_client(handler, region, service_name):
+    """
+    Return a pooled boto3 client for the handler's credentials in region.
+    """
+    return get_client_pool().get(handler, region, service_name, 'client')
+
+
+def get_aws_resource(handler, region, service_name):
+    """
+    Return a pooled boto3 resource, private to the calling thread, for the
+    handler's credentials in region.
+    """
+    return get_client_pool().get(handler, region, service_name, 'resource')
+
+
+def interactive_aws_calls():
+    """
+    Put the AWS calls made inside the block, or the decorated function, in the
+    rate limiter's priority lane so order forms do not wait on background jobs.
+    """
+    return get_client_pool().limiter.interactive()
+
+
+def trace_api_calls(function):
+    """
+    When API_TRACE_ENABLED is set, trace the AWS calls made while function
+    runs and report them when it returns. Generator functions, such as
+    discover_resources, are traced until they are exhausted.
+    """
+    def start():
+        return get_client_pool().tracer.start('{0}.{1}'.format(function.__module__, function.__name__),
+                                keep_calls=bool(API_TRACE_DIR))
+
+    def finish(trace):
+        get_client_pool().tracer.finish(trace)
+        for line in trace.summary():
+            set_progress(line)
+        if API_TRACE_DIR:
+            try:
+                set_progress('API trace written to {0}'.format(trace.write(API_TRACE_DIR)))
+            except OSError as err:
+                set_progress('Could not write the API trace: {0}'.format(err))
+
+    if inspect.isgeneratorfunction(function):
+        @wraps(function)
+        def traced_generator(*args, **kwargs):
+            if not API_TRACE_ENABLED:
+                return (yield from function(*args, **kwargs))
+            trace = start()
+            try:
+                return (yield from function(*args, **kwargs))
+            finally:
+                finish(trace)
+
+        return traced_generator
+
+    @wraps(function)
+    def traced(*args, **kwargs):
+        if not API_TRACE_ENABLED:
+            return function(*args, **kwargs)
+        trace = start()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            finish(trace)
+
+    return traced
+# END AWS client pool
+
+
+def get_process_state(key, default_factory):
+    """
+    Return the value kept under key for the life of this worker process,
+    creating it with default_factory() on first use. CloudBolt executes the
+    plug-in afresh for every job, so module globals are lost between jobs;
+    the state lives in a module registered under PROCESS_STATE_MODULE instead.
+    """
+    module = sys.modules.get(PROCESS_STATE_MODULE)
+    if module is None:
+        # setdefault is atomic, if two plug-ins race only one module survives
+        module = sys.modules.setdefault(PROCESS_STATE_MODULE, types.ModuleType(PROCESS_STATE_MODULE))
+
+    state = module.__dict__
+    if key not in state:
+        state.setdefault(key, default_factory())
+    return state[key]
+
+
+def get_or_create_custom_fields_as_needed():
+    """
+    Create any field in CUSTOM_FIELDS that does not exist yet, with one query
+    for the existing names and one bulk insert for the rest.
+    """
+    ensured = get_process_state(ENSURED_CUSTOM_FIELDS_STATE, set)
+    missing = [field for field in CUSTOM_FIELDS if field['name'] not in ensured]
+    if not missing:
+        return
+
+    existing = set(CustomField.objects.filter(
+        name__in=[field['name'] for field in missing]).values_list('name', flat=True))
+
+    # ignore_conflicts lets concurrent jobs race on the same new field safely
+    CustomField.objects.bulk_create(
+        [CustomField(**field) for field in missing if field['name'] not in existing],
+        ignore_conflicts=True,
+    )
+    ensured.update(field['name'] for field in missing)
+
+
+# BEGIN resource attribute writer, synced from "Shared Plug-in Code/resource_attributes.py"
+def get_custom_field_values(field, values):
+    """
+    Return {value: CustomFieldValue} for one field, creating the values that do
+    not exist yet. Values of the types in VALUE_COLUMNS are looked up and
+    created in bulk on their own column.
+    """
+    if field.type not in VALUE_COLUMNS:
+        return {value: CustomFieldValue.objects.get_or_create(field=field, value=value)[0] for value in values}
+
+    column = VALUE_COLUMNS[field.type][0]
+    values = list(values)
+    cfvs = {}
+    for start in range(0, len(values), WRITE_BATCH_SIZE):
+        batch = values[start:start + WRITE_BATCH_SIZE]
+        found = CustomFieldValue.objects.filter(field=field, **{column + '__in': batch})
+        cfvs.update({getattr(cfv, column): cfv for cfv in found})
+
+        missing = [value for value in batch if value not in cfvs]
+        if missing:
+            # bulk_create does not return primary keys on every database, so read them back
+            CustomFieldValue.objects.bulk_create(
+                [CustomFieldValue(field=field, **{column: value}) for value in missing])
+            created = CustomFieldValue.objects.filter(field=field, **{column + '__in': missing})
+            cfvs.update({getattr(cfv, column): cfv for cfv in created})
+
+    return cfvs
+
+
+def write_resource_attributes(updates):
+    """
+    Write {resource: {attribute: value}} for many resources at once.
+
+    Current values come from one prefetch and only the attributes that changed
+    are written: resource columns such as name with one bulk_update, custom
+    field values with a bulk delete and a bulk insert on the attributes table.
+    A value of None clears the attribute. A resource that changes also has its
+    discovery fingerprint emptied, unless the update sets it.
+    """
+    resources = list(updates)
+    prefetch_related_objects(resources, 'attributes__field')
+
+    names = {name for values in updates.values() for name in values if name not in RESOURCE_COLUMNS}
+    fields = {field.name: field for field in CustomField.objects.filter(name__in=names)}
+
+    changed_resources, removed, added = [], [], defaultdict(list)
+    for resource, values in updates.items():
+        current = {cfv.field.name: cfv for cfv in resource.attributes.all()}
+        changed = False
+
+        for name, value in values.items():
+            if name in RESOURCE_COLUMNS:
+                if getattr(resource, name) != value:
+                    setattr(resource, name, value)
+                    changed_resources.append(resource)
+                    changed = True
+                continue
+
+            field = fields.get(name)
+            if field is None:
+                logger.warning(f'Custom field {name} does not exist, not writing it for {resource}')
+                continue
+
+            if value is not None and field.type in VALUE_COLUMNS:
+                value = VALUE_COLUMNS[field.type][1](value)
+
+            cfv = current.get(name)
+            if cfv is not None and value is not None and str(cfv.value) == str(value):
+                continue
+            changed = True
+            if cfv is not None:
+                removed.append(Q(resource_id=resource.id, customfieldvalue_id=cfv.id))
+            if value is not None:
+                added[name].append((resource, value))
+
+        fingerprint = current.get(DISCOVERY_FINGERPRINT)
+        if changed and fingerprint is not None and fingerprint.value and DISCOVERY_FINGERPRINT not in values:
+            fields.setdefault(DISCOVERY_FINGERPRINT, fingerprint.field)
+            removed.append(Q(resource_id=resource.id, customfieldvalue_id=fingerprint.id))
+            added[DISCOVERY_FINGERPRINT].append((resource, ''))
+
+    if changed_resources:
+        Resource.objects.bulk_update(set(changed_resources), RESOURCE_COLUMNS, batch_size=WRITE_BATCH_SIZE)
+
+    through = Resource.attributes.through
+    for start in range(0, len(removed), WRITE_BATCH_SIZE):
+        through.objects.filter(reduce(operator.or_, removed[start:start + WRITE_BATCH_SIZE])).delete()
+
+    links = []
+    for name, pairs in added.items():
+        cfvs = get_custom_field_values(fields[name], {value for _, value in pairs})
+        links.extend(through(resource_id=resource.id, customfieldvalue_id=cfvs[value].id) for resource, value in pairs)
+    through.objects.bulk_create(links, batch_size=WRITE_BATCH_SIZE)
 
-def get_aws_rh_and_region(resource):
-    rh_aws_id = resource.aws_rh_id
-    aws_region =  resource.aws_region
-    rh_aws = None
+    # the prefetched attributes no longer match the database
+    for resource in resources:
+        getattr(resource, '_prefetched_objects_cache', {}).pop('attributes', None)
+# END resource attribute writer
 
-    if rh_aws_id != "" or rh_aws_id is not None:
-        rh_aws = AWSHandler.objects.get(id=rh_aws_id)
 
-    return aws_region, rh_aws
-    
 def boto_instance_to_dict(boto_instance, region, handler):
     """
     Create a pared-down representation of an MySQL database from the full boto
@@ -52,41 +704,122 @@ def boto_instance_to_dict(boto_instance, region, handler):
     logger.info(f"Updates MySQL database: {instance}")
 
     return instance
-    
+
+
+def get_attribute_values(resource):
+    """
+    Return the custom field values of a resource whose attributes were prefetched.
+    """
+    return {cfv.field.name: cfv.value for cfv in resource.attributes.all()}
+
+
+def get_target_resources(resource, **kwargs):
+    """
+    Return the database resources to refresh: every active resource of this
+    blueprint when REFRESH_SCOPE is "all", otherwise the resources the action
+    was run on.
+    """
+    if REFRESH_SCOPE.strip().lower() == 'all':
+        resources = Resource.objects.filter(blueprint_id=resource.blueprint_id, lifecycle='ACTIVE')
+    else:
+        resources = kwargs.get('resources') or [resource]
+
+    resources = list(resources)
+    prefetch_related_objects(resources, 'attributes__field')
+
+    return resources
+
+
+def describe_db_instances(client, identifiers):
+    """
+    Describe the given DB instances of one region and return them keyed by
+    identifier. Instances that no longer exist are simply absent.
+
+    Up to DESCRIBE_BATCH_SIZE identifiers are sent as one db-instance-id
+    filter. Beyond that a single paginated sweep of the region is cheaper than
+    many filtered calls, and the instances that were not asked for are dropped.
+    """
+    paginator = client.get_paginator('describe_db_instances')
+
+    if len(identifiers) <= DESCRIBE_BATCH_SIZE:
+        pages = paginator.paginate(Filters=[{'Name': 'db-instance-id', 'Values': list(identifiers)}])
+    else:
+        pages = paginator.paginate()
+
+    wanted = set(identifiers)
+    return {db_instance['DBInstanceIdentifier']: db_instance
+            for page in pages for db_instance in page['DBInstances']
+            if db_instance['DBInstanceIdentifier'] in wanted}
+
+
+@trace_api_calls
 def run(job, resource, logger=None, **kwargs):
-    # The Environment ID and MySQL database data dict were stored as attributes on
-    # this service by a build action.
-    mysql_instance_identifier = resource.db_identifier
+    # get or create custom fields
+    get_or_create_custom_fields_as_needed()
 
-    # get aws region and resource handler object
-    aws: AWSHandler
-    region, aws, = get_aws_rh_and_region(resource)
+    resources = get_target_resources(resource, **kwargs)
 
-    if aws is None or aws == "":
-        return  "WARNING", f"MySQL database instance {mysql_instance_identifier} not found, it may have already been deleted", ""
+    # group databases by the account and region they were stored with by a build action
+    regions = defaultdict(dict)
+    not_found, unchecked = [], []
+    blank = {}
+    for database in resources:
+        values = get_attribute_values(database)
+        if values.get('db_identifier'):
+            regions[(values.get('aws_rh_id'), values.get('aws_region'))][values['db_identifier']] = database
+        else:
+            # nothing to describe, so the database is flagged like one that no longer exists
+            blank[database] = {'db_status': 'not-found'}
+            not_found.append(database.name)
 
-    set_progress('Connecting to Amazon RDS')
-    
-    # initialize boto3 client
-    client = aws.get_boto3_client(region, 'rds')
+    set_progress(f'Refreshing {len(resources)} MySQL database connection info in {len(regions)} region(s)')
 
-    job.set_progress('Refreshing MySQL database connection info {0}...'.format(mysql_instance_identifier))
+    if blank:
+        write_resource_attributes(blank)
+    updated = len(blank)
 
-    # fetch MySQL database instance
-    postgresql_rsp = client.describe_db_instances(DBInstanceIdentifier=mysql_instance_identifier)['DBInstances']
+    for (rh_id, region), databases in regions.items():
+        handler = AWSHandler.objects.filter(id=rh_id).first() if rh_id else None
+        if handler is None or not region:
+            not_found.extend(databases)
+            continue
 
-    if not postgresql_rsp:
-        return  "WARNING", f"MySQL database instance {mysql_instance_identifier} not found, it may have already been deleted", ""
+        set_progress(f'Connecting to Amazon RDS in {region}')
 
+        # one describe for every database of this account and region
+        try:
+            client = get_aws_client(handler, region, 'rds')
+            db_instances = describe_db_instances(client, list(databases))
+        except (ClientError, BotoCoreError) as err:
+            # one unreachable account or region must not stop the others
+            set_progress(f'Could not describe the databases of {handler} in {region}: {err}')
+            unchecked.extend(databases)
+            continue
 
-    # convert MySQL database instance to dict
-    postgresql_instance = boto_instance_to_dict(postgresql_rsp[0], region, aws)
+        updates = {}
+        for identifier, database in databases.items():
+            db_instance = db_instances.get(identifier)
+            if db_instance is None:
+                # flag the database so it can be cleaned up
+                updates[database] = {'db_status': 'not-found'}
+                not_found.append(identifier)
+            else:
+                updates[database] = boto_instance_to_dict(db_instance, region, handler)
 
-    for key, value in postgresql_instance.items():
-        setattr(resource, key, value) # set custom field value
+        # copy the described instances onto the resources, region by region so a
+        # later failure does not lose them
+        write_resource_attributes(updates)
+        updated += len(updates)
 
-    resource.save()
+    problems = []
+    if not_found:
+        missing = ', '.join(str(identifier) for identifier in not_found)
+        problems.append(f"MySQL database instance(s) {missing} not found, they may have already been deleted")
+    if unchecked:
+        problems.append(f"MySQL database instance(s) {', '.join(unchecked)} could not be checked")
+    if problems:
+        return "WARNING", '. '.join(problems), ""
 
-    job.set_progress('MySQL database instance {0} updated.'.format(mysql_instance_identifier))
+    set_progress(f'{updated} MySQL database instance(s) updated.')
 
-    return 'SUCCESS', f'MySQL database instance {mysql_instance_identifier} updated successfully.', ''
\ No newline at end of file
+    return 'SUCCESS', f'{updated} MySQL database instance(s) updated successfully.', ''
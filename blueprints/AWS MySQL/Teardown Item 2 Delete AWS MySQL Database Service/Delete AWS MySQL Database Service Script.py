@@ -1,3 +1,20 @@
+import bisect
+import fcntl
+import hashlib
+import inspect
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import types
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from botocore.exceptions import BotoCoreError, ClientError
 from common.methods import set_progress
 from infrastructure.models import Environment
 from resourcehandlers.aws.models import AWSHandler
@@ -5,57 +22,614 @@ from utilities.logger import ThreadLogger
 
 logger = ThreadLogger(__name__)
 
-def get_aws_rh_and_region(resource):
-    rh_aws_id = resource.aws_rh_id
-    aws_region =  resource.aws_region
-    rh_aws = None
+# BEGIN AWS client pool constants, synced from "Shared Plug-in Code/aws_client_pool.py"
+# boto3 clients and resources are shared by every AWS plug-in in this process.
+# They are built by the resource handler, so its IAM role, proxy and partition
+# settings apply, and the pool keeps at most CLIENT_POOL_MAX_SIZE of them,
+# evicting the least recently used. The first plug-in to run registers the pool
+# under CLIENT_POOL_MODULE and every later one uses it, so the version in the
+# name must be bumped whenever this section or the pool code changes.
+CLIENT_POOL_MODULE = 'cloudbolt_aws_client_pool_v4'
+CLIENT_POOL_MAX_SIZE = 256
 
-    if rh_aws_id is not None or rh_aws_id != "":
-        rh_aws = AWSHandler.objects.filter(id=rh_aws_id).first()
+# Every AWS call made through the pool first takes a token from a bucket shared
+# by all CloudBolt worker processes on this host. There is one bucket per
+# handler, region, service and API family, stored in RATE_LIMIT_DIR and guarded
+# by a file lock. RATE_LIMITS gives the calls per second and burst size of each
+# family. Background calls leave RATE_LIMIT_INTERACTIVE_RESERVE tokens in the
+# bucket so order form calls, made in the priority lane, are not queued behind them.
+RATE_LIMIT_DIR = '/var/tmp/cloudbolt_aws_rate_limits'
+RATE_LIMITS = {'read': (10, 40), 'write': (2, 10)}
+RATE_LIMIT_INTERACTIVE_RESERVE = 5
+RATE_LIMIT_READ_PREFIXES = ('Describe', 'List', 'Get')
 
-    return aws_region, rh_aws
+# Set API_TRACE_ENABLED to time every AWS call made while run() or
+# discover_resources() executes, per operation and region, with retries,
+# throttles and rate limiter waits. A summary is added to the job progress at
+# the end and, when API_TRACE_DIR is set, every call is written there as JSON.
+API_TRACE_ENABLED = False
+API_TRACE_DIR = ''
+THROTTLE_ERROR_CODES = ['Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException',
+                        'RequestThrottled', 'SlowDown']
+# END AWS client pool constants
+
+# AWS strongly recommends taking a final snapshot before deleting a DB. Set to
+# True to have RDS take one for every database while it is deleted.
+TAKE_FINAL_SNAPSHOT = False
+
+# Number of delete calls and region polls run concurrently
+MAX_WORKERS = 10
+
+# Seconds to wait for every database to be gone before reporting the
+# stragglers, and the first/longest delay (seconds) between status polls. RDS
+# finishes an accepted delete on its own, so the job only waits long enough to
+# report most databases as deleted and lets the stragglers end with a warning.
+DELETE_TIMEOUT = 600
+POLL_INITIAL_DELAY = 30
+POLL_MAX_DELAY = 120
+
+# Maximum number of identifiers sent in one db-instance-id filter
+DESCRIBE_BATCH_SIZE = 100
+
+
+# BEGIN AWS client pool, synced from "Shared Plug-in Code/aws_client_pool.py"
+class APITrace(object):
+    """
+    The API calls made during one job: per operation and region counts,
+    time, retries, throttles and a latency histogram, plus every single call
+    when the trace is written to a file.
+    """
+    # upper bounds, in seconds, of the latency histogram buckets
+    HISTOGRAM_BOUNDS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+    def __init__(self, name, keep_calls=False):
+        self.name = name
+        self.started = time.time()
+        self.elapsed_started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.operations = {}
+        self.calls = [] if keep_calls else None
+
+    def record(self, operation, location, duration, retries=0, throttles=0, waited=0, error=None):
+        with self.lock:
+            stats = self.operations.get((operation, location))
+            if stats is None:
+                stats = self.operations[(operation, location)] = dict(
+                    calls=0, seconds=0, max_seconds=0, retries=0, throttles=0, errors=0, waited_seconds=0,
+                    histogram=[0] * (len(self.HISTOGRAM_BOUNDS) + 1))
+            stats['calls'] += 1
+            stats['seconds'] += duration
+            stats['max_seconds'] = max(stats['max_seconds'], duration)
+            stats['retries'] += retries
+            stats['throttles'] += throttles
+            stats['errors'] += 1 if error else 0
+            stats['waited_seconds'] += waited
+            stats['histogram'][bisect.bisect_left(self.HISTOGRAM_BOUNDS, duration)] += 1
+
+            if self.calls is not None:
+                self.calls.append(dict(at=round(time.time() - self.started, 4), operation=operation,
+                                       location=location, seconds=round(duration, 4), retries=retries,
+                                       throttles=throttles, waited_seconds=round(waited, 4), error=error))
+
+    def percentile(self, histogram, fraction):
+        """
+        Return the upper bound of the histogram bucket holding the given
+        fraction of the calls, or None when it is past the last bound.
+        """
+        target, seen = fraction * sum(histogram), 0
+        for bound, count in zip(self.HISTOGRAM_BOUNDS, histogram):
+            seen += count
+            if seen >= target:
+                return bound
+        return None
+
+    def summary(self, max_operations=10):
+        """
+        Return a few lines describing the trace, slowest operations first.
+        """
+        operations = sorted(self.operations.items(), key=lambda item: -item[1]['seconds'])
+        totals = {key: sum(stats[key] for _, stats in operations)
+                  for key in ['calls', 'seconds', 'retries', 'throttles', 'errors', 'waited_seconds']}
+
+        lines = ['{0}: {1} API call(s) taking {2:.1f}s{3}, {4} retries, {5} throttled, {6} failed, '
+                 'in {7:.1f}s elapsed'.format(
+                     self.name, totals['calls'], totals['seconds'],
+                     ', {0:.1f}s waiting on the rate limiter'.format(totals['waited_seconds'])
+                     if totals['waited_seconds'] else '',
+                     totals['retries'], totals['throttles'], totals['errors'],
+                     time.perf_counter() - self.elapsed_started)]
+
+        for (operation, location), stats in operations[:max_operations]:
+            p95 = self.percentile(stats['histogram'], 0.95)
+            lines.append('  {0} ({1}): {2} call(s), {3:.2f}s, avg {4:.0f}ms, p95 {5}, max {6:.0f}ms{7}{8}'.format(
+                operation, location, stats['calls'], stats['seconds'], stats['seconds'] / stats['calls'] * 1000,
+                '<{0:g}ms'.format(p95 * 1000) if p95 is not None else '>10s', stats['max_seconds'] * 1000,
+                ', {0} retries'.format(stats['retries']) if stats['retries'] else '',
+                ', {0} throttled'.format(stats['throttles']) if stats['throttles'] else ''))
+
+        return lines
+
+    def write(self, directory):
+        """
+        Write the whole trace as JSON to a new file in directory and return its path.
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, '{0}-{1}-{2}.json'.format(
+            re.sub(r'[^\w.-]+', '_', self.name), time.strftime('%Y%m%d%H%M%S', time.localtime(self.started)),
+            os.getpid()))
+
+        with open(path, 'w') as trace_file:
+            json.dump({
+                'name': self.name,
+                'started': self.started,
+                'elapsed_seconds': time.perf_counter() - self.elapsed_started,
+                'histogram_bounds': self.HISTOGRAM_BOUNDS,
+                'operations': [dict(stats, operation=operation, location=location)
+                               for (operation, location), stats in sorted(self.operations.items())],
+                'calls': self.calls or [],
+            }, trace_file)
+
+        return path
+
+
+class APITracer(object):
+    """
+    Routes API call timings to the traces of the jobs running in this process.
+
+    A call made by a thread that started a trace goes to that trace. Calls from
+    other threads, such as a job's worker pool, go to every active trace.
+    Without an active trace, recording costs one attribute check.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = []
+        self.local = threading.local()
+
+    def start(self, name, keep_calls=False):
+        trace = APITrace(name, keep_calls)
+        with self.lock:
+            self.active = self.active + [trace]
+        self.local.trace = trace
+        return trace
+
+    def finish(self, trace):
+        with self.lock:
+            self.active = [active for active in self.active if active is not trace]
+        if getattr(self.local, 'trace', None) is trace:
+            self.local.trace = None
+
+    def record(self, *args, **kwargs):
+        if not self.active:
+            return
+        trace = getattr(self.local, 'trace', None)
+        for trace in [trace] if trace is not None else self.active:
+            trace.record(*args, **kwargs)
+
+
+def register_trace_hooks(tracer, client, region, service_name):
+    """
+    Time every API call of a boto3 client into the tracer's active traces.
+    Retries and throttles are counted from botocore's needs-retry checks.
+    """
+    def before_call(model, context, **kwargs):
+        if tracer.active:
+            context['trace_operation'] = '{0}.{1}'.format(service_name, model.name)
+            context['trace_started'] = time.perf_counter()
+
+    def after_call(context, parsed=None, exception=None, **kwargs):
+        started = context.pop('trace_started', None)
+        if started is None:
+            return
+        parsed = parsed or {}
+        error = parsed.get('Error', {}).get('Code') or (exception is not None and type(exception).__name__) or None
+        tracer.record(context['trace_operation'], region, time.perf_counter() - started,
+                      retries=parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0),
+                      throttles=context.pop('trace_throttles', 0), waited=context.get('rate_limit_wait', 0),
+                      error=error)
+
+    def needs_retry(response=None, request_dict=None, **kwargs):
+        if response is None or request_dict is None or 'trace_started' not in request_dict.get('context', {}):
+            return
+        if response[1].get('Error', {}).get('Code') in THROTTLE_ERROR_CODES:
+            context = request_dict['context']
+            context['trace_throttles'] = context.get('trace_throttles', 0) + 1
+
+    client.meta.events.register('before-call', before_call)
+    client.meta.events.register('after-call', after_call)
+    client.meta.events.register('after-call-error', after_call)
+    client.meta.events.register('needs-retry', needs_retry)
+
+
+
+class AWSRateLimiter(object):
+    """
+    Token buckets shared between processes through files under RATE_LIMIT_DIR.
+
+    Each bucket file holds the token count and the time it was last updated;
+    a caller refills it for the time elapsed, takes a token if one is free and
+    otherwise sleeps for as long as the next token takes to arrive.
+    """
+    def __init__(self, directory=RATE_LIMIT_DIR):
+        self.directory = directory
+        self.local = threading.local()
+
+    @contextmanager
+    def interactive(self):
+        """
+        Run the calls made by this thread inside the block in the priority lane.
+        """
+        previous = getattr(self.local, 'interactive', False)
+        self.local.interactive = True
+        try:
+            yield
+        finally:
+            self.local.interactive = previous
+
+    def take(self, path, rate, burst, reserve):
+        """
+        Take one token from the bucket at path. Returns 0, or the seconds to
+        wait before trying again when the bucket is empty.
+        """
+        with open(path, 'a+') as bucket:
+            # the lock is released when the file is closed
+            fcntl.flock(bucket, fcntl.LOCK_EX)
+            bucket.seek(0)
+            state = bucket.read().split()
+            now = time.time()
+
+            tokens = burst
+            if len(state) == 2:
+                tokens = min(burst, float(state[0]) + max(now - float(state[1]), 0) * rate)
+
+            wait = 0
+            if tokens >= reserve + 1:
+                tokens -= 1
+            else:
+                wait = (reserve + 1 - tokens) / rate
+
+            bucket.seek(0)
+            bucket.truncate()
+            bucket.write('{0} {1}'.format(tokens, now))
+
+        return wait
+
+    def acquire(self, handler_id, region, service_name, operation_name):
+        """
+        Wait for a token and return the seconds spent waiting.
+        """
+        family = 'read' if operation_name.startswith(RATE_LIMIT_READ_PREFIXES) else 'write'
+        rate, burst = RATE_LIMITS[family]
+        reserve = 0 if getattr(self.local, 'interactive', False) else min(RATE_LIMIT_INTERACTIVE_RESERVE, burst - 1)
+        path = os.path.join(self.directory, '{0}-{1}-{2}-{3}'.format(handler_id, region, service_name, family))
+
+        waited = 0
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            wait = self.take(path, rate, burst, reserve)
+            while wait:
+                time.sleep(wait)
+                waited += wait
+                wait = self.take(path, rate, burst, reserve)
+        except OSError as err:
+            # never fail an AWS call because the buckets cannot be read
+            logger.warning('AWS rate limiter unavailable, not limiting {0}: {1}'.format(path, err))
+
+        return waited
+
+    def register(self, client, handler_id, region, service_name):
+        """
+        Make every API call of a boto3 client wait for a token first.
+        """
+        def before_call(model, context, **kwargs):
+            context['rate_limit_wait'] = self.acquire(handler_id, region, service_name, model.name)
+
+        client.meta.events.register('before-call', before_call)
+
+
+class AWSClientPool(object):
+    """
+    Process-wide LRU pool of boto3 clients and resources.
+
+    Entries are keyed by (handler id, credentials version, region, service,
+    kind). Clients are thread safe and shared by every thread; resources are
+    not, so they are also keyed by thread. Changing a handler's credentials
+    changes its version, which drops every entry built with the old ones.
+    """
+    def __init__(self, max_size=CLIENT_POOL_MAX_SIZE):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.build_locks = {}
+        self.versions = {}
+        self.limiter = AWSRateLimiter()
+        self.tracer = APITracer()
+
+    @staticmethod
+    def get_credentials_version(handler):
+        credentials = '{0}:{1}'.format(handler.serviceaccount, handler.servicepasswd)
+        return hashlib.sha1(credentials.encode('utf-8')).hexdigest()[:16]
+
+    def get_build_lock(self, handler, version):
+        """
+        Return the lock serializing builds for one handler and credentials
+        version. Must be called with self.lock held.
+        """
+        if self.versions.get(handler.id) != version:
+            # the credentials were rotated, forget everything built with the old ones
+            for key in [key for key in self.entries if key[0] == handler.id]:
+                del self.entries[key]
+            self.build_locks.pop((handler.id, self.versions.get(handler.id)), None)
+            self.versions[handler.id] = version
+
+        return self.build_locks.setdefault((handler.id, version), threading.Lock())
+
+    @staticmethod
+    def build(handler, region, service_name, kind):
+        """
+        Build a client or resource with the handler's own boto3 factories, which
+        apply its IAM role, proxy and partition endpoint settings.
+        """
+        if kind == 'resource':
+            return handler.get_api_wrapper().get_boto3_resource(
+                handler.serviceaccount, handler.servicepasswd, region, service_name)
+        return handler.get_boto3_client(region, service_name)
+
+    def get(self, handler, region, service_name, kind='client'):
+        version = self.get_credentials_version(handler)
+        key = (handler.id, version, region, service_name, kind)
+        if kind == 'resource':
+            key += (threading.get_ident(),)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry
+            build_lock = self.get_build_lock(handler, version)
+
+        # boto3 sessions are not thread safe, build one client at a time per handler
+        with build_lock:
+            entry = self.build(handler, region, service_name, kind)
+            client = entry.meta.client if kind == 'resource' else entry
+            self.limiter.register(client, handler.id, region, service_name)
+            register_trace_hooks(self.tracer, client, region, service_name)
+
+        with self.lock:
+            entry = self.entries.setdefault(key, entry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+        return entry
+
+
+def get_client_pool():
+    """
+    Return the AWS client pool shared by every AWS plug-in in this process.
+    Plug-ins are loaded as separate modules, so the pool is registered under a
+    well-known module name that the first plug-in to run creates.
+    """
+    module = sys.modules.get(CLIENT_POOL_MODULE)
+    if module is None:
+        module = types.ModuleType(CLIENT_POOL_MODULE)
+        module.pool = AWSClientPool()
+        # setdefault is atomic, if two plug-ins race only one pool survives
+        module = sys.modules.setdefault(CLIENT_POOL_MODULE, module)
+
+    return module.pool
+
+
+def get_aws_client(handler, region, service_name):
+    """
+    Return a pooled boto3 client for the handler's credentials in region.
+    """
+    return get_client_pool().get(handler, region, service_name, 'client')
+
+
+def get_aws_resource(handler, region, service_name):
+    """
+    Return a pooled boto3 resource, private to the calling thread, for the
+    handler's credentials in region.
+    """
+    return get_client_pool().get(handler, region, service_name, 'resource')
+
+
+def interactive_aws_calls():
+    """
+    Put the AWS calls made inside the block, or the decorated function, in the
+    rate limiter's priority lane so order forms do not wait on background jobs.
+    """
+    return get_client_pool().limiter.interactive()
+
+
+def trace_api_calls(function):
+    """
+    When API_TRACE_ENABLED is set, trace the AWS calls made while function
+    runs and report them when it returns. Generator functions, such as
+    discover_resources, are traced until they are exhausted.
+    """
+    def start():
+        return get_client_pool().tracer.start('{0}.{1}'.format(function.__module__, function.__name__),
+                                keep_calls=bool(API_TRACE_DIR))
+
+    def finish(trace):
+        get_client_pool().tracer.finish(trace)
+        for line in trace.summary():
+            set_progress(line)
+        if API_TRACE_DIR:
+            try:
+                set_progress('API trace written to {0}'.format(trace.write(API_TRACE_DIR)))
+            except OSError as err:
+                set_progress('Could not write the API trace: {0}'.format(err))
+
+    if inspect.isgeneratorfunction(function):
+        @wraps(function)
+        def traced_generator(*args, **kwargs):
+            if not API_TRACE_ENABLED:
+                return (yield from function(*args, **kwargs))
+            trace = start()
+            try:
+                return (yield from function(*args, **kwargs))
+            finally:
+                finish(trace)
+
+        return traced_generator
+
+    @wraps(function)
+    def traced(*args, **kwargs):
+        if not API_TRACE_ENABLED:
+            return function(*args, **kwargs)
+        trace = start()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            finish(trace)
+
+    return traced
+# END AWS client pool
+
+
+def get_attribute_values(resource):
+    """
+    Return the custom field values of a resource whose attributes were prefetched.
+    """
+    return {cfv.field.name: cfv.value for cfv in resource.attributes.all()}
+
+
+def delete_db_instance(client, identifier):
+    """
+    Issue delete_db_instance for one database and return its outcome:
+    "deleting", "not found" or the error. The call itself tells whether the
+    instance still exists, so no describe is needed first.
+    """
+    params = dict(DBInstanceIdentifier=identifier, DeleteAutomatedBackups=True)
+    if TAKE_FINAL_SNAPSHOT:
+        params['FinalDBSnapshotIdentifier'] = '{0}-final-{1}'.format(identifier, time.strftime('%Y%m%d%H%M%S'))
+    else:
+        params['SkipFinalSnapshot'] = True
 
-def run(job, logger=None, **kwargs):
-    resource = kwargs.pop('resources').first()
-
-    set_progress(f"MySQL database Delete plugin running for resource: {resource}")
-    logger.info(f"MySQL database Delete plugin running for resource: {resource}")
-    
-    mysql_database_identifier = resource.db_identifier
-    
-    # get aws region and resource handler object
-    aws: AWSHandler
-    region, aws = get_aws_rh_and_region(resource)
-
-    if aws is None or aws == "":
-        return "WARNING", "", "Need a valid aws region to delete this database"
-
-    set_progress('Connecting to Amazon MySQL Database')
-    
-    # initialize boto3 client
-    client = aws.get_boto3_client(region, 'rds')
-    
     try:
-        # verify MySQL database instance
-        rds_resp = client.describe_db_instances(DBInstanceIdentifier=mysql_database_identifier)
-    except Exception as err:
-        if "DBInstanceNotFound" in str(err):
-            return "WARNING", f"MySQL Database instance {mysql_database_identifier} not found, it may have already been deleted", ""
-        raise RuntimeError(err)
-    
-    job.set_progress('Deleting MySQL Database {0}...'.format(mysql_database_identifier))
-    
-    # delete MySQL Database from AWS
-    client.delete_db_instance(
-        DBInstanceIdentifier=mysql_database_identifier,
-        # AWS strongly recommends taking a final snapshot before deleting a DB.
-        # To do so, either set this to False or let the user choose by making it
-        # a runtime action input (in that case be sure to set the param type to
-        # Boolean so users get a dropdown).
-        SkipFinalSnapshot=True,
-        DeleteAutomatedBackups=True,
-    )
-    
-    job.set_progress(f"MySQL database {mysql_database_identifier} deleted successfully")
-    
-    return 'SUCCESS', f"MySQL database {mysql_database_identifier} deleted successfully", ''
\ No newline at end of file
+        client.delete_db_instance(**params)
+    except ClientError as err:
+        error = err.response.get('Error', {})
+        if error.get('Code') == 'DBInstanceNotFound':
+            return 'not found'
+        if error.get('Code') == 'InvalidDBInstanceState' and 'already being deleted' in error.get('Message', ''):
+            return 'deleting'
+        return str(err)
+
+    return 'deleting'
+
+
+def wait_for_db_instances_deleted(client, identifiers, timeout, initial_delay, max_delay):
+    """
+    Poll many DB instances together until none of them exists any more.
+
+    Instances are described with batched db-instance-id filters, so a poll
+    round costs one call per DESCRIBE_BATCH_SIZE databases. The delay between
+    rounds starts at initial_delay, grows by half up to max_delay and is
+    jittered. Returns the identifiers still present when the timeout passed.
+    """
+    deadline = time.monotonic() + timeout
+    paginator = client.get_paginator('describe_db_instances')
+    remaining = list(identifiers)
+    delay = initial_delay
+
+    while remaining:
+        time_left = deadline - time.monotonic()
+        if time_left <= 0:
+            break
+        time.sleep(min(delay * random.uniform(0.75, 1.25), time_left))
+        delay = min(delay * 1.5, max_delay)
+
+        try:
+            present = set()
+            for start in range(0, len(remaining), DESCRIBE_BATCH_SIZE):
+                batch = remaining[start:start + DESCRIBE_BATCH_SIZE]
+                for page in paginator.paginate(Filters=[{'Name': 'db-instance-id', 'Values': batch}]):
+                    present.update(db_instance['DBInstanceIdentifier'] for db_instance in page['DBInstances'])
+        except ClientError as err:
+            # a throttled poll is retried on the next round, anything else is fatal
+            if err.response.get('Error', {}).get('Code') not in ['Throttling', 'ThrottlingException']:
+                raise
+            continue
+
+        remaining = [identifier for identifier in remaining if identifier in present]
+
+    return remaining
+
+
+@trace_api_calls
+def run(job, logger=None, **kwargs):
+    resources = kwargs.pop('resources').prefetch_related('attributes__field')
+
+    set_progress(f"MySQL database Delete plugin running for {len(resources)} resource(s)")
+    logger.info(f"MySQL database Delete plugin running for resources: {list(resources)}")
+
+    # group databases by the account and region they were stored with by a build action
+    regions = defaultdict(list)
+    outcomes = {}
+    for resource in resources:
+        values = get_attribute_values(resource)
+        if not values.get('db_identifier'):
+            outcomes[(None, None, str(resource))] = 'no database identifier'
+            continue
+        regions[(values.get('aws_rh_id'), values.get('aws_region'))].append(values['db_identifier'])
+
+    clients = {}
+    for (rh_id, region), identifiers in regions.items():
+        handler = AWSHandler.objects.filter(id=rh_id).first() if rh_id else None
+        if handler is None or not region:
+            outcomes.update({(rh_id, region, identifier): 'need a valid aws region to delete this database'
+                             for identifier in identifiers})
+            continue
+        clients[(rh_id, region)] = get_aws_client(handler, region, 'rds')
+
+    set_progress(f"Deleting {sum(len(regions[key]) for key in clients)} MySQL database(s) in {len(clients)} region(s)")
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        # every delete is issued at once, final snapshots are then taken by RDS in parallel
+        deletes = {(key, identifier): executor.submit(delete_db_instance, client, identifier)
+                   for key, client in clients.items() for identifier in regions[key]}
+
+        deleting = defaultdict(list)
+        for ((rh_id, region), identifier), future in deletes.items():
+            outcome = future.result()
+            if outcome == 'deleting':
+                deleting[(rh_id, region)].append(identifier)
+            else:
+                outcomes[(rh_id, region, identifier)] = outcome
+
+        # one batched poll loop per region until the instances are gone
+        polls = {key: executor.submit(wait_for_db_instances_deleted, clients[key], identifiers, DELETE_TIMEOUT,
+                                      POLL_INITIAL_DELAY, POLL_MAX_DELAY)
+                 for key, identifiers in deleting.items()}
+
+        for (rh_id, region), future in polls.items():
+            try:
+                remaining = future.result()
+            except (ClientError, BotoCoreError) as err:
+                # the deletes were issued, only their completion is unknown
+                outcomes.update({(rh_id, region, identifier): f'deletion could not be confirmed: {err}'
+                                 for identifier in deleting[(rh_id, region)]})
+                continue
+            for identifier in deleting[(rh_id, region)]:
+                outcomes[(rh_id, region, identifier)] = (f'still deleting after {DELETE_TIMEOUT} seconds'
+                                                         if identifier in remaining else 'deleted')
+
+    for (_, region, identifier), outcome in sorted(outcomes.items(), key=lambda item: (item[0][1] or '', item[0][2])):
+        set_progress(f"MySQL database {identifier} ({region}): {outcome}")
+
+    deleted = sum(1 for outcome in outcomes.values() if outcome == 'deleted')
+    failed = [outcome for outcome in outcomes.values()
+              if outcome not in ['deleted', 'not found'] and not outcome.startswith('still deleting')]
+    message = f"{deleted} of {len(outcomes)} MySQL database(s) deleted successfully"
+
+    if failed:
+        return 'FAILURE', message, '; '.join(sorted(set(failed)))
+    if any(outcome.startswith('still deleting') for outcome in outcomes.values()):
+        return 'WARNING', message, 'Some databases are still being deleted by RDS'
+    if deleted < len(outcomes):
+        return 'WARNING', message, 'Some databases were not found, they may have already been deleted'
+
+    return 'SUCCESS', message, ''
\ No newline at end of file
@@ -1,130 +1,651 @@
 """
 Build service item action for AWS PostgreSQL database blueprint.
 """
+import bisect
+import fcntl
+import hashlib
+import inspect
+import json
+import mmap
+import operator
+import os
+import random
 import re
+import struct
+import sys
+import tempfile
+import threading
 import time
+import types
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import reduce, wraps
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+from django.conf import settings
+from django.core.cache.backends.filebased import FileBasedCache
+from django.db import connections
+from django.db.models import Q, prefetch_related_objects
 from common.methods import set_progress
 from infrastructure.models import CustomField, Environment
 from accounts.models import Group
+from orders.models import CustomFieldValue
+from resources.models import Resource
 from resourcehandlers.aws.models import AWSHandler
 from utilities.logger import ThreadLogger
 
 
 logger = ThreadLogger(__name__)
 
-def get_or_create_custom_fields_as_needed():
-    CustomField.objects.get_or_create(
-        name='aws_rh_id',
-        defaults={
-            "label": 'AWS RH ID',
-            "type": 'STR',
-            "description": 'Used by the AWS Databases blueprint'
-        }
-    )
+# BEGIN AWS client pool constants, synced from "Shared Plug-in Code/aws_client_pool.py"
+# boto3 clients and resources are shared by every AWS plug-in in this process.
+# They are built by the resource handler, so its IAM role, proxy and partition
+# settings apply, and the pool keeps at most CLIENT_POOL_MAX_SIZE of them,
+# evicting the least recently used. The first plug-in to run registers the pool
+# under CLIENT_POOL_MODULE and every later one uses it, so the version in the
+# name must be bumped whenever this section or the pool code changes.
+CLIENT_POOL_MODULE = 'cloudbolt_aws_client_pool_v4'
+CLIENT_POOL_MAX_SIZE = 256
 
-    CustomField.objects.get_or_create(
-        name='db_identifier',
-        defaults={
-            "label": 'AWS database identifier',
-            "type": 'STR',
-            "description": 'Used by the AWS Databases blueprint'
-        }
-    )
-    
-    CustomField.objects.get_or_create(
-        name='db_endpoint_address',
-        defaults={
-            "label": 'Endpoint Address',
-            "type": 'STR',
-            "description": 'Used by the AWS Databases blueprint',
-            "show_on_servers": True
-        }
-    )
+# Every AWS call made through the pool first takes a token from a bucket shared
+# by all CloudBolt worker processes on this host. There is one bucket per
+# handler, region, service and API family, stored in RATE_LIMIT_DIR and guarded
+# by a file lock. RATE_LIMITS gives the calls per second and burst size of each
+# family. Background calls leave RATE_LIMIT_INTERACTIVE_RESERVE tokens in the
+# bucket so order form calls, made in the priority lane, are not queued behind them.
+RATE_LIMIT_DIR = '/var/tmp/cloudbolt_aws_rate_limits'
+RATE_LIMITS = {'read': (10, 40), 'write': (2, 10)}
+RATE_LIMIT_INTERACTIVE_RESERVE = 5
+RATE_LIMIT_READ_PREFIXES = ('Describe', 'List', 'Get')
 
-    CustomField.objects.get_or_create(
-        name='db_endpoint_port',
-        defaults={
-            "label": 'Endpoint Port',
-            "type": 'STR',
-            "description": 'Used by the AWS Databases blueprint',
-            "show_on_servers": True
-        }
-    )
+# Set API_TRACE_ENABLED to time every AWS call made while run() or
+# discover_resources() executes, per operation and region, with retries,
+# throttles and rate limiter waits. A summary is added to the job progress at
+# the end and, when API_TRACE_DIR is set, every call is written there as JSON.
+API_TRACE_ENABLED = False
+API_TRACE_DIR = ''
+THROTTLE_ERROR_CODES = ['Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException',
+                        'RequestThrottled', 'SlowDown']
+# END AWS client pool constants
 
-    CustomField.objects.get_or_create(
-        name='db_availability_zone',
-        defaults={
-            "label": 'Availability Zone',
-            "type": 'STR',
-            "description": 'Used by the AWS Databases blueprint'
-        }
-    )
+DB_ENGINE = 'postgres'
 
-    CustomField.objects.get_or_create(
-        name='db_publicly_accessible',
-        defaults={
-            "label": 'Publicly Accessible',
-            "type": 'STR',
-            "description": 'Used by the AWS Databases blueprint'
-        }
-    )
-    
-    CustomField.objects.get_or_create(
-        name='db_engine',
-        defaults={
-            "label": 'Engine',
-            "type": 'STR',
-            "description": 'Used by the AWS Databases blueprint'
-        }
-    )
-    
-    CustomField.objects.get_or_create(
-        name='db_status',
-        defaults={
-            "label": 'Status',
-            "type": 'STR',
-            "description": 'Used by the AWS Databases blueprint',
-            "show_on_servers": True
-        }
-    )
-    
-    CustomField.objects.get_or_create(
-        name='db_username',
-        defaults={
-            "label": 'Username',
-            "type": 'STR',
-            "description": 'Used by the AWS Databases blueprint',
-            "show_on_servers": True
-        }
-    )
-    
-    CustomField.objects.get_or_create(
-        name='db_subnet_group',
-        defaults={
-            "label": 'Subnet group',
-            "type": 'STR',
-            "description": 'Used by the AWS Databases blueprint'
-        }
-    )
+# On-disk cache of the RDS engine-version and orderable-instance catalogs,
+# shared by every job worker on this host. Entries expire after
+# CATALOG_CACHE_TTL seconds and the cache is culled once it holds more than
+# CATALOG_CACHE_MAX_ENTRIES catalogs.
+CATALOG_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'cb_rds_catalog_cache')
+CATALOG_CACHE_TTL = 24 * 60 * 60
+CATALOG_CACHE_MAX_ENTRIES = 2000
 
-    CustomField.objects.get_or_create(
-        name='db_subnets',
-        defaults={
-            "label": 'Subnets',
-            "type": 'STR',
-            "description": 'Used by the AWS Databases blueprint'
-        }
+catalog_cache = FileBasedCache(CATALOG_CACHE_DIR, {
+    'TIMEOUT': CATALOG_CACHE_TTL,
+    'OPTIONS': {'MAX_ENTRIES': CATALOG_CACHE_MAX_ENTRIES},
+})
+
+# Instance class capability index (vCPUs, memory, network and EBS limits per
+# class), built offline by build_rds_instance_class_index.py in the
+# "AWS RDS Instance Class Index" folder. Imported blueprints do not carry it, so
+# it is installed in the proserv directory as a setup step:
+#     python build_rds_instance_class_index.py ec2_instance_types_dump.json --install
+# Without it, instance classes are listed without their details.
+INSTANCE_CLASS_INDEX_PATH = os.path.join(getattr(settings, 'PROSERV_DIR', '/var/opt/cloudbolt/proserv'),
+                                         'rds_instance_class_index.bin')
+INSTANCE_CLASS_INDEX_INSTALL_COMMAND = 'python build_rds_instance_class_index.py ec2_instance_types_dump.json --install'
+INSTANCE_CLASS_INDEX_MAGIC = b'RDSCLSIX'
+INSTANCE_CLASS_INDEX_VERSION = 1
+INSTANCE_CLASS_INDEX_HEADER = struct.Struct('<8sHHIQ')
+INSTANCE_CLASS_INDEX_RECORD = struct.Struct('<32sHI24sIIII')
+
+# Allocated storage (GiB) for catalog entries that do not report a MinStorageSize
+DEFAULT_ALLOCATED_STORAGE = 20
+
+# Process state key of the loaded index, or of the failure to load it
+INSTANCE_CLASS_INDEX_STATE = 'aws_rds.instance_class_index'
+
+# Process state key of the regions RDS is available in
+RDS_REGIONS_STATE = 'aws_rds.supported_regions'
+
+# When True the build returns as soon as create_db_instance is accepted instead
+# of holding a job worker until the instance is available. The resource is left
+# with db_provisioning_state "pending" and the "AWS RDS Provisioning Poller"
+# recurring job hydrates it once the instance is available.
+ASYNC_PROVISIONING = False
+
+# Seconds to wait for a synchronously built instance to become available
+CREATE_TIMEOUT = 3000
+
+# Statuses from which an instance will not become available on its own, the
+# same ones the "AWS RDS Provisioning Poller" fails a pending resource on
+FAILED_STATUSES = ['failed', 'deleting', 'storage-full', 'incompatible-network',
+                   'incompatible-option-group', 'incompatible-parameters', 'incompatible-restore',
+                   'inaccessible-encryption-credentials']
+
+# First and longest delay (seconds) between status polls while the instance is
+# being created. Creation takes several minutes, so the first poll waits a while.
+POLL_INITIAL_DELAY = 60
+POLL_MAX_DELAY = 120
+
+# BEGIN RDS status wait constants, synced from "Shared Plug-in Code/rds_status_wait.py"
+# Maximum number of identifiers sent in one db-instance-id filter
+DESCRIBE_BATCH_SIZE = 100
+# END RDS status wait constants
+
+# Checks run concurrently before create_db_instance so that an order which
+# cannot succeed fails within seconds instead of minutes into the job. Set to
+# False to go straight to create_db_instance.
+PREFLIGHT_ENABLED = True
+
+# Naming rules of the DB instance identifier and of the initial database, which
+# is named after the identifier
+DB_IDENTIFIER_PATTERN = re.compile(r'^[a-zA-Z](?!.*--)[a-zA-Z0-9-]{0,62}(?<!-)$')
+DB_NAME_PATTERN = re.compile(r'^[a-zA-Z][a-zA-Z0-9_]{0,62}$')
+
+# BEGIN resource attribute writer constants, synced from "Shared Plug-in Code/resource_attributes.py"
+# Attributes written to the resource row itself rather than as custom field values
+RESOURCE_COLUMNS = ['name']
+
+# Rows per IN clause and per bulk statement when writing resource attributes
+WRITE_BATCH_SIZE = 500
+
+# Attribute in which discovery keeps the state it last synced for a resource.
+# Any other write that changes the resource empties it, so the next sync
+# rewrites the resource instead of skipping it as unchanged.
+DISCOVERY_FINGERPRINT = 'discovery_fingerprint'
+
+# CustomFieldValue column holding the value of each custom field type, with the
+# conversion applied before a value is compared or stored. Other types are
+# looked up one value at a time through CustomFieldValue.value.
+VALUE_COLUMNS = {
+    'STR': ('str_value', str),
+    'INT': ('int_value', int),
+    'BOOL': ('boolean_value', lambda value: value if isinstance(value, bool) else str(value).lower() == 'true'),
+}
+# END resource attribute writer constants
+
+# Custom fields used by this blueprint, created on first use
+CUSTOM_FIELDS = [
+    {'name': 'aws_rh_id', 'label': 'AWS RH ID', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint'},
+    {'name': 'db_identifier', 'label': 'AWS database identifier', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint'},
+    {'name': 'db_endpoint_address', 'label': 'Endpoint Address', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint', 'show_on_servers': True},
+    {'name': 'db_endpoint_port', 'label': 'Endpoint Port', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint', 'show_on_servers': True},
+    {'name': 'db_availability_zone', 'label': 'Availability Zone', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint'},
+    {'name': 'db_publicly_accessible', 'label': 'Publicly Accessible', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint'},
+    {'name': 'db_engine', 'label': 'Engine', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint'},
+    {'name': 'db_status', 'label': 'Status', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint', 'show_on_servers': True},
+    {'name': 'db_username', 'label': 'Username', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint', 'show_on_servers': True},
+    {'name': 'db_subnet_group', 'label': 'Subnet group', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint'},
+    {'name': 'db_subnets', 'label': 'Subnets', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint'},
+    {'name': 'aws_region', 'label': 'Region', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint'},
+    {'name': 'db_provisioning_state', 'label': 'Provisioning State', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint'},
+]
+
+# Values that must outlive a job are kept in a module registered under this
+# name, shared by the CloudBolt plug-ins of this worker process
+PROCESS_STATE_MODULE = 'cloudbolt_plugin_process_state_v1'
+
+# Names of the custom fields known to exist, kept in the process state so later
+# jobs skip the custom field setup entirely
+ENSURED_CUSTOM_FIELDS_STATE = 'aws_postgresql_create.ensured_custom_fields'
+
+
+# BEGIN AWS client pool, synced from "Shared Plug-in Code/aws_client_pool.py"
+class APITrace(object):
+    """
+    The API calls made during one job: per operation and region counts,
+    time, retries, throttles and a latency histogram, plus every single call
+    when the trace is written to a file.
+    """
+    # upper bounds, in seconds, of the latency histogram buckets
+    HISTOGRAM_BOUNDS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+    def __init__(self, name, keep_calls=False):
+        self.name = name
+        self.started = time.time()
+        self.elapsed_started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.operations = {}
+        self.calls = [] if keep_calls else None
+
+    def record(self, operation, location, duration, retries=0, throttles=0, waited=0, error=None):
+        with self.lock:
+            stats = self.operations.get((operation, location))
+            if stats is None:
+                stats = self.operations[(operation, location)] = dict(
+                    calls=0, seconds=0, max_seconds=0, retries=0, throttles=0, errors=0, waited_seconds=0,
+                    histogram=[0] * (len(self.HISTOGRAM_BOUNDS) + 1))
+            stats['calls'] += 1
+            stats['seconds'] += duration
+            stats['max_seconds'] = max(stats['max_seconds'], duration)
+            stats['retries'] += retries
+            stats['throttles'] += throttles
+            stats['errors'] += 1 if error else 0
+            stats['waited_seconds'] += waited
+            stats['histogram'][bisect.bisect_left(self.HISTOGRAM_BOUNDS, duration)] += 1
+
+            if self.calls is not None:
+                self.calls.append(dict(at=round(time.time() - self.started, 4), operation=operation,
+                                       location=location, seconds=round(duration, 4), retries=retries,
+                                       throttles=throttles, waited_seconds=round(waited, 4), error=error))
+
+    def percentile(self, histogram, fraction):
+        """
+        Return the upper bound of the histogram bucket holding the given
+        fraction of the calls, or None when it is past the last bound.
+        """
+        target, seen = fraction * sum(histogram), 0
+        for bound, count in zip(self.HISTOGRAM_BOUNDS, histogram):
+            seen += count
+            if seen >= target:
+                return bound
+        return None
+
+    def summary(self, max_operations=10):
+        """
+        Return a few lines describing the trace, slowest operations first.
+        """
+        operations = sorted(self.operations.items(), key=lambda item: -item[1]['seconds'])
+        totals = {key: sum(stats[key] for _, stats in operations)
+                  for key in ['calls', 'seconds', 'retries', 'throttles', 'errors', 'waited_seconds']}
+
+        lines = ['{0}: {1} API call(s) taking {2:.1f}s{3}, {4} retries, {5} throttled, {6} failed, '
+                 'in {7:.1f}s elapsed'.format(
+                     self.name, totals['calls'], totals['seconds'],
+                     ', {0:.1f}s waiting on the rate limiter'.format(totals['waited_seconds'])
+                     if totals['waited_seconds'] else '',
+                     totals['retries'], totals['throttles'], totals['errors'],
+                     time.perf_counter() - self.elapsed_started)]
+
+        for (operation, location), stats in operations[:max_operations]:
+            p95 = self.percentile(stats['histogram'], 0.95)
+            lines.append('  {0} ({1}): {2} call(s), {3:.2f}s, avg {4:.0f}ms, p95 {5}, max {6:.0f}ms{7}{8}'.format(
+                operation, location, stats['calls'], stats['seconds'], stats['seconds'] / stats['calls'] * 1000,
+                '<{0:g}ms'.format(p95 * 1000) if p95 is not None else '>10s', stats['max_seconds'] * 1000,
+                ', {0} retries'.format(stats['retries']) if stats['retries'] else '',
+                ', {0} throttled'.format(stats['throttles']) if stats['throttles'] else ''))
+
+        return lines
+
+    def write(self, directory):
+        """
+        Write the whole trace as JSON to a new file in directory and return its path.
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, '{0}-{1}-{2}.json'.format(
+            re.sub(r'[^\w.-]+', '_', self.name), time.strftime('%Y%m%d%H%M%S', time.localtime(self.started)),
+            os.getpid()))
+
+        with open(path, 'w') as trace_file:
+            json.dump({
+                'name': self.name,
+                'started': self.started,
+                'elapsed_seconds': time.perf_counter() - self.elapsed_started,
+                'histogram_bounds': self.HISTOGRAM_BOUNDS,
+                'operations': [dict(stats, operation=operation, location=location)
+                               for (operation, location), stats in sorted(self.operations.items())],
+                'calls': self.calls or [],
+            }, trace_file)
+
+        return path
+
+
+class APITracer(object):
+    """
+    Routes API call timings to the traces of the jobs running in this process.
+
+    A call made by a thread that started a trace goes to that trace. Calls from
+    other threads, such as a job's worker pool, go to every active trace.
+    Without an active trace, recording costs one attribute check.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = []
+        self.local = threading.local()
+
+    def start(self, name, keep_calls=False):
+        trace = APITrace(name, keep_calls)
+        with self.lock:
+            self.active = self.active + [trace]
+        self.local.trace = trace
+        return trace
+
+    def finish(self, trace):
+        with self.lock:
+            self.active = [active for active in self.active if active is not trace]
+        if getattr(self.local, 'trace', None) is trace:
+            self.local.trace = None
+
+    def record(self, *args, **kwargs):
+        if not self.active:
+            return
+        trace = getattr(self.local, 'trace', None)
+        for trace in [trace] if trace is not None else self.active:
+            trace.record(*args, **kwargs)
+
+
+def register_trace_hooks(tracer, client, region, service_name):
+    """
+    Time every API call of a boto3 client into the tracer's active traces.
+    Retries and throttles are counted from botocore's needs-retry checks.
+    """
+    def before_call(model, context, **kwargs):
+        if tracer.active:
+            context['trace_operation'] = '{0}.{1}'.format(service_name, model.name)
+            context['trace_started'] = time.perf_counter()
+
+    def after_call(context, parsed=None, exception=None, **kwargs):
+        started = context.pop('trace_started', None)
+        if started is None:
+            return
+        parsed = parsed or {}
+        error = parsed.get('Error', {}).get('Code') or (exception is not None and type(exception).__name__) or None
+        tracer.record(context['trace_operation'], region, time.perf_counter() - started,
+                      retries=parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0),
+                      throttles=context.pop('trace_throttles', 0), waited=context.get('rate_limit_wait', 0),
+                      error=error)
+
+    def needs_retry(response=None, request_dict=None, **kwargs):
+        if response is None or request_dict is None or 'trace_started' not in request_dict.get('context', {}):
+            return
+        if response[1].get('Error', {}).get('Code') in THROTTLE_ERROR_CODES:
+            context = request_dict['context']
+            context['trace_throttles'] = context.get('trace_throttles', 0) + 1
+
+    client.meta.events.register('before-call', before_call)
+    client.meta.events.register('after-call', after_call)
+    client.meta.events.register('after-call-error', after_call)
+    client.meta.events.register('needs-retry', needs_retry)
+
+
+
+class AWSRateLimiter(object):
+    """
+    Token buckets shared between processes through files under RATE_LIMIT_DIR.
+
+    Each bucket file holds the token count and the time it was last updated;
+    a caller refills it for the time elapsed, takes a token if one is free and
+    otherwise sleeps for as long as the next token takes to arrive.
+    """
+    def __init__(self, directory=RATE_LIMIT_DIR):
+        self.directory = directory
+        self.local = threading.local()
+
+    @contextmanager
+    def interactive(self):
+        """
+        Run the calls made by this thread inside the block in the priority lane.
+        """
+        previous = getattr(self.local, 'interactive', False)
+        self.local.interactive = True
+        try:
+            yield
+        finally:
+            self.local.interactive = previous
+
+    def take(self, path, rate, burst, reserve):
+        """
+        Take one token from the bucket at path. Returns 0, or the seconds to
+        wait before trying again when the bucket is empty.
+        """
+        with open(path, 'a+') as bucket:
+            # the lock is released when the file is closed
+            fcntl.flock(bucket, fcntl.LOCK_EX)
+            bucket.seek(0)
+            state = bucket.read().split()
+            now = time.time()
+
+            tokens = burst
+            if len(state) == 2:
+                tokens = min(burst, float(state[0]) + max(now - float(state[1]), 0) * rate)
+
+            wait = 0
+            if tokens >= reserve + 1:
+                tokens -= 1
+            else:
+                wait = (reserve + 1 - tokens) / rate
+
+            bucket.seek(0)
+            bucket.truncate()
+            bucket.write('{0} {1}'.format(tokens, now))
+
+        return wait
+
+    def acquire(self, handler_id, region, service_name, operation_name):
+        """
+        Wait for a token and return the seconds spent waiting.
+        """
+        family = 'read' if operation_name.startswith(RATE_LIMIT_READ_PREFIXES) else 'write'
+        rate, burst = RATE_LIMITS[family]
+        reserve = 0 if getattr(self.local, 'interactive', False) else min(RATE_LIMIT_INTERACTIVE_RESERVE, burst - 1)
+        path = os.path.join(self.directory, '{0}-{1}-{2}-{3}'.format(handler_id, region, service_name, family))
+
+        waited = 0
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            wait = self.take(path, rate, burst, reserve)
+            while wait:
+                time.sleep(wait)
+                waited += wait
+                wait = self.take(path, rate, burst, reserve)
+        except OSError as err:
+            # never fail an AWS call because the buckets cannot be read
+            logger.warning('AWS rate limiter unavailable, not limiting {0}: {1}'.format(path, err))
+
+        return waited
+
+    def register(self, client, handler_id, region, service_name):
+        """
+        Make every API call of a boto3 client wait for a token first.
+        """
+        def before_call(model, context, **kwargs):
+            context['rate_limit_wait'] = self.acquire(handler_id, region, service_name, model.name)
+
+        client.meta.events.register('before-call', before_call)
+
+
+class AWSClientPool(object):
+    """
+    Process-wide LRU pool of boto3 clients and resources.
+
+    Entries are keyed by (handler id, credentials version, region, service,
+    kind). Clients are thread safe and shared by every thread; resources are
+    not, so they are also keyed by thread. Changing a handler's credentials
+    changes its version, which drops every entry built with the old ones.
+    """
+    def __init__(self, max_size=CLIENT_POOL_MAX_SIZE):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.build_locks = {}
+        self.versions = {}
+        self.limiter = AWSRateLimiter()
+        self.tracer = APITracer()
+
+    @staticmethod
+    def get_credentials_version(handler):
+        credentials = '{0}:{1}'.format(handler.serviceaccount, handler.servicepasswd)
+        return hashlib.sha1(credentials.encode('utf-8')).hexdigest()[:16]
+
+    def get_build_lock(self, handler, version):
+        """
+        Return the lock serializing builds for one handler and credentials
+        version. Must be called with self.lock held.
+        """
+        if self.versions.get(handler.id) != version:
+            # the credentials were rotated, forget everything built with the old ones
+            for key in [key for key in self.entries if key[0] == handler.id]:
+                del self.entries[key]
+            self.build_locks.pop((handler.id, self.versions.get(handler.id)), None)
+            self.versions[handler.id] = version
+
+        return self.build_locks.setdefault((handler.id, version), threading.Lock())
+
+    @staticmethod
+    def build(handler, region, service_name, kind):
+        """
+        Build a client or resource with the handler's own boto3 factories, which
+        apply its IAM role, proxy and partition endpoint settings.
+        """
+        if kind == 'resource':
+            return handler.get_api_wrapper().get_boto3_resource(
+                handler.serviceaccount, handler.servicepasswd, region, service_name)
+        return handler.get_boto3_client(region, service_name)
+
+    def get(self, handler, region, service_name, kind='client'):
+        version = self.get_credentials_version(handler)
+        key = (handler.id, version, region, service_name, kind)
+        if kind == 'resource':
+            key += (threading.get_ident(),)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry
+            build_lock = self.get_build_lock(handler, version)
+
+        # boto3 sessions are not thread safe, build one client at a time per handler
+        with build_lock:
+            entry = self.build(handler, region, service_name, kind)
+            client = entry.meta.client if kind == 'resource' else entry
+            self.limiter.register(client, handler.id, region, service_name)
+            register_trace_hooks(self.tracer, client, region, service_name)
+
+        with self.lock:
+            entry = self.entries.setdefault(key, entry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+        return entry
+
+
+def get_client_pool():
+    """
+    Return the AWS client pool shared by every AWS plug-in in this process.
+    Plug-ins are loaded as separate modules, so the pool is registered under a
+    well-known module name that the first plug-in to run creates.
+    """
+    module = sys.modules.get(CLIENT_POOL_MODULE)
+    if module is None:
+        module = types.ModuleType(CLIENT_POOL_MODULE)
+        module.pool = AWSClientPool()
+        # setdefault is atomic, if two plug-ins race only one pool survives
+        module = sys.modules.setdefault(CLIENT_POOL_MODULE, module)
+
+    return module.pool
+
+
+def get_aws_client(handler, region, service_name):
+    """
+    Return a pooled boto3 client for the handler's credentials in region.
+    """
+    return get_client_pool().get(handler, region, service_name, 'client')
+
+
+def get_aws_resource(handler, region, service_name):
+    """
+    Return a pooled boto3 resource, private to the calling thread, for the
+    handler's credentials in region.
+    """
+    return get_client_pool().get(handler, region, service_name, 'resource')
+
+
+def interactive_aws_calls():
+    """
+    Put the AWS calls made inside the block, or the decorated function, in the
+    rate limiter's priority lane so order forms do not wait on background jobs.
+    """
+    return get_client_pool().limiter.interactive()
+
+
+def trace_api_calls(function):
+    """
+    When API_TRACE_ENABLED is set, trace the AWS calls made while function
+    runs and report them when it returns. Generator functions, such as
+    discover_resources, are traced until they are exhausted.
+    """
+    def start():
+        return get_client_pool().tracer.start('{0}.{1}'.format(function.__module__, function.__name__),
+                                keep_calls=bool(API_TRACE_DIR))
+
+    def finish(trace):
+        get_client_pool().tracer.finish(trace)
+        for line in trace.summary():
+            set_progress(line)
+        if API_TRACE_DIR:
+            try:
+                set_progress('API trace written to {0}'.format(trace.write(API_TRACE_DIR)))
+            except OSError as err:
+                set_progress('Could not write the API trace: {0}'.format(err))
+
+    if inspect.isgeneratorfunction(function):
+        @wraps(function)
+        def traced_generator(*args, **kwargs):
+            if not API_TRACE_ENABLED:
+                return (yield from function(*args, **kwargs))
+            trace = start()
+            try:
+                return (yield from function(*args, **kwargs))
+            finally:
+                finish(trace)
+
+        return traced_generator
+
+    @wraps(function)
+    def traced(*args, **kwargs):
+        if not API_TRACE_ENABLED:
+            return function(*args, **kwargs)
+        trace = start()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            finish(trace)
+
+    return traced
+# END AWS client pool
+
+
+def get_process_state(key, default_factory):
+    """
+    Return the value kept under key for the life of this worker process,
+    creating it with default_factory() on first use. CloudBolt executes the
+    plug-in afresh for every job, so module globals are lost between jobs;
+    the state lives in a module registered under PROCESS_STATE_MODULE instead.
+    """
+    module = sys.modules.get(PROCESS_STATE_MODULE)
+    if module is None:
+        # setdefault is atomic, if two plug-ins race only one module survives
+        module = sys.modules.setdefault(PROCESS_STATE_MODULE, types.ModuleType(PROCESS_STATE_MODULE))
+
+    state = module.__dict__
+    if key not in state:
+        state.setdefault(key, default_factory())
+    return state[key]
+
+
+def get_or_create_custom_fields_as_needed():
+    """
+    Create any field in CUSTOM_FIELDS that does not exist yet, with one query
+    for the existing names and one bulk insert for the rest.
+    """
+    ensured = get_process_state(ENSURED_CUSTOM_FIELDS_STATE, set)
+    missing = [field for field in CUSTOM_FIELDS if field['name'] not in ensured]
+    if not missing:
+        return
+
+    existing = set(CustomField.objects.filter(
+        name__in=[field['name'] for field in missing]).values_list('name', flat=True))
+
+    # ignore_conflicts lets concurrent jobs race on the same new field safely
+    CustomField.objects.bulk_create(
+        [CustomField(**field) for field in missing if field['name'] not in existing],
+        ignore_conflicts=True,
     )
-    
-    CustomField.objects.get_or_create(
-        name='aws_region',
-        defaults={
-            "label": 'Region',
-            "type": 'STR',
-            "description": 'Used by the AWS Databases blueprint'
-        }
-    )  
-    
+    ensured.update(field['name'] for field in missing)
+
+
 def get_boto3_service_client(env, service_name="rds"):
     """
     Return boto connection to the RDS in the specified environment's region.
@@ -133,7 +654,7 @@ def get_boto3_service_client(env, service_name="rds"):
     rh: AWSHandler = env.resource_handler.cast()
 
     # get aws client object
-    client = rh.get_boto3_client(env.aws_region, service_name)
+    client = get_aws_client(rh, env.aws_region, service_name)
 
     return client
     
@@ -152,8 +673,144 @@ def sort_dropdown_options(data, placeholder=None, is_reverse=False):
         sorted_options.insert(0, placeholder)
     
     return {'options': sorted_options, 'override': True}
-    
-    
+
+
+def get_db_engine_versions(env, engine=DB_ENGINE):
+    """
+    Return the available engine versions of an engine in the environment's
+    region, from the catalog cache when possible.
+    """
+    cache_key = 'rds_engine_versions:{0}:{1}'.format(env.aws_region, engine)
+    engine_versions = catalog_cache.get(cache_key)
+
+    if engine_versions is None:
+        client = get_boto3_service_client(env)
+        filters=[{'Name':'status','Values':['available']},{'Name':'engine-mode','Values':['provisioned']}]
+        paginator = client.get_paginator('describe_db_engine_versions')
+
+        engine_versions = []
+        for page in paginator.paginate(Engine=engine, IncludeAll=False, Filters=filters):
+            engine_versions.extend({
+                'EngineVersion': version['EngineVersion'],
+                'DBEngineVersionDescription': version['DBEngineVersionDescription'],
+            } for version in page['DBEngineVersions'])
+
+        catalog_cache.set(cache_key, engine_versions)
+
+    return engine_versions
+
+
+def get_orderable_instance_options(env, engine_version, engine=DB_ENGINE):
+    """
+    Return the orderable instance class options of an engine version in the
+    environment's region, from the catalog cache when possible. Only the keys
+    the order form uses are kept.
+    """
+    cache_key = 'rds_orderable_options:{0}:{1}:{2}'.format(env.aws_region, engine, engine_version)
+    instance_options = catalog_cache.get(cache_key)
+
+    if instance_options is None:
+        client = get_boto3_service_client(env)
+        paginator = client.get_paginator('describe_orderable_db_instance_options')
+        keys = ['DBInstanceClass', 'StorageType', 'MinStorageSize', 'MaxStorageSize']
+
+        instance_options = []
+        for page in paginator.paginate(Engine=engine, Vpc=True, EngineVersion=engine_version):
+            instance_options.extend({key: option[key] for key in keys if key in option}
+                                    for option in page['OrderableDBInstanceOptions'])
+
+        catalog_cache.set(cache_key, instance_options)
+
+    return instance_options
+
+
+class InstanceClassIndex(object):
+    """
+    Read-only, memory-mapped view of the instance class capability index.
+    Lookups binary-search the sorted records without reading the whole file.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as index_file:
+            self.data = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, _, self.count, self.built_at = INSTANCE_CLASS_INDEX_HEADER.unpack_from(self.data)
+        if magic != INSTANCE_CLASS_INDEX_MAGIC or version != INSTANCE_CLASS_INDEX_VERSION:
+            raise ValueError('{0} is not a version {1} instance class index'.format(path, INSTANCE_CLASS_INDEX_VERSION))
+
+    def record_offset(self, position):
+        return INSTANCE_CLASS_INDEX_HEADER.size + position * INSTANCE_CLASS_INDEX_RECORD.size
+
+    def lookup(self, instance_class):
+        """
+        Return the capabilities of an instance class, or None if it is not indexed.
+        """
+        key = instance_class.encode('ascii').ljust(32, b'\0')
+        low, high = 0, self.count
+
+        while low < high:
+            middle = (low + high) // 2
+            offset = self.record_offset(middle)
+            if self.data[offset:offset + 32] < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low == self.count:
+            return None
+
+        record = INSTANCE_CLASS_INDEX_RECORD.unpack_from(self.data, self.record_offset(low))
+        if record[0] != key:
+            return None
+
+        return {
+            'vcpus': record[1],
+            'memory_mib': record[2],
+            'network': record[3].rstrip(b'\0').decode('ascii'),
+            'ebs_baseline_mbps': record[4],
+            'ebs_max_mbps': record[5],
+            'baseline_iops': record[6],
+            'max_iops': record[7],
+        }
+
+
+def get_instance_class_index():
+    """
+    Load the instance class index on first use in this process. Returns None
+    when it is not installed or cannot be read, in which case instance classes
+    are listed without details. The failure is logged and remembered, so later
+    renders do not retry it until the worker restarts.
+    """
+    state = get_process_state(INSTANCE_CLASS_INDEX_STATE, dict)
+    if 'index' not in state:
+        index = None
+        try:
+            index = InstanceClassIndex(INSTANCE_CLASS_INDEX_PATH)
+        except (OSError, ValueError) as err:
+            logger.warning('Instance class index is not available ({0}), instance classes are listed without '
+                           'details. Install it as {1} by running "{2}" in the "AWS RDS Instance Class Index" '
+                           'folder of the blueprints.'.format(err, INSTANCE_CLASS_INDEX_PATH,
+                                                              INSTANCE_CLASS_INDEX_INSTALL_COMMAND))
+        state.setdefault('index', index)
+
+    return state['index']
+
+
+def get_rds_supported_regions():
+    """
+    Return the regions RDS is available in. The list comes from the endpoint
+    metadata bundled with botocore, so no API call is made, and it is kept in
+    the process state for the life of the worker process.
+    """
+    state = get_process_state(RDS_REGIONS_STATE, dict)
+    if 'regions' not in state:
+        session = boto3.session.Session()
+        state.setdefault('regions', frozenset(
+            region for partition in session.get_available_partitions()
+            for region in session.get_available_regions('rds', partition_name=partition)))
+
+    return state['regions']
+
+
 def generate_options_for_aws_region(**kwargs):
     """
     Generate AWS region options
@@ -169,20 +826,17 @@ def generate_options_for_aws_region(**kwargs):
     # fetch all group environment
     envs = group.get_available_environments()
     
-    aws_envs = [env for env in envs if env.resource_handler is not None and env.resource_handler.resource_technology.slug.startswith('aws')]
+    # filter AWS environments in one joined query rather than loading each handler's technology
+    aws_envs = Environment.objects.filter(id__in=[env.id for env in envs],
+                                          resource_handler__resource_technology__slug__startswith='aws')
     
     if not aws_envs:
         return [("", "-----Select Environment-----")]
 
-    # get boto3 client    
-    client = get_boto3_service_client(aws_envs[0])
-
     # fetch all postgres supported regions
-    rds_support_regions = [region['RegionName'] for region in client.describe_source_regions()['SourceRegions']]
-    rds_support_regions.append(aws_envs[0].aws_region)
+    rds_support_regions = get_rds_supported_regions()
    
     options = []
-    # get boto3 client    
     for env in aws_envs:
         if env.aws_region in rds_support_regions:
             options.append((env.id, env.name))
@@ -190,6 +844,7 @@ def generate_options_for_aws_region(**kwargs):
     return sort_dropdown_options(options, ("", "-----Select Environment-----"))
 
 
+@interactive_aws_calls()
 def generate_options_for_db_engine_version(control_value=None, **kwargs):
     """
     Generate PostgreSQL Database Engine version options
@@ -202,13 +857,9 @@ def generate_options_for_db_engine_version(control_value=None, **kwargs):
     
     env = Environment.objects.get(id=control_value)
 
-    # get boto3 client
-    client = get_boto3_service_client(env)
-    
     version_rgx = '^\d(\.\d)*$'
-    filters=[{'Name':'status','Values':['available']},{'Name':'engine-mode','Values':['provisioned']}]
-    
-    for engine in client.describe_db_engine_versions(Engine='postgres', IncludeAll=False, Filters=filters)['DBEngineVersions']:
+
+    for engine in get_db_engine_versions(env):
         option_label = engine['DBEngineVersionDescription']
         
         if re.match(version_rgx, engine['EngineVersion']) and engine['EngineVersion'] not in engine['DBEngineVersionDescription']:
@@ -218,6 +869,7 @@ def generate_options_for_db_engine_version(control_value=None, **kwargs):
     
     return sort_dropdown_options(options, ("", "-----Select Engine Version-----"), True)
     
+@interactive_aws_calls()
 def generate_options_for_instance_class(control_value=None, **kwargs):
     """
     Generate PostgreSQL Database Engine Version instance class options
@@ -231,55 +883,219 @@ def generate_options_for_instance_class(control_value=None, **kwargs):
     control_value = control_value.split("/")
     env = Environment.objects.get(id=control_value[1])
 
-    # get boto3 client
-    client = get_boto3_service_client(env)
-    
-    ins_cls_dict = {'xlarge': {'cpu': 4, 'storage': 32}, '2xlarge': {'cpu': 8, 'storage': 64}, '4xlarge': {'cpu': 16, 'storage': 128}, 
-                    '8xlarge':{'cpu': 32, 'storage': 256}, '16xlarge': {'cpu': 64, 'storage': 512}, 'large': {'cpu': 2, 'storage': 16},
-                    'small': {'cpu': 2, 'storage': 2}, 'medium': {'cpu': 2, 'storage':4}
-                    }
-    
     # fetch all db engine version instance classes
-    instance_klasss = client.describe_orderable_db_instance_options(Engine='postgres', Vpc=True, 
-                                    EngineVersion=control_value[0])['OrderableDBInstanceOptions']
+    instance_klasss = get_orderable_instance_options(env, control_value[0])
+    instance_class_index = get_instance_class_index()
     
     for instance_klass in instance_klasss:
-        storage = None
-        cpu = None
-        st_dict = ins_cls_dict.get(instance_klass['DBInstanceClass'].split(".")[-1], None)
-
-        if "MaxStorageSize" in instance_klass and st_dict is not None:  
-            if instance_klass['MinStorageSize']  <= st_dict['storage'] <= instance_klass['MaxStorageSize']:
-                storage = st_dict['storage']
-                cpu = st_dict['cpu']
-            else:
-                storage = instance_klass['MinStorageSize']
-                cpu = int(storage)//8 if int(storage)//8 > 1 else 2
-                
-        elif st_dict is not None:
-            storage = st_dict['storage']
-            cpu = st_dict['cpu']
-
-        if cpu is None:
-            continue
-
-        key = "{0}$?{1}$?{2}".format(instance_klass['DBInstanceClass'], storage, instance_klass['StorageType'])
-        name = "{0} ({1} GiB RAM,   {2} vCPUs, {3} Storage)".format(instance_klass['DBInstanceClass'],storage, cpu, 
-                                                    instance_klass['StorageType'].capitalize())
+        instance_class = instance_klass['DBInstanceClass']
+        storage = instance_klass.get('MinStorageSize', DEFAULT_ALLOCATED_STORAGE)
+        storage_type = instance_klass['StorageType']
+
+        capabilities = None
+        if instance_class_index is not None:
+            capabilities = instance_class_index.lookup(instance_class)
+
+        key = "{0}$?{1}$?{2}".format(instance_class, storage, storage_type)
+
+        if capabilities is None:
+            name = "{0} ({1} Storage)".format(instance_class, storage_type.capitalize())
+        else:
+            name = "{0} ({1} vCPUs, {2:g} GiB RAM, {3} network, {4} Mbps EBS, {5} max IOPS, {6} Storage)".format(
+                instance_class, capabilities['vcpus'], capabilities['memory_mib'] / 1024, capabilities['network'],
+                capabilities['ebs_max_mbps'], capabilities['max_iops'], storage_type.capitalize())
+
         options.append((key, name))
     
     return sort_dropdown_options(options, ("", "-----Select Instance Class-----"), True)
 
 
-def boto_instance_to_dict(boto_instance, env, client):
+# BEGIN RDS status wait, synced from "Shared Plug-in Code/rds_status_wait.py"
+def describe_db_instances(client, identifiers):
+    """
+    Describe many DB instances with batched db-instance-id filters and return
+    them keyed by identifier. Instances that no longer exist are simply absent.
+    """
+    db_instances = {}
+    paginator = client.get_paginator('describe_db_instances')
+
+    for start in range(0, len(identifiers), DESCRIBE_BATCH_SIZE):
+        batch = identifiers[start:start + DESCRIBE_BATCH_SIZE]
+        for page in paginator.paginate(Filters=[{'Name': 'db-instance-id', 'Values': batch}]):
+            for db_instance in page['DBInstances']:
+                db_instances[db_instance['DBInstanceIdentifier']] = db_instance
+
+    return db_instances
+
+
+def wait_for_db_instances_status(client, identifiers, target_status, timeout, initial_delay, max_delay,
+                                 failed_statuses=(), strict=True):
+    """
+    Poll many DB instances together until every one of them reports target_status.
+
+    Instances are described with batched db-instance-id filters. The delay
+    between polls starts at initial_delay, grows by half after every round up
+    to max_delay and is jittered, never beyond max_delay, so concurrent jobs do
+    not poll in lockstep. Throttled polls are retried on the next round.
+
+    Returns the last describe result of every instance that still exists,
+    keyed by identifier. When strict, RuntimeError is raised as soon as an
+    instance is gone or reports one of failed_statuses, and once the timeout
+    has passed. Otherwise such instances are no longer polled and the result
+    is returned once every instance is settled or the timeout has passed;
+    callers tell the outcomes apart by the statuses returned.
+    """
+    deadline = time.monotonic() + timeout
+    remaining = list(identifiers)
+    db_instances = {}
+    delay = initial_delay
+
+    while True:
+        try:
+            described = describe_db_instances(client, remaining)
+        except ClientError as err:
+            if err.response.get('Error', {}).get('Code') not in THROTTLE_ERROR_CODES:
+                raise
+        else:
+            missing = [identifier for identifier in remaining if identifier not in described]
+            failed = [identifier for identifier, db_instance in described.items()
+                      if db_instance['DBInstanceStatus'] in failed_statuses]
+            if strict and missing:
+                raise RuntimeError(f"DB instance(s) {', '.join(missing)} not found")
+            if strict and failed:
+                raise RuntimeError(f"DB instance {failed[0]} is {described[failed[0]]['DBInstanceStatus']} and "
+                                   f"will not become '{target_status}'")
+
+            for identifier in missing:
+                db_instances.pop(identifier, None)
+            db_instances.update(described)
+            remaining = [identifier for identifier, db_instance in described.items()
+                         if identifier not in failed and db_instance['DBInstanceStatus'] != target_status]
+
+        if not remaining:
+            return db_instances
+
+        time_left = deadline - time.monotonic()
+        if time_left <= 0:
+            if strict:
+                raise RuntimeError(f"DB instance(s) {', '.join(remaining)} did not reach '{target_status}' "
+                                   f"within {timeout} seconds")
+            return db_instances
+
+        time.sleep(min(delay * random.uniform(0.75, 1.25), max_delay, time_left))
+        delay = min(delay * 1.5, max_delay)
+# END RDS status wait
+
+
+# BEGIN resource attribute writer, synced from "Shared Plug-in Code/resource_attributes.py"
+def get_custom_field_values(field, values):
+    """
+    Return {value: CustomFieldValue} for one field, creating the values that do
+    not exist yet. Values of the types in VALUE_COLUMNS are looked up and
+    created in bulk on their own column.
+    """
+    if field.type not in VALUE_COLUMNS:
+        return {value: CustomFieldValue.objects.get_or_create(field=field, value=value)[0] for value in values}
+
+    column = VALUE_COLUMNS[field.type][0]
+    values = list(values)
+    cfvs = {}
+    for start in range(0, len(values), WRITE_BATCH_SIZE):
+        batch = values[start:start + WRITE_BATCH_SIZE]
+        found = CustomFieldValue.objects.filter(field=field, **{column + '__in': batch})
+        cfvs.update({getattr(cfv, column): cfv for cfv in found})
+
+        missing = [value for value in batch if value not in cfvs]
+        if missing:
+            # bulk_create does not return primary keys on every database, so read them back
+            CustomFieldValue.objects.bulk_create(
+                [CustomFieldValue(field=field, **{column: value}) for value in missing])
+            created = CustomFieldValue.objects.filter(field=field, **{column + '__in': missing})
+            cfvs.update({getattr(cfv, column): cfv for cfv in created})
+
+    return cfvs
+
+
+def write_resource_attributes(updates):
+    """
+    Write {resource: {attribute: value}} for many resources at once.
+
+    Current values come from one prefetch and only the attributes that changed
+    are written: resource columns such as name with one bulk_update, custom
+    field values with a bulk delete and a bulk insert on the attributes table.
+    A value of None clears the attribute. A resource that changes also has its
+    discovery fingerprint emptied, unless the update sets it.
+    """
+    resources = list(updates)
+    prefetch_related_objects(resources, 'attributes__field')
+
+    names = {name for values in updates.values() for name in values if name not in RESOURCE_COLUMNS}
+    fields = {field.name: field for field in CustomField.objects.filter(name__in=names)}
+
+    changed_resources, removed, added = [], [], defaultdict(list)
+    for resource, values in updates.items():
+        current = {cfv.field.name: cfv for cfv in resource.attributes.all()}
+        changed = False
+
+        for name, value in values.items():
+            if name in RESOURCE_COLUMNS:
+                if getattr(resource, name) != value:
+                    setattr(resource, name, value)
+                    changed_resources.append(resource)
+                    changed = True
+                continue
+
+            field = fields.get(name)
+            if field is None:
+                logger.warning(f'Custom field {name} does not exist, not writing it for {resource}')
+                continue
+
+            if value is not None and field.type in VALUE_COLUMNS:
+                value = VALUE_COLUMNS[field.type][1](value)
+
+            cfv = current.get(name)
+            if cfv is not None and value is not None and str(cfv.value) == str(value):
+                continue
+            changed = True
+            if cfv is not None:
+                removed.append(Q(resource_id=resource.id, customfieldvalue_id=cfv.id))
+            if value is not None:
+                added[name].append((resource, value))
+
+        fingerprint = current.get(DISCOVERY_FINGERPRINT)
+        if changed and fingerprint is not None and fingerprint.value and DISCOVERY_FINGERPRINT not in values:
+            fields.setdefault(DISCOVERY_FINGERPRINT, fingerprint.field)
+            removed.append(Q(resource_id=resource.id, customfieldvalue_id=fingerprint.id))
+            added[DISCOVERY_FINGERPRINT].append((resource, ''))
+
+    if changed_resources:
+        Resource.objects.bulk_update(set(changed_resources), RESOURCE_COLUMNS, batch_size=WRITE_BATCH_SIZE)
+
+    through = Resource.attributes.through
+    for start in range(0, len(removed), WRITE_BATCH_SIZE):
+        through.objects.filter(reduce(operator.or_, removed[start:start + WRITE_BATCH_SIZE])).delete()
+
+    links = []
+    for name, pairs in added.items():
+        cfvs = get_custom_field_values(fields[name], {value for _, value in pairs})
+        links.extend(through(resource_id=resource.id, customfieldvalue_id=cfvs[value].id) for resource, value in pairs)
+    through.objects.bulk_create(links, batch_size=WRITE_BATCH_SIZE)
+
+    # the prefetched attributes no longer match the database
+    for resource in resources:
+        getattr(resource, '_prefetched_objects_cache', {}).pop('attributes', None)
+# END resource attribute writer
+
+
+def boto_instance_to_dict(boto_instance, region, handler):
     """
     Create a pared-down representation of an PostgreSQL database from the full boto dictionary.
     """
 
     instance = {
         'name': boto_instance['DBInstanceIdentifier'],
-        'aws_region': env.aws_region,
-        'aws_rh_id': env.resource_handler.cast().id,
+        'aws_region': region,
+        'aws_rh_id': handler.id,
         'db_identifier': boto_instance['DBInstanceIdentifier'],
         'db_engine': boto_instance['Engine'],
         'db_status': boto_instance['DBInstanceStatus'],
@@ -293,15 +1109,6 @@ def boto_instance_to_dict(boto_instance, env, client):
 
     # Endpoint may not be returned if networking is not set up yet
     endpoint = boto_instance.get('Endpoint', {})
-    
-    if not endpoint:
-        time.sleep(10)
-        
-        # fetch PostgreSQL database instance
-        postgres_response = client.describe_db_instances(DBInstanceIdentifier=boto_instance['DBInstanceIdentifier'], 
-                                    Filters=[{'Name':'engine','Values':[boto_instance['Engine']]}])['DBInstances']
-        if postgres_response:
-            endpoint = postgres_response[0].get('Endpoint', {})
 
     instance.update({'db_endpoint_address': endpoint.get('Address'), 
         'db_endpoint_port': endpoint.get('Port'), 
@@ -311,7 +1118,144 @@ def boto_instance_to_dict(boto_instance, env, client):
     logger.info(f'PostgreSQL database {instance} created successfully.')
 
     return instance
-    
+
+
+def hydrate_resource(resource, boto_instance, region, handler, **attributes):
+    """
+    Copy a described DB instance, plus any extra attributes, onto its resource,
+    writing only the attributes that changed.
+    """
+    instance = boto_instance_to_dict(boto_instance, region, handler)
+    instance.update(attributes)
+
+    write_resource_attributes({resource: instance})
+
+
+def check_db_identifier(client, payload):
+    """
+    Check that the identifier and database name are valid and that no DB
+    instance uses the identifier yet.
+    """
+    identifier = payload['DBInstanceIdentifier']
+    if not DB_IDENTIFIER_PATTERN.match(identifier):
+        return [f'"{identifier}" is not a valid DB instance identifier: use 1 to 63 letters, digits or hyphens, '
+                'starting with a letter, without two consecutive hyphens or a trailing hyphen']
+    if not DB_NAME_PATTERN.match(payload['DBName']):
+        return [f'"{payload["DBName"]}" is not a valid PostgreSQL database name: use letters, digits or underscores, '
+                'starting with a letter']
+
+    try:
+        client.describe_db_instances(DBInstanceIdentifier=identifier)
+    except ClientError as err:
+        if err.response.get('Error', {}).get('Code') == 'DBInstanceNotFound':
+            return []
+        raise
+
+    return [f'DB instance {identifier} exists already']
+
+
+def check_account_quotas(client, payload):
+    """
+    Check that the account has room for one more DB instance and for its storage.
+    """
+    quotas = {quota['AccountQuotaName']: quota
+              for quota in client.describe_account_attributes()['AccountQuotas']}
+
+    problems = []
+    instances = quotas.get('DBInstances')
+    if instances and instances['Used'] + 1 > instances['Max']:
+        problems.append('the DB instance quota of {0} is used up'.format(instances['Max']))
+
+    # AllocatedStorage is reported in GiB, like the payload
+    storage = quotas.get('AllocatedStorage')
+    if storage and storage['Used'] + payload['AllocatedStorage'] > storage['Max']:
+        problems.append('{0} GiB of storage would exceed the storage quota ({1} of {2} GiB used)'.format(
+            payload['AllocatedStorage'], storage['Used'], storage['Max']))
+
+    return problems
+
+
+def check_db_subnet_group(env, client):
+    """
+    Check that the instance can be placed. No subnet group is given, so RDS
+    uses the default one, which needs a default VPC with subnets in two zones.
+    """
+    try:
+        subnet_group = client.describe_db_subnet_groups(DBSubnetGroupName='default')['DBSubnetGroups'][0]
+    except ClientError as err:
+        if err.response.get('Error', {}).get('Code') != 'DBSubnetGroupNotFoundFault':
+            raise
+        # RDS creates the default subnet group on first use if there is a default VPC
+        ec2 = get_boto3_service_client(env, 'ec2')
+        if not ec2.describe_vpcs(Filters=[{'Name': 'isDefault', 'Values': ['true']}])['Vpcs']:
+            return [f'{env.aws_region} has no default VPC and no default DB subnet group']
+        return []
+
+    zones = {subnet['SubnetAvailabilityZone']['Name'] for subnet in subnet_group.get('Subnets', [])
+             if subnet.get('SubnetStatus', 'Active') == 'Active'}
+    if len(zones) < 2:
+        return ['the default DB subnet group of {0} covers {1} availability zone(s), at least 2 are needed'.format(
+            env.aws_region, len(zones))]
+
+    return []
+
+
+def check_orderable(env, payload):
+    """
+    Check the engine version, instance class, storage type and size against the
+    cached catalogs the order form was built from.
+    """
+    engine_version, instance_class = payload['EngineVersion'], payload['DBInstanceClass']
+    if engine_version not in {version['EngineVersion'] for version in get_db_engine_versions(env)}:
+        return [f'PostgreSQL {engine_version} is not available in {env.aws_region}']
+
+    options = [option for option in get_orderable_instance_options(env, engine_version)
+               if option['DBInstanceClass'] == instance_class and option['StorageType'] == payload['StorageType']]
+    if not options:
+        return [f'{instance_class} with {payload["StorageType"]} storage cannot be ordered for PostgreSQL '
+                f'{engine_version} in {env.aws_region}']
+
+    storage = payload['AllocatedStorage']
+    if not any(option.get('MinStorageSize', 0) <= storage <= option.get('MaxStorageSize', storage)
+               for option in options):
+        return ['{0} GiB is outside the storage sizes {1} supports'.format(storage, instance_class)]
+
+    return []
+
+
+def run_preflight_checks(env, client, payload):
+    """
+    Run the pre-flight checks concurrently and return the problems found. A
+    check that cannot run, for example for lack of permissions, is reported
+    in the job progress and does not block the order.
+    """
+    checks = {
+        'identifier': (check_db_identifier, client, payload),
+        'account quotas': (check_account_quotas, client, payload),
+        'subnet group': (check_db_subnet_group, env, client),
+        'orderable options': (check_orderable, env, payload),
+    }
+
+    def run_check(check, *args):
+        try:
+            return check(*args)
+        finally:
+            # worker threads get their own DB connections, don't leak them
+            connections.close_all()
+
+    problems = []
+    with ThreadPoolExecutor(max_workers=len(checks)) as executor:
+        futures = {name: executor.submit(run_check, *check) for name, check in checks.items()}
+        for name, future in futures.items():
+            try:
+                problems.extend(future.result())
+            except (ClientError, BotoCoreError) as err:
+                set_progress(f'Pre-flight check of the {name} skipped: {err}')
+
+    return problems
+
+
+@trace_api_calls
 def run(job, logger=None, **kwargs):
     set_progress('Creating AWS PostgreSQL database...')
     logger.info('Creating AWS PostgreSQL database...')
@@ -356,6 +1300,12 @@ def run(job, logger=None, **kwargs):
     if storage_type == 'io1':
         postgres_payload['Iops'] = 1000
             
+    if PREFLIGHT_ENABLED:
+        set_progress('Validating the PostgreSQL database order...')
+        problems = run_preflight_checks(env, client, postgres_payload)
+        if problems:
+            return "FAILURE", "The PostgreSQL database cannot be created", '; '.join(problems)
+
     set_progress('Create PostgreSQL database "{}"'.format(db_identifier))
     
     
@@ -366,22 +1316,32 @@ def run(job, logger=None, **kwargs):
             return ("FAILURE", "Database already exists", "DB instance %s exists already" % db_identifier)
         raise
     
-    # It takes awhile for the DB to be created and backed up.
-    waiter = client.get_waiter('db_instance_available')
-    waiter.config.max_attempts = 100  # default is 40 but oracle takes more time.
-    waiter.wait(DBInstanceIdentifier=db_identifier)
+    if ASYNC_PROVISIONING:
+        db_instance = postgres_response['DBInstance']
+
+        write_resource_attributes({resource: {
+            'name': db_identifier,
+            'aws_region': env.aws_region,
+            'aws_rh_id': env.resource_handler.cast().id,
+            'db_identifier': db_identifier,
+            'db_engine': db_instance['Engine'],
+            'db_status': db_instance['DBInstanceStatus'],
+            'db_username': db_instance['MasterUsername'],
+            'db_provisioning_state': 'pending',
+        }})
+
+        set_progress(f'PostgreSQL database {db_identifier} submitted, it will be completed by the provisioning poller.')
+
+        return 'SUCCESS', f'PostgreSQL database {db_identifier} submitted for provisioning.', ''
     
-    logger.info(f"PostgreSQL instance response {postgres_response}")
+    # It takes awhile for the DB to be created and backed up. The final describe
+    # result already carries the endpoint, so it is used for hydration directly.
+    db_instance = wait_for_db_instances_status(client, [db_identifier], 'available', CREATE_TIMEOUT,
+                                               POLL_INITIAL_DELAY, POLL_MAX_DELAY, FAILED_STATUSES)[db_identifier]
     
-    # convert boto model into cb PostgreSQL dict
-    postgresql_instance = boto_instance_to_dict(postgres_response['DBInstance'], env, client)
+    logger.info(f"PostgreSQL instance response {db_instance}")
     
-
-    for key, value in postgresql_instance.items():
-        setattr(resource, key, value) # set custom field value
-
-    resource.name = db_identifier
-    resource.save()
+    hydrate_resource(resource, db_instance, env.aws_region, env.resource_handler.cast())
 
     set_progress(f'PostgreSQL database {db_identifier} created successfully.')
     
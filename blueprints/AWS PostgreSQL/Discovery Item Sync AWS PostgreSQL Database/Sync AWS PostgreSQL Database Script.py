@@ -1,56 +1,622 @@
+import bisect
+import fcntl
+import hashlib
+import inspect
 import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import types
+from collections import deque, OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from django.core.cache.backends.filebased import FileBasedCache
+from django.db import connections
 from common.methods import set_progress
 from infrastructure.models import CustomField
 from resourcehandlers.aws.models import AWSHandler
+from resources.models import Resource
 from botocore.client import ClientError
+from botocore.exceptions import BotoCoreError
 from utilities.logger import ThreadLogger
 
 logger = ThreadLogger(__name__)
 
+# BEGIN AWS client pool constants, synced from "Shared Plug-in Code/aws_client_pool.py"
+# boto3 clients and resources are shared by every AWS plug-in in this process.
+# They are built by the resource handler, so its IAM role, proxy and partition
+# settings apply, and the pool keeps at most CLIENT_POOL_MAX_SIZE of them,
+# evicting the least recently used. The first plug-in to run registers the pool
+# under CLIENT_POOL_MODULE and every later one uses it, so the version in the
+# name must be bumped whenever this section or the pool code changes.
+CLIENT_POOL_MODULE = 'cloudbolt_aws_client_pool_v4'
+CLIENT_POOL_MAX_SIZE = 256
+
+# Every AWS call made through the pool first takes a token from a bucket shared
+# by all CloudBolt worker processes on this host. There is one bucket per
+# handler, region, service and API family, stored in RATE_LIMIT_DIR and guarded
+# by a file lock. RATE_LIMITS gives the calls per second and burst size of each
+# family. Background calls leave RATE_LIMIT_INTERACTIVE_RESERVE tokens in the
+# bucket so order form calls, made in the priority lane, are not queued behind them.
+RATE_LIMIT_DIR = '/var/tmp/cloudbolt_aws_rate_limits'
+RATE_LIMITS = {'read': (10, 40), 'write': (2, 10)}
+RATE_LIMIT_INTERACTIVE_RESERVE = 5
+RATE_LIMIT_READ_PREFIXES = ('Describe', 'List', 'Get')
+
+# Set API_TRACE_ENABLED to time every AWS call made while run() or
+# discover_resources() executes, per operation and region, with retries,
+# throttles and rate limiter waits. A summary is added to the job progress at
+# the end and, when API_TRACE_DIR is set, every call is written there as JSON.
+API_TRACE_ENABLED = False
+API_TRACE_DIR = ''
+THROTTLE_ERROR_CODES = ['Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException',
+                        'RequestThrottled', 'SlowDown']
+# END AWS client pool constants
+
 RESOURCE_IDENTIFIER = ['db_identifier', 'aws_region']
 
+DB_ENGINE = 'postgres'
+
+# Engines kept in the shared RDS inventory snapshot. The MySQL and PostgreSQL
+# discovery plugins both read from it, so one sweep per region serves both.
+SHARED_INVENTORY_ENGINES = ['mysql', 'postgres']
+
+# Seconds a shared inventory snapshot stays valid. Set to 0 to skip the
+# snapshot and have the sweep filter on DB_ENGINE only.
+INVENTORY_SNAPSHOT_TTL = 600
+
+# The snapshots are kept in an on-disk cache shared by every job worker on this
+# host, whatever cache backend CloudBolt is configured with. The sweep of a
+# region is guarded by a file lock in INVENTORY_CACHE_DIR/locks so only one
+# worker sweeps it at a time. A region whose lock cannot be taken is swept
+# without it.
+INVENTORY_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'cb_rds_inventory_cache')
+INVENTORY_CACHE_MAX_ENTRIES = 2000
+
+inventory_cache = FileBasedCache(INVENTORY_CACHE_DIR, {
+    'TIMEOUT': INVENTORY_SNAPSHOT_TTL,
+    'OPTIONS': {'MAX_ENTRIES': INVENTORY_CACHE_MAX_ENTRIES},
+})
+
+# Number of (handler, region) pairs swept concurrently.
+MAX_WORKERS = 16
+
+# Regions fetched ahead of the one being returned. Bounds how many region
+# results are held in memory at once while records are streamed out.
+MAX_REGIONS_AHEAD = 2 * MAX_WORKERS
+
+# Seconds a single region may spend paginating before its sweep is cut short.
+REGION_TIME_BUDGET = 300
+
+# Discovery returns only the databases that are new, changed or gone since the
+# last sync. Set to True to return every database, e.g. after editing resources
+# by hand.
+FORCE_FULL_RESYNC = False
+
+# Fingerprint stored on a database that has been reported as gone, so it is
+# reported only once
+VANISHED_FINGERPRINT = 'vanished'
+
+# Custom fields used by this blueprint, created on first use
+CUSTOM_FIELDS = [
+    {'name': 'db_endpoint_address', 'label': 'Endpoint Address', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint', 'show_on_servers': True},
+    {'name': 'db_endpoint_port', 'label': 'Endpoint Port', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint', 'show_on_servers': True},
+    {'name': 'db_status', 'label': 'Database Status', 'type': 'STR', 'description': 'PostgreSQl Database Status', 'show_on_servers': True},
+    {'name': 'db_username', 'label': 'Username', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint', 'show_on_servers': True},
+    {'name': 'discovery_fingerprint', 'label': 'Discovery Fingerprint', 'type': 'STR', 'description': 'Used by the AWS Databases blueprint'},
+]
+
+# Values that must outlive a job are kept in a module registered under this
+# name, shared by the CloudBolt plug-ins of this worker process
+PROCESS_STATE_MODULE = 'cloudbolt_plugin_process_state_v1'
+
+# Names of the custom fields known to exist, kept in the process state so later
+# jobs skip the custom field setup entirely
+ENSURED_CUSTOM_FIELDS_STATE = 'aws_postgresql_discovery.ensured_custom_fields'
+
+
+# BEGIN AWS client pool, synced from "Shared Plug-in Code/aws_client_pool.py"
+class APITrace(object):
+    """
+    The API calls made during one job: per operation and region counts,
+    time, retries, throttles and a latency histogram, plus every single call
+    when the trace is written to a file.
+    """
+    # upper bounds, in seconds, of the latency histogram buckets
+    HISTOGRAM_BOUNDS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+    def __init__(self, name, keep_calls=False):
+        self.name = name
+        self.started = time.time()
+        self.elapsed_started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.operations = {}
+        self.calls = [] if keep_calls else None
+
+    def record(self, operation, location, duration, retries=0, throttles=0, waited=0, error=None):
+        with self.lock:
+            stats = self.operations.get((operation, location))
+            if stats is None:
+                stats = self.operations[(operation, location)] = dict(
+                    calls=0, seconds=0, max_seconds=0, retries=0, throttles=0, errors=0, waited_seconds=0,
+                    histogram=[0] * (len(self.HISTOGRAM_BOUNDS) + 1))
+            stats['calls'] += 1
+            stats['seconds'] += duration
+            stats['max_seconds'] = max(stats['max_seconds'], duration)
+            stats['retries'] += retries
+            stats['throttles'] += throttles
+            stats['errors'] += 1 if error else 0
+            stats['waited_seconds'] += waited
+            stats['histogram'][bisect.bisect_left(self.HISTOGRAM_BOUNDS, duration)] += 1
+
+            if self.calls is not None:
+                self.calls.append(dict(at=round(time.time() - self.started, 4), operation=operation,
+                                       location=location, seconds=round(duration, 4), retries=retries,
+                                       throttles=throttles, waited_seconds=round(waited, 4), error=error))
+
+    def percentile(self, histogram, fraction):
+        """
+        Return the upper bound of the histogram bucket holding the given
+        fraction of the calls, or None when it is past the last bound.
+        """
+        target, seen = fraction * sum(histogram), 0
+        for bound, count in zip(self.HISTOGRAM_BOUNDS, histogram):
+            seen += count
+            if seen >= target:
+                return bound
+        return None
+
+    def summary(self, max_operations=10):
+        """
+        Return a few lines describing the trace, slowest operations first.
+        """
+        operations = sorted(self.operations.items(), key=lambda item: -item[1]['seconds'])
+        totals = {key: sum(stats[key] for _, stats in operations)
+                  for key in ['calls', 'seconds', 'retries', 'throttles', 'errors', 'waited_seconds']}
+
+        lines = ['{0}: {1} API call(s) taking {2:.1f}s{3}, {4} retries, {5} throttled, {6} failed, '
+                 'in {7:.1f}s elapsed'.format(
+                     self.name, totals['calls'], totals['seconds'],
+                     ', {0:.1f}s waiting on the rate limiter'.format(totals['waited_seconds'])
+                     if totals['waited_seconds'] else '',
+                     totals['retries'], totals['throttles'], totals['errors'],
+                     time.perf_counter() - self.elapsed_started)]
+
+        for (operation, location), stats in operations[:max_operations]:
+            p95 = self.percentile(stats['histogram'], 0.95)
+            lines.append('  {0} ({1}): {2} call(s), {3:.2f}s, avg {4:.0f}ms, p95 {5}, max {6:.0f}ms{7}{8}'.format(
+                operation, location, stats['calls'], stats['seconds'], stats['seconds'] / stats['calls'] * 1000,
+                '<{0:g}ms'.format(p95 * 1000) if p95 is not None else '>10s', stats['max_seconds'] * 1000,
+                ', {0} retries'.format(stats['retries']) if stats['retries'] else '',
+                ', {0} throttled'.format(stats['throttles']) if stats['throttles'] else ''))
+
+        return lines
+
+    def write(self, directory):
+        """
+        Write the whole trace as JSON to a new file in directory and return its path.
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, '{0}-{1}-{2}.json'.format(
+            re.sub(r'[^\w.-]+', '_', self.name), time.strftime('%Y%m%d%H%M%S', time.localtime(self.started)),
+            os.getpid()))
+
+        with open(path, 'w') as trace_file:
+            json.dump({
+                'name': self.name,
+                'started': self.started,
+                'elapsed_seconds': time.perf_counter() - self.elapsed_started,
+                'histogram_bounds': self.HISTOGRAM_BOUNDS,
+                'operations': [dict(stats, operation=operation, location=location)
+                               for (operation, location), stats in sorted(self.operations.items())],
+                'calls': self.calls or [],
+            }, trace_file)
+
+        return path
+
+
+class APITracer(object):
+    """
+    Routes API call timings to the traces of the jobs running in this process.
+
+    A call made by a thread that started a trace goes to that trace. Calls from
+    other threads, such as a job's worker pool, go to every active trace.
+    Without an active trace, recording costs one attribute check.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = []
+        self.local = threading.local()
+
+    def start(self, name, keep_calls=False):
+        trace = APITrace(name, keep_calls)
+        with self.lock:
+            self.active = self.active + [trace]
+        self.local.trace = trace
+        return trace
+
+    def finish(self, trace):
+        with self.lock:
+            self.active = [active for active in self.active if active is not trace]
+        if getattr(self.local, 'trace', None) is trace:
+            self.local.trace = None
+
+    def record(self, *args, **kwargs):
+        if not self.active:
+            return
+        trace = getattr(self.local, 'trace', None)
+        for trace in [trace] if trace is not None else self.active:
+            trace.record(*args, **kwargs)
+
+
+def register_trace_hooks(tracer, client, region, service_name):
+    """
+    Time every API call of a boto3 client into the tracer's active traces.
+    Retries and throttles are counted from botocore's needs-retry checks.
+    """
+    def before_call(model, context, **kwargs):
+        if tracer.active:
+            context['trace_operation'] = '{0}.{1}'.format(service_name, model.name)
+            context['trace_started'] = time.perf_counter()
+
+    def after_call(context, parsed=None, exception=None, **kwargs):
+        started = context.pop('trace_started', None)
+        if started is None:
+            return
+        parsed = parsed or {}
+        error = parsed.get('Error', {}).get('Code') or (exception is not None and type(exception).__name__) or None
+        tracer.record(context['trace_operation'], region, time.perf_counter() - started,
+                      retries=parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0),
+                      throttles=context.pop('trace_throttles', 0), waited=context.get('rate_limit_wait', 0),
+                      error=error)
+
+    def needs_retry(response=None, request_dict=None, **kwargs):
+        if response is None or request_dict is None or 'trace_started' not in request_dict.get('context', {}):
+            return
+        if response[1].get('Error', {}).get('Code') in THROTTLE_ERROR_CODES:
+            context = request_dict['context']
+            context['trace_throttles'] = context.get('trace_throttles', 0) + 1
+
+    client.meta.events.register('before-call', before_call)
+    client.meta.events.register('after-call', after_call)
+    client.meta.events.register('after-call-error', after_call)
+    client.meta.events.register('needs-retry', needs_retry)
+
+
+
+class AWSRateLimiter(object):
+    """
+    Token buckets shared between processes through files under RATE_LIMIT_DIR.
+
+    Each bucket file holds the token count and the time it was last updated;
+    a caller refills it for the time elapsed, takes a token if one is free and
+    otherwise sleeps for as long as the next token takes to arrive.
+    """
+    def __init__(self, directory=RATE_LIMIT_DIR):
+        self.directory = directory
+        self.local = threading.local()
+
+    @contextmanager
+    def interactive(self):
+        """
+        Run the calls made by this thread inside the block in the priority lane.
+        """
+        previous = getattr(self.local, 'interactive', False)
+        self.local.interactive = True
+        try:
+            yield
+        finally:
+            self.local.interactive = previous
+
+    def take(self, path, rate, burst, reserve):
+        """
+        Take one token from the bucket at path. Returns 0, or the seconds to
+        wait before trying again when the bucket is empty.
+        """
+        with open(path, 'a+') as bucket:
+            # the lock is released when the file is closed
+            fcntl.flock(bucket, fcntl.LOCK_EX)
+            bucket.seek(0)
+            state = bucket.read().split()
+            now = time.time()
+
+            tokens = burst
+            if len(state) == 2:
+                tokens = min(burst, float(state[0]) + max(now - float(state[1]), 0) * rate)
+
+            wait = 0
+            if tokens >= reserve + 1:
+                tokens -= 1
+            else:
+                wait = (reserve + 1 - tokens) / rate
+
+            bucket.seek(0)
+            bucket.truncate()
+            bucket.write('{0} {1}'.format(tokens, now))
+
+        return wait
+
+    def acquire(self, handler_id, region, service_name, operation_name):
+        """
+        Wait for a token and return the seconds spent waiting.
+        """
+        family = 'read' if operation_name.startswith(RATE_LIMIT_READ_PREFIXES) else 'write'
+        rate, burst = RATE_LIMITS[family]
+        reserve = 0 if getattr(self.local, 'interactive', False) else min(RATE_LIMIT_INTERACTIVE_RESERVE, burst - 1)
+        path = os.path.join(self.directory, '{0}-{1}-{2}-{3}'.format(handler_id, region, service_name, family))
+
+        waited = 0
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            wait = self.take(path, rate, burst, reserve)
+            while wait:
+                time.sleep(wait)
+                waited += wait
+                wait = self.take(path, rate, burst, reserve)
+        except OSError as err:
+            # never fail an AWS call because the buckets cannot be read
+            logger.warning('AWS rate limiter unavailable, not limiting {0}: {1}'.format(path, err))
+
+        return waited
+
+    def register(self, client, handler_id, region, service_name):
+        """
+        Make every API call of a boto3 client wait for a token first.
+        """
+        def before_call(model, context, **kwargs):
+            context['rate_limit_wait'] = self.acquire(handler_id, region, service_name, model.name)
+
+        client.meta.events.register('before-call', before_call)
+
+
+class AWSClientPool(object):
+    """
+    Process-wide LRU pool of boto3 clients and resources.
+
+    Entries are keyed by (handler id, credentials version, region, service,
+    kind). Clients are thread safe and shared by every thread; resources are
+    not, so they are also keyed by thread. Changing a handler's credentials
+    changes its version, which drops every entry built with the old ones.
+    """
+    def __init__(self, max_size=CLIENT_POOL_MAX_SIZE):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.build_locks = {}
+        self.versions = {}
+        self.limiter = AWSRateLimiter()
+        self.tracer = APITracer()
+
+    @staticmethod
+    def get_credentials_version(handler):
+        credentials = '{0}:{1}'.format(handler.serviceaccount, handler.servicepasswd)
+        return hashlib.sha1(credentials.encode('utf-8')).hexdigest()[:16]
+
+    def get_build_lock(self, handler, version):
+        """
+        Return the lock serializing builds for one handler and credentials
+        version. Must be called with self.lock held.
+        """
+        if self.versions.get(handler.id) != version:
+            # the credentials were rotated, forget everything built with the old ones
+            for key in [key for key in self.entries if key[0] == handler.id]:
+                del self.entries[key]
+            self.build_locks.pop((handler.id, self.versions.get(handler.id)), None)
+            self.versions[handler.id] = version
+
+        return self.build_locks.setdefault((handler.id, version), threading.Lock())
+
+    @staticmethod
+    def build(handler, region, service_name, kind):
+        """
+        Build a client or resource with the handler's own boto3 factories, which
+        apply its IAM role, proxy and partition endpoint settings.
+        """
+        if kind == 'resource':
+            return handler.get_api_wrapper().get_boto3_resource(
+                handler.serviceaccount, handler.servicepasswd, region, service_name)
+        return handler.get_boto3_client(region, service_name)
+
+    def get(self, handler, region, service_name, kind='client'):
+        version = self.get_credentials_version(handler)
+        key = (handler.id, version, region, service_name, kind)
+        if kind == 'resource':
+            key += (threading.get_ident(),)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry
+            build_lock = self.get_build_lock(handler, version)
+
+        # boto3 sessions are not thread safe, build one client at a time per handler
+        with build_lock:
+            entry = self.build(handler, region, service_name, kind)
+            client = entry.meta.client if kind == 'resource' else entry
+            self.limiter.register(client, handler.id, region, service_name)
+            register_trace_hooks(self.tracer, client, region, service_name)
+
+        with self.lock:
+            entry = self.entries.setdefault(key, entry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+        return entry
+
+
+def get_client_pool():
+    """
+    Return the AWS client pool shared by every AWS plug-in in this process.
+    Plug-ins are loaded as separate modules, so the pool is registered under a
+    well-known module name that the first plug-in to run creates.
+    """
+    module = sys.modules.get(CLIENT_POOL_MODULE)
+    if module is None:
+        module = types.ModuleType(CLIENT_POOL_MODULE)
+        module.pool = AWSClientPool()
+        # setdefault is atomic, if two plug-ins race only one pool survives
+        module = sys.modules.setdefault(CLIENT_POOL_MODULE, module)
+
+    return module.pool
+
+
+def get_aws_client(handler, region, service_name):
+    """
+    Return a pooled boto3 client for the handler's credentials in region.
+    """
+    return get_client_pool().get(handler, region, service_name, 'client')
+
+
+def get_aws_resource(handler, region, service_name):
+    """
+    Return a pooled boto3 resource, private to the calling thread, for the
+    handler's credentials in region.
+    """
+    return get_client_pool().get(handler, region, service_name, 'resource')
+
+
+def interactive_aws_calls():
+    """
+    Put the AWS calls made inside the block, or the decorated function, in the
+    rate limiter's priority lane so order forms do not wait on background jobs.
+    """
+    return get_client_pool().limiter.interactive()
+
+
+def trace_api_calls(function):
+    """
+    When API_TRACE_ENABLED is set, trace the AWS calls made while function
+    runs and report them when it returns. Generator functions, such as
+    discover_resources, are traced until they are exhausted.
+    """
+    def start():
+        return get_client_pool().tracer.start('{0}.{1}'.format(function.__module__, function.__name__),
+                                keep_calls=bool(API_TRACE_DIR))
+
+    def finish(trace):
+        get_client_pool().tracer.finish(trace)
+        for line in trace.summary():
+            set_progress(line)
+        if API_TRACE_DIR:
+            try:
+                set_progress('API trace written to {0}'.format(trace.write(API_TRACE_DIR)))
+            except OSError as err:
+                set_progress('Could not write the API trace: {0}'.format(err))
+
+    if inspect.isgeneratorfunction(function):
+        @wraps(function)
+        def traced_generator(*args, **kwargs):
+            if not API_TRACE_ENABLED:
+                return (yield from function(*args, **kwargs))
+            trace = start()
+            try:
+                return (yield from function(*args, **kwargs))
+            finally:
+                finish(trace)
+
+        return traced_generator
+
+    @wraps(function)
+    def traced(*args, **kwargs):
+        if not API_TRACE_ENABLED:
+            return function(*args, **kwargs)
+        trace = start()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            finish(trace)
+
+    return traced
+# END AWS client pool
+
+
+def get_process_state(key, default_factory):
+    """
+    Return the value kept under key for the life of this worker process,
+    creating it with default_factory() on first use. CloudBolt executes the
+    plug-in afresh for every job, so module globals are lost between jobs;
+    the state lives in a module registered under PROCESS_STATE_MODULE instead.
+    """
+    module = sys.modules.get(PROCESS_STATE_MODULE)
+    if module is None:
+        # setdefault is atomic, if two plug-ins race only one module survives
+        module = sys.modules.setdefault(PROCESS_STATE_MODULE, types.ModuleType(PROCESS_STATE_MODULE))
+
+    state = module.__dict__
+    if key not in state:
+        state.setdefault(key, default_factory())
+    return state[key]
+
+
 def get_or_create_custom_fields_as_needed():
-    CustomField.objects.get_or_create(
-        name='db_endpoint_address',
-        defaults={
-            "label": 'Endpoint Address',
-            "type": 'STR',
-            "description": 'Used by the AWS Databases blueprint',
-            "show_on_servers": True
-        }
-    )
+    """
+    Create any field in CUSTOM_FIELDS that does not exist yet, with one query
+    for the existing names and one bulk insert for the rest.
+    """
+    ensured = get_process_state(ENSURED_CUSTOM_FIELDS_STATE, set)
+    missing = [field for field in CUSTOM_FIELDS if field['name'] not in ensured]
+    if not missing:
+        return
 
-    CustomField.objects.get_or_create(
-        name='db_endpoint_port',
-        defaults={
-            "label": 'Endpoint Port',
-            "type": 'STR',
-            "description": 'Used by the AWS Databases blueprint',
-            "show_on_servers": True
-        }
-    )
+    existing = set(CustomField.objects.filter(
+        name__in=[field['name'] for field in missing]).values_list('name', flat=True))
 
-    CustomField.objects.get_or_create(
-        name='db_status',
-        defaults={
-            "label": 'Database Status',
-            "type": 'STR',
-            "description": 'PostgreSQl Database Status',
-            "show_on_servers": True
-        }
+    # ignore_conflicts lets concurrent jobs race on the same new field safely
+    CustomField.objects.bulk_create(
+        [CustomField(**field) for field in missing if field['name'] not in existing],
+        ignore_conflicts=True,
     )
+    ensured.update(field['name'] for field in missing)
+
+
+class DiscoveredDatabase(Mapping):
+    """
+    Read-only dict-like record of one discovered database.
+
+    Slots replace the per-record dict, and values that repeat across the
+    estate (region, engine, status, subnet group...) are interned, so a large
+    sweep holds one copy of each instead of one per database.
+    """
+    __slots__ = ('name', 'aws_region', 'aws_rh_id', 'db_identifier', 'db_engine', 'db_status', 'db_username',
+                 'db_publicly_accessible', 'db_availability_zone', 'db_cluster_identifier', 'db_endpoint_address',
+                 'db_endpoint_port', 'db_subnet_group', 'db_subnets', 'discovery_fingerprint')
+
+    INTERNED = frozenset(['aws_region', 'db_engine', 'db_status', 'db_username', 'db_availability_zone',
+                          'db_subnet_group'])
+
+    def __init__(self, **values):
+        for key, value in values.items():
+            if key in self.INTERNED and isinstance(value, str):
+                value = sys.intern(value)
+            elif key == 'db_subnets':
+                value = [sys.intern(subnet) for subnet in value]
+            setattr(self, key, value)
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __iter__(self):
+        return (key for key in self.__slots__ if hasattr(self, key))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({dict(self)!r})'
+
 
-    CustomField.objects.get_or_create(
-        name='db_username',
-        defaults={
-            "label": 'Username',
-            "type": 'STR',
-            "description": 'Used by the AWS Databases blueprint',
-            "show_on_servers": True
-        }
-    )
-    
-    
 def boto_instance_to_dict(boto_instance, region, handler):
     """
     Create a pared-down representation of an PostgreSQL database from the full boto
@@ -85,31 +651,193 @@ def boto_instance_to_dict(boto_instance, region, handler):
     return instance
 
 
+def describe_region_db_instances(handler, region, engines):
+    """
+    Walk the describe_db_instances paginator for one handler/region pair,
+    filtering server-side on the given engines.
+
+    Returns a (db_instances, error) tuple. Once the region exceeds
+    REGION_TIME_BUDGET the sweep stops and the pages fetched so far are kept.
+    """
+    started = time.monotonic()
+    db_instances = []
+    try:
+        rds = get_aws_client(handler, region, 'rds')
+        paginator = rds.get_paginator('describe_db_instances')
+        for page in paginator.paginate(Filters=[{'Name': 'engine', 'Values': engines}]):
+            db_instances.extend(page['DBInstances'])
+            if time.monotonic() - started > REGION_TIME_BUDGET:
+                return db_instances, f'time budget of {REGION_TIME_BUDGET}s exceeded, results are partial'
+    except (ClientError, BotoCoreError) as e:
+        return db_instances, f'AWS error: {e}'
+    finally:
+        # worker threads get their own DB connections, don't leak them
+        connections.close_all()
+
+    return db_instances, None
+
+
+def get_region_db_instances(handler, region):
+    """
+    Return the DB instances of one handler/region pair from the shared RDS
+    inventory snapshot, sweeping the region only when no fresh snapshot exists.
+    """
+    if not INVENTORY_SNAPSHOT_TTL:
+        return describe_region_db_instances(handler, region, [DB_ENGINE])
+
+    snapshot_key = 'rds_inventory:{0}:{1}'.format(handler.id, region)
+
+    db_instances = inventory_cache.get(snapshot_key)
+    if db_instances is not None:
+        return db_instances, None
+
+    lock_dir = os.path.join(INVENTORY_CACHE_DIR, 'locks')
+    lock = None
+    try:
+        os.makedirs(lock_dir, exist_ok=True)
+        lock = open(os.path.join(lock_dir, '{0}-{1}'.format(handler.id, region)), 'a')
+        # the other RDS discovery plugin may be sweeping this region right now,
+        # wait for its snapshot rather than paying for a second sweep
+        deadline = time.monotonic() + REGION_TIME_BUDGET
+        while True:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    break
+                time.sleep(2)
+    except OSError as err:
+        # a sweep the other plugin may repeat is better than no sweep at all
+        logger.warning('RDS inventory lock unavailable, sweeping {0} without it: {1}'.format(region, err))
+
+    try:
+        db_instances = inventory_cache.get(snapshot_key)
+        if db_instances is not None:
+            return db_instances, None
+
+        db_instances, error = describe_region_db_instances(handler, region, SHARED_INVENTORY_ENGINES)
+        # partial sweeps are used for this run only, never shared
+        if error is None:
+            inventory_cache.set(snapshot_key, db_instances, INVENTORY_SNAPSHOT_TTL)
+    finally:
+        if lock is not None:
+            lock.close()
+
+    return db_instances, error
+
+
+def get_fingerprint(record):
+    """
+    Return a stable hash of a discovered database dict.
+    """
+    return hashlib.sha1(json.dumps(record, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def get_stored_fingerprints():
+    """
+    Return the fingerprints stored by earlier syncs, keyed by
+    (aws_rh_id, aws_region, db_identifier).
+    """
+    resources = Resource.objects.filter(
+        lifecycle='ACTIVE', attributes__field__name='discovery_fingerprint',
+    ).distinct().prefetch_related('attributes__field')
+
+    fingerprints = {}
+    for resource in resources:
+        values = {cfv.field.name: cfv.value for cfv in resource.attributes.all()}
+        if values.get('db_identifier') and values.get('db_engine') in [DB_ENGINE, None]:
+            key = (str(values.get('aws_rh_id')), values.get('aws_region'), values['db_identifier'])
+            fingerprints[key] = values['discovery_fingerprint']
+
+    return fingerprints
+
+
+def sweep_regions(executor, sweeps):
+    """
+    Submit the region sweeps and yield (handler, region, future) in submission
+    order, never holding more than MAX_REGIONS_AHEAD regions at once.
+    """
+    pending = deque()
+    for handler, region in sweeps:
+        pending.append((handler, region, executor.submit(get_region_db_instances, handler, region)))
+        if len(pending) >= MAX_REGIONS_AHEAD:
+            yield pending.popleft()
+
+    while pending:
+        yield pending.popleft()
+
+
+def get_region_records(handler, region, future, stored, swept):
+    """
+    Yield a DiscoveredDatabase for every new or changed PostgreSQL database of one
+    swept region, and None for every unchanged one.
+    """
+    db_instances, error = future.result()
+    if error:
+        set_progress(f'{handler} ({region}): {error}')
+    else:
+        swept.add((str(handler.id), region))
+
+    for db_instance in sorted(db_instances, key=lambda db: db['DBInstanceIdentifier']):
+
+        if db_instance['Engine'] != DB_ENGINE:
+            continue
+
+        record = boto_instance_to_dict(db_instance, region, handler)
+        key = (str(handler.id), region, record['db_identifier'])
+
+        fingerprint = get_fingerprint(record)
+        if stored.pop(key, None) == fingerprint and not FORCE_FULL_RESYNC:
+            yield None
+            continue
+
+        yield DiscoveredDatabase(discovery_fingerprint=fingerprint, **record)
+
+
+@trace_api_calls
 def discover_resources(**kwargs):
+    """
+    Yield the new, changed and vanished PostgreSQL databases region by region, so
+    records can be reconciled while later regions are still being swept.
+    """
     set_progress(f"Started discovering PostgreSQL database on AWS.")
     logger.info(f"Started discovering PostgreSQL database on AWS.")
     
     # get or create custom fields
     get_or_create_custom_fields_as_needed()
     
-    discovered_postgresql_database = []
-    
     handler: AWSHandler
-    for handler in AWSHandler.objects.all():
-        for region in handler.current_regions():
-            rds = handler.get_boto3_client(region, 'rds')
-            try:
-                db_instances =  rds.describe_db_instances()['DBInstances']
-            except ClientError as e:
-                set_progress('AWS ClientError: {}'.format(e))
-                continue
+    sweeps = ((handler, region) for handler in AWSHandler.objects.order_by('id')
+              for region in sorted(handler.current_regions()))
     
-            
-            for db_instance in db_instances:
-                
-                if db_instance['Engine'] != 'postgres':
+    # fingerprints of the databases as they were last synced. Every database
+    # found is removed, so what remains at the end has vanished.
+    stored = get_stored_fingerprints()
+    swept, discovered, unchanged = set(), 0, 0
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        # regions come back in submission order so the result does not depend on which region answers first
+        for handler, region, future in sweep_regions(executor, sweeps):
+            for record in get_region_records(handler, region, future, stored, swept):
+                if record is None:
+                    unchanged += 1
                     continue
-                    
-                discovered_postgresql_database.append(boto_instance_to_dict(db_instance, region, handler))
-                        
-    return discovered_postgresql_database
\ No newline at end of file
+                discovered += 1
+                yield record
+
+    # databases synced before but missing from a complete sweep of their region
+    for (rh_id, region, identifier), fingerprint in sorted(stored.items()):
+        if (rh_id, region) in swept and fingerprint != VANISHED_FINGERPRINT:
+            discovered += 1
+            yield DiscoveredDatabase(
+                name=identifier,
+                aws_region=region,
+                aws_rh_id=rh_id,
+                db_identifier=identifier,
+                db_status='deleted',
+                discovery_fingerprint=VANISHED_FINGERPRINT,
+            )
+
+    set_progress(f"Discovered {discovered} new, changed or deleted PostgreSQL database(s), "
+                 f"{unchanged} unchanged.")
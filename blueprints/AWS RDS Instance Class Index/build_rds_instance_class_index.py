@@ -0,0 +1,99 @@
+"""
+Build the RDS instance class capability index used by the order forms of the
+AWS MySQL and AWS PostgreSQL blueprints.
+
+RDS does not publish per-class hardware numbers, but every db.<type> class runs
+on the EC2 instance type of the same name, so the index is built offline from a
+saved `aws ec2 describe-instance-types` dump:
+
+    aws ec2 describe-instance-types --output json > ec2_instance_types_dump.json
+    python build_rds_instance_class_index.py ec2_instance_types_dump.json
+
+The Create plug-ins memory-map the index from the CloudBolt proserv directory.
+Blueprints imported into CloudBolt do not carry this folder, so installing the
+index there is a setup step on every CloudBolt server, repeated after each
+rebuild. The rds_instance_class_index.bin kept in this folder is the built copy
+to install:
+
+    python build_rds_instance_class_index.py ec2_instance_types_dump.json --install
+
+Until it is installed, the order forms list instance classes without details and
+the plug-ins log a warning naming the path it is expected at.
+
+File layout (little endian):
+    header:  magic (8s), format version (H), reserved (H), record count (I),
+             build time as epoch seconds (Q)
+    records: sorted by class name, each one
+             class name (32s), vCPUs (H), memory MiB (I), network performance (24s),
+             EBS baseline Mbps (I), EBS maximum Mbps (I), baseline IOPS (I),
+             maximum IOPS (I)
+"""
+import argparse
+import json
+import os
+import shutil
+import struct
+import time
+
+INDEX_MAGIC = b'RDSCLSIX'
+INDEX_VERSION = 1
+HEADER_FORMAT = struct.Struct('<8sHHIQ')
+RECORD_FORMAT = struct.Struct('<32sHI24sIIII')
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rds_instance_class_index.bin')
+DEFAULT_PROSERV_DIR = '/var/opt/cloudbolt/proserv'
+
+
+def instance_type_to_record(instance_type):
+    """
+    Pack one DescribeInstanceTypes entry as an index record for its db. class.
+    """
+    ebs = instance_type.get('EbsInfo', {}).get('EbsOptimizedInfo', {})
+    name = 'db.{0}'.format(instance_type['InstanceType'])
+
+    return RECORD_FORMAT.pack(
+        name.encode('ascii'),
+        instance_type['VCpuInfo']['DefaultVCpus'],
+        instance_type['MemoryInfo']['SizeInMiB'],
+        instance_type.get('NetworkInfo', {}).get('NetworkPerformance', '').encode('ascii')[:24],
+        int(ebs.get('BaselineBandwidthInMbps', 0)),
+        int(ebs.get('MaximumBandwidthInMbps', 0)),
+        int(ebs.get('BaselineIops', 0)),
+        int(ebs.get('MaximumIops', 0)),
+    )
+
+
+def build_index(dump_paths, output_path):
+    instance_types = {}
+    for dump_path in dump_paths:
+        with open(dump_path) as dump:
+            for instance_type in json.load(dump)['InstanceTypes']:
+                instance_types[instance_type['InstanceType']] = instance_type
+
+    records = sorted(instance_type_to_record(instance_type) for instance_type in instance_types.values())
+
+    with open(output_path, 'wb') as index:
+        index.write(HEADER_FORMAT.pack(INDEX_MAGIC, INDEX_VERSION, 0, len(records), int(time.time())))
+        for record in records:
+            index.write(record)
+
+    return len(records)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('dumps', nargs='+', help='saved describe-instance-types JSON output')
+    parser.add_argument('-o', '--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--install', nargs='?', const=DEFAULT_PROSERV_DIR, metavar='PROSERV_DIR',
+                        help='also copy the index into the CloudBolt proserv directory (default: %(const)s)')
+    args = parser.parse_args()
+
+    count = build_index(args.dumps, args.output)
+    print('Wrote {0} instance classes to {1}'.format(count, args.output))
+
+    if args.install:
+        installed = os.path.join(args.install, os.path.basename(DEFAULT_OUTPUT))
+        # copy then rename, so running plug-ins never map a partly written file
+        shutil.copyfile(args.output, installed + '.tmp')
+        os.replace(installed + '.tmp', installed)
+        print('Installed the index as {0}'.format(installed))
@@ -7,13 +7,27 @@ https://github.com/CloudBoltSoftware/cloudbolt-forge/tree/master/actions/cloudbo
 from common.methods import set_progress
 
 
-import json
+import bisect
 import hashlib
+import inspect
+import json
+import os
+import re
+import sys
+import threading
+import time
+import types
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
 
 from googleapiclient.discovery import build, Resource
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest, build_http
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2.credentials import Credentials
 
-from infrastructure.models import Environment
+from infrastructure.models import CustomField, Environment
 from common.methods import set_progress
 from resourcehandlers.gcp.models import GCPHandler
 from infrastructure.models import Server
@@ -24,9 +38,365 @@ from accounts.models import Group
 
 RESOURCE_IDENTIFIER = 'create_gke_k8s_cluster_name'
 
+# BEGIN GCP service cache constants, synced from "Shared Plug-in Code/gcp_service_cache.py"
+# Set API_TRACE_ENABLED to time every GCP call made while this plug-in runs,
+# per method and location. A summary is added to the job progress at the end
+# and, when API_TRACE_DIR is set, every call is written there as JSON.
+API_TRACE_ENABLED = False
+API_TRACE_DIR = ''
+
+# googleapiclient services are shared by every GKE plug-in and thread in this
+# process and built from the discovery documents bundled with googleapiclient,
+# so no discovery document is fetched at runtime. Each thread sends requests
+# over its own connection. The cache keeps at most SERVICE_CACHE_MAX_SIZE
+# services, evicting the least recently used.
+SERVICE_CACHE_MODULE = 'cloudbolt_gcp_service_cache_v2'
+SERVICE_CACHE_MAX_SIZE = 64
+# END GCP service cache constants
+
+# GKE labels every node VM of every node pool with the name of its cluster
+GKE_CLUSTER_LABEL = 'goog-k8s-cluster-name'
+
+# Node VMs per aggregatedList page (the compute API caps this at 500)
+NODE_PAGE_SIZE = 500
+
+# Rows per IN clause and per bulk insert when reconciling clusters and nodes
+WRITE_BATCH_SIZE = 500
+
+# Projects read from GCP at once. Each worker thread gets its own services,
+# and so its own authorized connection, from the service cache, and all
+# database writes stay on the job's thread. Set to 1 to sync one at a time.
+SYNC_MAX_WORKERS = 8
+
+# Clusters are only written when their fingerprint changed since the last
+# sync. Set to True to write every cluster, e.g. after editing resources by hand.
+FORCE_FULL_RESYNC = False
+
+# Custom fields used by this blueprint, created on first use
+CUSTOM_FIELDS = [
+    {'name': 'discovery_fingerprint', 'label': 'Discovery Fingerprint', 'type': 'STR', 'description': 'Used by the Google Kubernetes Engine Cluster blueprint'},
+]
+
+# Values that must outlive a job are kept in a module registered under this
+# name, shared by the CloudBolt plug-ins of this worker process
+PROCESS_STATE_MODULE = 'cloudbolt_plugin_process_state_v1'
+
+# Names of the custom fields known to exist, kept in the process state so later
+# jobs skip the custom field setup entirely
+ENSURED_CUSTOM_FIELDS_STATE = 'gke_sync.ensured_custom_fields'
+
+
+# BEGIN GCP service cache, synced from "Shared Plug-in Code/gcp_service_cache.py"
+class APITrace(object):
+    """
+    The API calls made during one job: per operation and region counts,
+    time, retries, throttles and a latency histogram, plus every single call
+    when the trace is written to a file.
+    """
+    # upper bounds, in seconds, of the latency histogram buckets
+    HISTOGRAM_BOUNDS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+    def __init__(self, name, keep_calls=False):
+        self.name = name
+        self.started = time.time()
+        self.elapsed_started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.operations = {}
+        self.calls = [] if keep_calls else None
+
+    def record(self, operation, location, duration, retries=0, throttles=0, waited=0, error=None):
+        with self.lock:
+            stats = self.operations.get((operation, location))
+            if stats is None:
+                stats = self.operations[(operation, location)] = dict(
+                    calls=0, seconds=0, max_seconds=0, retries=0, throttles=0, errors=0, waited_seconds=0,
+                    histogram=[0] * (len(self.HISTOGRAM_BOUNDS) + 1))
+            stats['calls'] += 1
+            stats['seconds'] += duration
+            stats['max_seconds'] = max(stats['max_seconds'], duration)
+            stats['retries'] += retries
+            stats['throttles'] += throttles
+            stats['errors'] += 1 if error else 0
+            stats['waited_seconds'] += waited
+            stats['histogram'][bisect.bisect_left(self.HISTOGRAM_BOUNDS, duration)] += 1
+
+            if self.calls is not None:
+                self.calls.append(dict(at=round(time.time() - self.started, 4), operation=operation,
+                                       location=location, seconds=round(duration, 4), retries=retries,
+                                       throttles=throttles, waited_seconds=round(waited, 4), error=error))
+
+    def percentile(self, histogram, fraction):
+        """
+        Return the upper bound of the histogram bucket holding the given
+        fraction of the calls, or None when it is past the last bound.
+        """
+        target, seen = fraction * sum(histogram), 0
+        for bound, count in zip(self.HISTOGRAM_BOUNDS, histogram):
+            seen += count
+            if seen >= target:
+                return bound
+        return None
+
+    def summary(self, max_operations=10):
+        """
+        Return a few lines describing the trace, slowest operations first.
+        """
+        operations = sorted(self.operations.items(), key=lambda item: -item[1]['seconds'])
+        totals = {key: sum(stats[key] for _, stats in operations)
+                  for key in ['calls', 'seconds', 'retries', 'throttles', 'errors', 'waited_seconds']}
+
+        lines = ['{0}: {1} API call(s) taking {2:.1f}s{3}, {4} retries, {5} throttled, {6} failed, '
+                 'in {7:.1f}s elapsed'.format(
+                     self.name, totals['calls'], totals['seconds'],
+                     ', {0:.1f}s waiting on the rate limiter'.format(totals['waited_seconds'])
+                     if totals['waited_seconds'] else '',
+                     totals['retries'], totals['throttles'], totals['errors'],
+                     time.perf_counter() - self.elapsed_started)]
+
+        for (operation, location), stats in operations[:max_operations]:
+            p95 = self.percentile(stats['histogram'], 0.95)
+            lines.append('  {0} ({1}): {2} call(s), {3:.2f}s, avg {4:.0f}ms, p95 {5}, max {6:.0f}ms{7}{8}'.format(
+                operation, location, stats['calls'], stats['seconds'], stats['seconds'] / stats['calls'] * 1000,
+                '<{0:g}ms'.format(p95 * 1000) if p95 is not None else '>10s', stats['max_seconds'] * 1000,
+                ', {0} retries'.format(stats['retries']) if stats['retries'] else '',
+                ', {0} throttled'.format(stats['throttles']) if stats['throttles'] else ''))
+
+        return lines
+
+    def write(self, directory):
+        """
+        Write the whole trace as JSON to a new file in directory and return its path.
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, '{0}-{1}-{2}.json'.format(
+            re.sub(r'[^\w.-]+', '_', self.name), time.strftime('%Y%m%d%H%M%S', time.localtime(self.started)),
+            os.getpid()))
+
+        with open(path, 'w') as trace_file:
+            json.dump({
+                'name': self.name,
+                'started': self.started,
+                'elapsed_seconds': time.perf_counter() - self.elapsed_started,
+                'histogram_bounds': self.HISTOGRAM_BOUNDS,
+                'operations': [dict(stats, operation=operation, location=location)
+                               for (operation, location), stats in sorted(self.operations.items())],
+                'calls': self.calls or [],
+            }, trace_file)
+
+        return path
+
+
+class APITracer(object):
+    """
+    Routes API call timings to the traces of the jobs running in this process.
+
+    A call made by a thread that started a trace goes to that trace. Calls from
+    other threads, such as a job's worker pool, go to every active trace.
+    Without an active trace, recording costs one attribute check.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = []
+        self.local = threading.local()
+
+    def start(self, name, keep_calls=False):
+        trace = APITrace(name, keep_calls)
+        with self.lock:
+            self.active = self.active + [trace]
+        self.local.trace = trace
+        return trace
+
+    def finish(self, trace):
+        with self.lock:
+            self.active = [active for active in self.active if active is not trace]
+        if getattr(self.local, 'trace', None) is trace:
+            self.local.trace = None
+
+    def record(self, *args, **kwargs):
+        if not self.active:
+            return
+        trace = getattr(self.local, 'trace', None)
+        for trace in [trace] if trace is not None else self.active:
+            trace.record(*args, **kwargs)
+
+
+class TracedHttpRequest(HttpRequest):
+    """
+    googleapiclient request that times execute() into the active API traces.
+    Pass it to build() as requestBuilder.
+    """
+    def execute(self, http=None, num_retries=0):
+        tracer = get_service_cache().tracer
+        if not tracer.active:
+            return super(TracedHttpRequest, self).execute(http=http, num_retries=num_retries)
 
+        started = time.perf_counter()
+        error = None
+        try:
+            return super(TracedHttpRequest, self).execute(http=http, num_retries=num_retries)
+        except HttpError as err:
+            error = str(err.resp.status)
+            raise
+        finally:
+            location = re.search(r'/(?:zones|locations|regions)/([^/?]+)', self.uri)
+            tracer.record(self.methodId, location.group(1) if location else 'global',
+                          time.perf_counter() - started, throttles=1 if error == '429' else 0, error=error)
+
+
+class ThreadLocalHttp(object):
+    """
+    Stands in for the httplib2.Http of a shared googleapiclient service and
+    sends each thread's requests over an authorized Http of its own, since
+    httplib2 connections are not thread safe. A thread's Http goes away with
+    the thread.
+    """
+    def __init__(self, credentials):
+        self.credentials = credentials
+        self.local = threading.local()
+
+    def get_http(self):
+        http = getattr(self.local, 'http', None)
+        if http is None:
+            if hasattr(self.credentials, 'authorize'):
+                # oauth2client credentials
+                http = self.credentials.authorize(build_http())
+            else:
+                http = AuthorizedHttp(self.credentials, http=build_http())
+            self.local.http = http
+        return http
+
+    def request(self, *args, **kwargs):
+        return self.get_http().request(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.get_http(), name)
+
+
+class GCPServiceCache(object):
+    """
+    Process-wide LRU cache of googleapiclient services.
+
+    Entries are keyed by (handler id, credentials id, credentials version,
+    service, version) and shared by every thread, which each get their own
+    connection through ThreadLocalHttp. Changing a set of credentials changes
+    its version, which drops every service built with the old ones. The cache
+    also owns the API tracer, so calls are traced whichever plug-in built the
+    service.
+    """
+    def __init__(self, max_size=SERVICE_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.tracer = APITracer()
+
+    def get(self, handler_id, credentials_id, credentials_key, get_credentials, service_name, version='v1'):
+        """
+        Return the service for a handler, building it with get_credentials()
+        on a miss. credentials_id names the credentials within the handler,
+        'api_key' or a service account email, and stays the same when they
+        are rotated. credentials_key is the secret the credentials are made
+        from; only its hash is kept.
+        """
+        owner = (handler_id, credentials_id)
+        credentials_version = hashlib.sha1(credentials_key.encode('utf-8')).hexdigest()[:16]
+        key = owner + (credentials_version, service_name, version)
+
+        with self.lock:
+            if self.versions.get(owner) != credentials_version:
+                # the credentials were rotated, forget everything built with the old ones
+                for stale in [stale for stale in self.entries if stale[:2] == owner]:
+                    del self.entries[stale]
+                self.versions[owner] = credentials_version
+
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry
+
+        entry = build(service_name, version, http=ThreadLocalHttp(get_credentials()), cache_discovery=False,
+                      static_discovery=True, requestBuilder=TracedHttpRequest)
+
+        with self.lock:
+            entry = self.entries.setdefault(key, entry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+        return entry
+
+
+def get_service_cache():
+    """
+    Return the googleapiclient service cache shared by every GKE plug-in in
+    this process. Plug-ins are loaded as separate modules, so the cache is
+    registered under a well-known module name that the first plug-in creates.
+    """
+    module = sys.modules.get(SERVICE_CACHE_MODULE)
+    if module is None:
+        module = types.ModuleType(SERVICE_CACHE_MODULE)
+        module.cache = GCPServiceCache()
+        # setdefault is atomic, if two plug-ins race only one cache survives
+        module = sys.modules.setdefault(SERVICE_CACHE_MODULE, module)
+
+    return module.cache
+
+
+def trace_api_calls(function):
+    """
+    When API_TRACE_ENABLED is set, trace the GCP calls made while function
+    runs and report them when it returns. Generator functions, such as
+    discover_resources, are traced until they are exhausted.
+    """
+    def start():
+        return get_service_cache().tracer.start('{0}.{1}'.format(function.__module__, function.__name__),
+                                                keep_calls=bool(API_TRACE_DIR))
+
+    def finish(trace):
+        get_service_cache().tracer.finish(trace)
+        for line in trace.summary():
+            set_progress(line)
+        if API_TRACE_DIR:
+            try:
+                set_progress('API trace written to {0}'.format(trace.write(API_TRACE_DIR)))
+            except OSError as err:
+                set_progress('Could not write the API trace: {0}'.format(err))
+
+    if inspect.isgeneratorfunction(function):
+        @wraps(function)
+        def traced_generator(*args, **kwargs):
+            if not API_TRACE_ENABLED:
+                return (yield from function(*args, **kwargs))
+            trace = start()
+            try:
+                return (yield from function(*args, **kwargs))
+            finally:
+                finish(trace)
+
+        return traced_generator
+
+    @wraps(function)
+    def traced(*args, **kwargs):
+        if not API_TRACE_ENABLED:
+            return function(*args, **kwargs)
+        trace = start()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            finish(trace)
+
+    return traced
+# END GCP service cache
+
+
+@trace_api_calls
 def discover_resources(**kwargs):
-    discovered_google_gke_clusters = []
+    """
+    Sync the GKE clusters of every GCP project to resources, writing only the
+    clusters that changed and retiring the ones that no longer exist.
+    """
+    # get or create custom fields
+    get_or_create_custom_fields_as_needed()
     
     #create a set of all projects
     gcp_envs = Environment.objects.filter(
@@ -36,104 +406,366 @@ def discover_resources(**kwargs):
     group = Group.objects.filter(name__icontains='unassigned').first()
     blueprint = ServiceBlueprint.objects.filter(name__icontains="Google Kubernetes Engine Cluster").first()
     resource_type = ResourceType.objects.filter(name__icontains="cluster").first()
+
+    # hostnames of the servers already known for GKE nodes, so new nodes are
+    # found without a query per node
+    hostnames = get_gke_node_hostnames()
+
+    # the clusters synced before, by project. A project's clusters that are
+    # not found again when it is read have been deleted.
+    synced = get_synced_clusters(blueprint)
+    changed, unchanged, deleted = 0, 0, 0
     
+    # pick the handler and environment to sync each project through, in the
+    # same order as before, so every project is only read once
+    jobs = []
     for handler in GCPHandler.objects.all():
         set_progress('Connecting to Google Kubernetics Engine Cluster for \
                       handler: {}'.format(handler))
-        
+        if not handler.gcp_api_credentials:
+            set_progress("Could not find Google Cloud credentials for this reource handler.")
+            set_progress("Could not connect to Google Cloud.  Skipping this resource handler.")
+            continue
+
         #only get gke clusters of projects in the set
         for env in Environment.objects.filter(resource_handler_id=handler.id):
             project_id = env.gcp_project
             if project_id not in projects:
                 continue
 
-            container_wrapper = create_gke_api_wrapper(handler, "container")
-            if not container_wrapper:
-                set_progress("Could not connect to Google Cloud.  Skipping this resource handler.")
+            gcp_project = handler.gcp_projects.get(id = project_id).gcp_id
+            jobs.append((handler, env, gcp_project))
+            #remove project from the set once it is queued
+            projects.discard(project_id)
+
+    # read every project from GCP concurrently and write the results from this
+    # thread as they arrive, in job order
+    with ThreadPoolExecutor(max_workers=max(1, SYNC_MAX_WORKERS)) as executor:
+        futures = [executor.submit(fetch_project_clusters, handler, gcp_project)
+                   for handler, env, gcp_project in jobs]
+        for (handler, env, gcp_project), future in zip(jobs, futures):
+            try:
+                clusters, project_nodes, missing_zones = future.result()
+            except Exception as err:
+                # leave the project's clusters as they are, it is synced again next time
+                set_progress(f"Could not read the GKE clusters of project {gcp_project}: {err}")
                 continue
 
-            set_progress("Connection to Google Cloud established")
-            
-            gcp_project = handler.gcp_projects.get(id = project_id).gcp_id
-            clusters = list_gke_clusters(container_wrapper, gcp_project).get("clusters", None)
+            if missing_zones:
+                set_progress(f"Could not list the GKE clusters of project {gcp_project} in "
+                             f"{', '.join(missing_zones)}, their clusters are kept as they are")
             if not clusters:
-                set_progress("No resource are vailable to sync")
-                return []
-            compute_wrapper = create_gke_api_wrapper(handler, "compute")
-        
-            for cluster in clusters:
-                if cluster.get("name"):
-                    nodes = list_gke_nodes(compute_wrapper, gcp_project, cluster['zone'], cluster['name']).get("items", None)
-                    resource = Resource_gke.objects.filter(name__exact = cluster['name'], lifecycle = 'ACTIVE').first()
-                    if not resource:
-                        resource = Resource_gke.objects.create(
-                            name=cluster['name'],
-                            blueprint=blueprint,
-                            group=group,
-                            resource_type=resource_type,
-                        )
-                        set_progress(f"Creating new resource {cluster['name']}")
-                    # Store the resource handler's ID on this resource so the teardown action
-                    # knows which credentials to use.
-                    resource.google_rh_id = handler.id
-                    resource.lifecycle = 'ACTIVE'
-                    resource.create_gke_k8s_cluster_name = cluster.get("name", "noName")
-                    resource.created_at = cluster['createTime']
-                    resource.kubernetes_version = cluster['initialClusterVersion']
-                    resource.endpoint = cluster['endpoint']
-                    resource.status = cluster['status']
-                    resource.project_id =  gcp_project
-                    resource.create_gke_k8s_cluster_project = env.id
-                    resource.gcp_zone = cluster['zone']
-                    for node in nodes:
-                            id_unicode = '{}:{}'.format(node['id'], 'gcp')
-                            uuid = hashlib.sha1(id_unicode.encode('utf-8')).hexdigest()
-                            try:
-                                serv = Server.objects.get(hostname=node['name'])
-                            except Server.DoesNotExist:
-                                serv = None
-                            
-                            if not serv:
-                                serv = Server.objects.create(hostname=node['name'],
-                                        resource_handler_svr_id=uuid,
-                                        environment=env,
-                                        resource_handler=env.resource_handler,
-                                        group=resource.group)
-                                
-                                server = Server.objects.get(hostname=node['name'])
-                                resource.server_set.add(server)     
-                    resource.save()
-            #remove project from the set after getting its clusters
-            projects.discard(project_id)
+                set_progress(f"No GKE clusters found in project {gcp_project}")
+
+            project_changed, project_unchanged, project_deleted = sync_project_clusters(
+                handler, env, gcp_project, clusters, project_nodes, hostnames, synced.get(gcp_project, {}),
+                missing_zones, blueprint, group, resource_type)
+            changed += project_changed
+            unchanged += project_unchanged
+            deleted += project_deleted
 
+    set_progress(f"Synced {changed} new or changed GKE cluster(s), {unchanged} unchanged, "
+                 f"{deleted} deleted.")
     return []
 
 
-def list_gke_clusters(wrapper: Resource, project_id: str) -> dict:
+def get_process_state(key, default_factory):
+    """
+    Return the value kept under key for the life of this worker process,
+    creating it with default_factory() on first use. CloudBolt executes the
+    plug-in afresh for every job, so module globals are lost between jobs;
+    the state lives in a module registered under PROCESS_STATE_MODULE instead.
+    """
+    module = sys.modules.get(PROCESS_STATE_MODULE)
+    if module is None:
+        # setdefault is atomic, if two plug-ins race only one module survives
+        module = sys.modules.setdefault(PROCESS_STATE_MODULE, types.ModuleType(PROCESS_STATE_MODULE))
+
+    state = module.__dict__
+    if key not in state:
+        state.setdefault(key, default_factory())
+    return state[key]
+
+
+def get_or_create_custom_fields_as_needed():
+    """
+    Create any field in CUSTOM_FIELDS that does not exist yet, with one query
+    for the existing names and one bulk insert for the rest.
+    """
+    ensured = get_process_state(ENSURED_CUSTOM_FIELDS_STATE, set)
+    missing = [field for field in CUSTOM_FIELDS if field['name'] not in ensured]
+    if not missing:
+        return
+
+    existing = set(CustomField.objects.filter(
+        name__in=[field['name'] for field in missing]).values_list('name', flat=True))
+
+    # ignore_conflicts lets concurrent jobs race on the same new field safely
+    CustomField.objects.bulk_create(
+        [CustomField(**field) for field in missing if field['name'] not in existing],
+        ignore_conflicts=True,
+    )
+    ensured.update(field['name'] for field in missing)
+
+
+def get_attribute_values(resource):
+    """
+    Return the custom field values of a resource whose attributes were prefetched.
+    """
+    return {cfv.field.name: cfv.value for cfv in resource.attributes.all()}
+
+
+def get_fingerprint(attributes):
+    """
+    Return a stable hash of a cluster's synced attributes.
+    """
+    return hashlib.sha1(json.dumps(attributes, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def get_synced_clusters(blueprint):
+    """
+    Return the active cluster resources of this blueprint as
+    {gcp project: {cluster name: resource}}.
+    """
+    resources = Resource_gke.objects.filter(
+        blueprint=blueprint, lifecycle='ACTIVE').order_by('id').prefetch_related('attributes__field')
+
+    synced = {}
+    for resource in resources:
+        project = get_attribute_values(resource).get('project_id')
+        if project:
+            synced.setdefault(project, {}).setdefault(resource.name, resource)
+
+    return synced
+
+
+def fetch_project_clusters(handler, gcp_project):
+    """
+    Read one project's clusters, their nodes and the zones the cluster list
+    could not reach from GCP. This runs on a worker thread and must not touch
+    the database.
+    """
+    container_wrapper = create_gke_api_wrapper(handler, "container")
+    clusters, missing_zones = list_gke_clusters(container_wrapper, gcp_project)
+    if not clusters:
+        return [], {}, missing_zones
+
+    # every node of every cluster and pool in the project, in one paginated listing
+    compute_wrapper = create_gke_api_wrapper(handler, "compute")
+    return clusters, list_gke_nodes(compute_wrapper, gcp_project), missing_zones
+
+
+def sync_project_clusters(handler, env, gcp_project, clusters, project_nodes, hostnames, previous,
+                          missing_zones, blueprint, group, resource_type):
+    """
+    Write one project's clusters and nodes, as read by fetch_project_clusters(),
+    to their resources and servers. previous holds the project's clusters as
+    last synced; those missing from clusters are marked deleted, unless they
+    are in one of the missing_zones the listing could not reach. Return the
+    number of changed, unchanged and deleted clusters.
+    """
+    clusters = [cluster for cluster in clusters if cluster.get("name")]
+    resources = get_cluster_resources([cluster['name'] for cluster in clusters],
+                                      blueprint, group, resource_type)
+
+    changed_resources, unchanged = [], 0
+    new_servers = {}
+    for cluster in clusters:
+        nodes = get_cluster_nodes(project_nodes, cluster)
+        resource = resources[cluster['name']]
+        attributes = {
+            # Store the resource handler's ID on this resource so the teardown action
+            # knows which credentials to use.
+            'google_rh_id': handler.id,
+            'create_gke_k8s_cluster_name': cluster.get("name", "noName"),
+            'created_at': cluster['createTime'],
+            'kubernetes_version': cluster['initialClusterVersion'],
+            'endpoint': cluster['endpoint'],
+            'status': cluster['status'],
+            'project_id': gcp_project,
+            'create_gke_k8s_cluster_project': env.id,
+            'gcp_zone': cluster['zone'],
+        }
+        fingerprint = get_fingerprint(attributes)
+        if get_attribute_values(resource).get('discovery_fingerprint') == fingerprint and not FORCE_FULL_RESYNC:
+            unchanged += 1
+        else:
+            for name, value in attributes.items():
+                setattr(resource, name, value)
+            resource.lifecycle = 'ACTIVE'
+            resource.discovery_fingerprint = fingerprint
+            changed_resources.append(resource)
+
+        new_servers[cluster['name']] = []
+        for node in nodes:
+            if node['name'] in hostnames:
+                continue
+            hostnames.add(node['name'])
+
+            id_unicode = '{}:{}'.format(node['id'], 'gcp')
+            uuid = hashlib.sha1(id_unicode.encode('utf-8')).hexdigest()
+            new_servers[cluster['name']].append(Server(hostname=node['name'],
+                                                       resource_handler_svr_id=uuid,
+                                                       environment=env,
+                                                       resource_handler=env.resource_handler,
+                                                       group=resource.group))
+
+    # one insert for all of the project's new nodes, then one attach per cluster
+    created = create_servers([server for servers in new_servers.values() for server in servers])
+    for cluster_name, servers in new_servers.items():
+        if servers:
+            resources[cluster_name].server_set.add(*[created[server.hostname] for server in servers])
+
+    for resource in changed_resources:
+        resource.save()
+
+    # clusters synced before but gone from the project
+    deleted = 0
+    for name, resource in sorted(previous.items()):
+        if name in resources:
+            continue
+        if may_be_unlisted(get_attribute_values(resource).get('gcp_zone'), missing_zones):
+            set_progress(f"GKE cluster {name} was not listed in project {gcp_project}, but its location could "
+                         f"not be reached, keeping it")
+            continue
+        set_progress(f"GKE cluster {name} no longer exists in project {gcp_project}, marking it deleted")
+        resource.lifecycle = 'HISTORICAL'
+        resource.save()
+        deleted += 1
+
+    return len(changed_resources), unchanged, deleted
+
+
+def get_gke_node_hostnames():
+    """
+    Return the hostnames of every server that may be a GKE node. Node names
+    always start with "gke-", so one indexed prefix query covers them all.
+    """
+    return set(Server.objects.filter(hostname__startswith='gke-').values_list('hostname', flat=True))
+
+
+def get_cluster_resources(names, blueprint, group, resource_type):
+    """
+    Return {name: resource} for the given cluster names. Existing ACTIVE
+    resources are read in batched queries, the oldest one winning when a name
+    repeats, and the missing ones are created with one bulk insert.
+    """
+    names = list(names)
+    resources = {}
+    for start in range(0, len(names), WRITE_BATCH_SIZE):
+        for resource in Resource_gke.objects.filter(
+                name__in=names[start:start + WRITE_BATCH_SIZE], lifecycle='ACTIVE',
+        ).order_by('id').prefetch_related('attributes__field'):
+            resources.setdefault(resource.name, resource)
+
+    missing = [name for name in names if name not in resources]
+    if missing:
+        for name in missing:
+            set_progress(f"Creating new resource {name}")
+        Resource_gke.objects.bulk_create([
+            Resource_gke(name=name, blueprint=blueprint, group=group, resource_type=resource_type, lifecycle='ACTIVE')
+            for name in missing
+        ], batch_size=WRITE_BATCH_SIZE)
+
+        # bulk_create does not return primary keys on every database, so read them back
+        for start in range(0, len(missing), WRITE_BATCH_SIZE):
+            for resource in Resource_gke.objects.filter(
+                    name__in=missing[start:start + WRITE_BATCH_SIZE], lifecycle='ACTIVE', blueprint=blueprint,
+            ).order_by('id').prefetch_related('attributes__field'):
+                resources.setdefault(resource.name, resource)
+
+    return resources
+
+
+def create_servers(servers):
+    """
+    Insert new servers in bulk and return {hostname: server} read back with
+    their primary keys.
+    """
+    if not servers:
+        return {}
+
+    Server.objects.bulk_create(servers, batch_size=WRITE_BATCH_SIZE)
+
+    hostnames = [server.hostname for server in servers]
+    created = {}
+    for start in range(0, len(hostnames), WRITE_BATCH_SIZE):
+        for server in Server.objects.filter(hostname__in=hostnames[start:start + WRITE_BATCH_SIZE]).order_by('id'):
+            created.setdefault(server.hostname, server)
+
+    return created
+
+
+def list_gke_clusters(wrapper: Resource, project_id: str) -> tuple:
     """
-    Get all gke clusters in a given project
+    Get all gke clusters in a given project, and the zones GKE could not reach
+    while listing them, whose clusters may be missing from the list
     https://cloud.google.com/kubernetes-engine/docs/reference/rest/v1/projects.zones.clusters/list
     """
     clusters_list_request = wrapper.projects().zones().clusters().list(projectId=project_id, zone='-')
-    return clusters_list_request.execute()
+    response = clusters_list_request.execute()
+    return response.get("clusters", []), response.get("missingZones", [])
     
-def list_gke_nodes(wrapper: Resource, project_id: str, zone : str, cluster_name: str) -> dict:
+def list_gke_nodes(wrapper: Resource, project_id: str) -> dict:
     """
-    Get all gke nodes in a given project
-    https://cloud.google.com/kubernetes-engine/docs/reference/rest/v1/projects.zones.clusters/list
+    Get all gke nodes in a given project, across every zone and node pool, as
+    {cluster_name: {zone: [nodes]}}
+    https://cloud.google.com/compute/docs/reference/rest/v1/instances/aggregatedList
+    """
+    nodes = {}
+    instances = wrapper.instances()
+    request = instances.aggregatedList(project=project_id, filter="labels.{}:*".format(GKE_CLUSTER_LABEL),
+                                       maxResults=NODE_PAGE_SIZE)
+    while request is not None:
+        response = request.execute()
+        for scope, scoped_list in response.get("items", {}).items():
+            zone = scope.split("/")[-1]
+            for node in scoped_list.get("instances", []):
+                cluster_name = node.get("labels", {}).get(GKE_CLUSTER_LABEL)
+                nodes.setdefault(cluster_name, {}).setdefault(zone, []).append(node)
+        request = instances.aggregatedList_next(previous_request=request, previous_response=response)
+    return nodes
+
+
+def get_cluster_nodes(nodes: dict, cluster: dict) -> list:
+    """
+    Pick one cluster's nodes out of list_gke_nodes(). The location check keeps
+    same-named clusters in other locations apart: a zonal cluster matches the
+    nodes of its zone, a regional cluster the nodes in every zone of its region.
+    A prefix match would not do: europe-west1 is a prefix of europe-west12-a.
+    """
+    location = cluster.get('location') or cluster['zone']
+    return [
+        node
+        for zone, zone_nodes in nodes.get(cluster['name'], {}).items()
+        if zone == location or zone.rsplit('-', 1)[0] == location
+        for node in zone_nodes
+    ]
+
+
+def may_be_unlisted(location: str, missing_zones: list) -> bool:
+    """
+    Return whether a cluster last synced in location, a zone or a region, may
+    be absent from a cluster list only because one of missing_zones could not
+    be reached. A cluster whose location is unknown is given the benefit of
+    the doubt whenever a zone is missing.
     """
-    nodes_list_request = wrapper.instances().list(project=project_id, zone=zone, filter="name:gke-{}-default-pool*".format(cluster_name))
-    return nodes_list_request.execute()
+    if not missing_zones:
+        return False
+    if not location:
+        return True
+    return any(zone == location or zone.rsplit('-', 1)[0] == location for zone in missing_zones)
 
 
 def create_gke_api_wrapper(gcp_handler: GCPHandler, service: str) -> Resource:
     """
-    Using googleapiclient.discovery, build the api wrapper for the gke cluster
+    Return the api wrapper for the gke cluster from the process-wide service
+    cache, building it on first use
     """
     if not gcp_handler.gcp_api_credentials:
         set_progress("Could not find Google Cloud credentials for this reource handler.")
         return None
-    credentials_dict = json.loads(gcp_handler.gcp_api_credentials)
-    credentials = Credentials(**credentials_dict)
-    gke_wrapper: Resource = build(service, "v1", credentials=credentials, cache_discovery=False)
+    api_key = gcp_handler.gcp_api_credentials
+    gke_wrapper: Resource = get_service_cache().get(
+        gcp_handler.id, 'api_key', api_key, lambda: Credentials(**json.loads(api_key)), service)
     return gke_wrapper
\ No newline at end of file
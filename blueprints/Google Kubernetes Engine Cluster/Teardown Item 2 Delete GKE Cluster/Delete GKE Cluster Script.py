@@ -4,10 +4,23 @@ Google Kubernetes Engine blueprint.
 """
 from __future__ import unicode_literals
 
+import hashlib
+import sys
+import types
+from collections import OrderedDict
+import bisect
+import inspect
 import json
+import os
+import re
+import threading
+import time
+from functools import wraps
 
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest, build_http
+from google_auth_httplib2 import AuthorizedHttp
 from oauth2client.service_account import ServiceAccountCredentials
 
 from containerorchestrators.kuberneteshandler.models import Kubernetes
@@ -16,7 +29,327 @@ from resourcehandlers.gcp.models import GCPProject
 from google.oauth2.credentials import Credentials
 from common.methods import set_progress
 
+# BEGIN GCP service cache constants, synced from "Shared Plug-in Code/gcp_service_cache.py"
+# Set API_TRACE_ENABLED to time every GCP call made while this plug-in runs,
+# per method and location. A summary is added to the job progress at the end
+# and, when API_TRACE_DIR is set, every call is written there as JSON.
+API_TRACE_ENABLED = False
+API_TRACE_DIR = ''
 
+# googleapiclient services are shared by every GKE plug-in and thread in this
+# process and built from the discovery documents bundled with googleapiclient,
+# so no discovery document is fetched at runtime. Each thread sends requests
+# over its own connection. The cache keeps at most SERVICE_CACHE_MAX_SIZE
+# services, evicting the least recently used.
+SERVICE_CACHE_MODULE = 'cloudbolt_gcp_service_cache_v2'
+SERVICE_CACHE_MAX_SIZE = 64
+# END GCP service cache constants
+
+
+# BEGIN GCP service cache, synced from "Shared Plug-in Code/gcp_service_cache.py"
+class APITrace(object):
+    """
+    The API calls made during one job: per operation and region counts,
+    time, retries, throttles and a latency histogram, plus every single call
+    when the trace is written to a file.
+    """
+    # upper bounds, in seconds, of the latency histogram buckets
+    HISTOGRAM_BOUNDS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+    def __init__(self, name, keep_calls=False):
+        self.name = name
+        self.started = time.time()
+        self.elapsed_started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.operations = {}
+        self.calls = [] if keep_calls else None
+
+    def record(self, operation, location, duration, retries=0, throttles=0, waited=0, error=None):
+        with self.lock:
+            stats = self.operations.get((operation, location))
+            if stats is None:
+                stats = self.operations[(operation, location)] = dict(
+                    calls=0, seconds=0, max_seconds=0, retries=0, throttles=0, errors=0, waited_seconds=0,
+                    histogram=[0] * (len(self.HISTOGRAM_BOUNDS) + 1))
+            stats['calls'] += 1
+            stats['seconds'] += duration
+            stats['max_seconds'] = max(stats['max_seconds'], duration)
+            stats['retries'] += retries
+            stats['throttles'] += throttles
+            stats['errors'] += 1 if error else 0
+            stats['waited_seconds'] += waited
+            stats['histogram'][bisect.bisect_left(self.HISTOGRAM_BOUNDS, duration)] += 1
+
+            if self.calls is not None:
+                self.calls.append(dict(at=round(time.time() - self.started, 4), operation=operation,
+                                       location=location, seconds=round(duration, 4), retries=retries,
+                                       throttles=throttles, waited_seconds=round(waited, 4), error=error))
+
+    def percentile(self, histogram, fraction):
+        """
+        Return the upper bound of the histogram bucket holding the given
+        fraction of the calls, or None when it is past the last bound.
+        """
+        target, seen = fraction * sum(histogram), 0
+        for bound, count in zip(self.HISTOGRAM_BOUNDS, histogram):
+            seen += count
+            if seen >= target:
+                return bound
+        return None
+
+    def summary(self, max_operations=10):
+        """
+        Return a few lines describing the trace, slowest operations first.
+        """
+        operations = sorted(self.operations.items(), key=lambda item: -item[1]['seconds'])
+        totals = {key: sum(stats[key] for _, stats in operations)
+                  for key in ['calls', 'seconds', 'retries', 'throttles', 'errors', 'waited_seconds']}
+
+        lines = ['{0}: {1} API call(s) taking {2:.1f}s{3}, {4} retries, {5} throttled, {6} failed, '
+                 'in {7:.1f}s elapsed'.format(
+                     self.name, totals['calls'], totals['seconds'],
+                     ', {0:.1f}s waiting on the rate limiter'.format(totals['waited_seconds'])
+                     if totals['waited_seconds'] else '',
+                     totals['retries'], totals['throttles'], totals['errors'],
+                     time.perf_counter() - self.elapsed_started)]
+
+        for (operation, location), stats in operations[:max_operations]:
+            p95 = self.percentile(stats['histogram'], 0.95)
+            lines.append('  {0} ({1}): {2} call(s), {3:.2f}s, avg {4:.0f}ms, p95 {5}, max {6:.0f}ms{7}{8}'.format(
+                operation, location, stats['calls'], stats['seconds'], stats['seconds'] / stats['calls'] * 1000,
+                '<{0:g}ms'.format(p95 * 1000) if p95 is not None else '>10s', stats['max_seconds'] * 1000,
+                ', {0} retries'.format(stats['retries']) if stats['retries'] else '',
+                ', {0} throttled'.format(stats['throttles']) if stats['throttles'] else ''))
+
+        return lines
+
+    def write(self, directory):
+        """
+        Write the whole trace as JSON to a new file in directory and return its path.
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, '{0}-{1}-{2}.json'.format(
+            re.sub(r'[^\w.-]+', '_', self.name), time.strftime('%Y%m%d%H%M%S', time.localtime(self.started)),
+            os.getpid()))
+
+        with open(path, 'w') as trace_file:
+            json.dump({
+                'name': self.name,
+                'started': self.started,
+                'elapsed_seconds': time.perf_counter() - self.elapsed_started,
+                'histogram_bounds': self.HISTOGRAM_BOUNDS,
+                'operations': [dict(stats, operation=operation, location=location)
+                               for (operation, location), stats in sorted(self.operations.items())],
+                'calls': self.calls or [],
+            }, trace_file)
+
+        return path
+
+
+class APITracer(object):
+    """
+    Routes API call timings to the traces of the jobs running in this process.
+
+    A call made by a thread that started a trace goes to that trace. Calls from
+    other threads, such as a job's worker pool, go to every active trace.
+    Without an active trace, recording costs one attribute check.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = []
+        self.local = threading.local()
+
+    def start(self, name, keep_calls=False):
+        trace = APITrace(name, keep_calls)
+        with self.lock:
+            self.active = self.active + [trace]
+        self.local.trace = trace
+        return trace
+
+    def finish(self, trace):
+        with self.lock:
+            self.active = [active for active in self.active if active is not trace]
+        if getattr(self.local, 'trace', None) is trace:
+            self.local.trace = None
+
+    def record(self, *args, **kwargs):
+        if not self.active:
+            return
+        trace = getattr(self.local, 'trace', None)
+        for trace in [trace] if trace is not None else self.active:
+            trace.record(*args, **kwargs)
+
+
+class TracedHttpRequest(HttpRequest):
+    """
+    googleapiclient request that times execute() into the active API traces.
+    Pass it to build() as requestBuilder.
+    """
+    def execute(self, http=None, num_retries=0):
+        tracer = get_service_cache().tracer
+        if not tracer.active:
+            return super(TracedHttpRequest, self).execute(http=http, num_retries=num_retries)
+
+        started = time.perf_counter()
+        error = None
+        try:
+            return super(TracedHttpRequest, self).execute(http=http, num_retries=num_retries)
+        except HttpError as err:
+            error = str(err.resp.status)
+            raise
+        finally:
+            location = re.search(r'/(?:zones|locations|regions)/([^/?]+)', self.uri)
+            tracer.record(self.methodId, location.group(1) if location else 'global',
+                          time.perf_counter() - started, throttles=1 if error == '429' else 0, error=error)
+
+
+class ThreadLocalHttp(object):
+    """
+    Stands in for the httplib2.Http of a shared googleapiclient service and
+    sends each thread's requests over an authorized Http of its own, since
+    httplib2 connections are not thread safe. A thread's Http goes away with
+    the thread.
+    """
+    def __init__(self, credentials):
+        self.credentials = credentials
+        self.local = threading.local()
+
+    def get_http(self):
+        http = getattr(self.local, 'http', None)
+        if http is None:
+            if hasattr(self.credentials, 'authorize'):
+                # oauth2client credentials
+                http = self.credentials.authorize(build_http())
+            else:
+                http = AuthorizedHttp(self.credentials, http=build_http())
+            self.local.http = http
+        return http
+
+    def request(self, *args, **kwargs):
+        return self.get_http().request(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.get_http(), name)
+
+
+class GCPServiceCache(object):
+    """
+    Process-wide LRU cache of googleapiclient services.
+
+    Entries are keyed by (handler id, credentials id, credentials version,
+    service, version) and shared by every thread, which each get their own
+    connection through ThreadLocalHttp. Changing a set of credentials changes
+    its version, which drops every service built with the old ones. The cache
+    also owns the API tracer, so calls are traced whichever plug-in built the
+    service.
+    """
+    def __init__(self, max_size=SERVICE_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.tracer = APITracer()
+
+    def get(self, handler_id, credentials_id, credentials_key, get_credentials, service_name, version='v1'):
+        """
+        Return the service for a handler, building it with get_credentials()
+        on a miss. credentials_id names the credentials within the handler,
+        'api_key' or a service account email, and stays the same when they
+        are rotated. credentials_key is the secret the credentials are made
+        from; only its hash is kept.
+        """
+        owner = (handler_id, credentials_id)
+        credentials_version = hashlib.sha1(credentials_key.encode('utf-8')).hexdigest()[:16]
+        key = owner + (credentials_version, service_name, version)
+
+        with self.lock:
+            if self.versions.get(owner) != credentials_version:
+                # the credentials were rotated, forget everything built with the old ones
+                for stale in [stale for stale in self.entries if stale[:2] == owner]:
+                    del self.entries[stale]
+                self.versions[owner] = credentials_version
+
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry
+
+        entry = build(service_name, version, http=ThreadLocalHttp(get_credentials()), cache_discovery=False,
+                      static_discovery=True, requestBuilder=TracedHttpRequest)
+
+        with self.lock:
+            entry = self.entries.setdefault(key, entry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+        return entry
+
+
+def get_service_cache():
+    """
+    Return the googleapiclient service cache shared by every GKE plug-in in
+    this process. Plug-ins are loaded as separate modules, so the cache is
+    registered under a well-known module name that the first plug-in creates.
+    """
+    module = sys.modules.get(SERVICE_CACHE_MODULE)
+    if module is None:
+        module = types.ModuleType(SERVICE_CACHE_MODULE)
+        module.cache = GCPServiceCache()
+        # setdefault is atomic, if two plug-ins race only one cache survives
+        module = sys.modules.setdefault(SERVICE_CACHE_MODULE, module)
+
+    return module.cache
+
+
+def trace_api_calls(function):
+    """
+    When API_TRACE_ENABLED is set, trace the GCP calls made while function
+    runs and report them when it returns. Generator functions, such as
+    discover_resources, are traced until they are exhausted.
+    """
+    def start():
+        return get_service_cache().tracer.start('{0}.{1}'.format(function.__module__, function.__name__),
+                                                keep_calls=bool(API_TRACE_DIR))
+
+    def finish(trace):
+        get_service_cache().tracer.finish(trace)
+        for line in trace.summary():
+            set_progress(line)
+        if API_TRACE_DIR:
+            try:
+                set_progress('API trace written to {0}'.format(trace.write(API_TRACE_DIR)))
+            except OSError as err:
+                set_progress('Could not write the API trace: {0}'.format(err))
+
+    if inspect.isgeneratorfunction(function):
+        @wraps(function)
+        def traced_generator(*args, **kwargs):
+            if not API_TRACE_ENABLED:
+                return (yield from function(*args, **kwargs))
+            trace = start()
+            try:
+                return (yield from function(*args, **kwargs))
+            finally:
+                finish(trace)
+
+        return traced_generator
+
+    @wraps(function)
+    def traced(*args, **kwargs):
+        if not API_TRACE_ENABLED:
+            return function(*args, **kwargs)
+        trace = start()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            finish(trace)
+
+    return traced
+# END GCP service cache
+
+
+@trace_api_calls
 def run(job=None, logger=None, resource=None, **kwargs):
     # Get cluster information
     cluster_name = resource.create_gke_k8s_cluster_name
@@ -53,6 +386,8 @@ def run(job=None, logger=None, resource=None, **kwargs):
         client_email = service_account_key.get("client_email")
         private_key = service_account_key.get("private_key")
 
+        credentials_id = client_email
+        credentials_key = json.dumps(service_account_key, sort_keys=True)
         credentials = ServiceAccountCredentials.from_json_keyfile_dict(
             {
                 "client_email": client_email,
@@ -66,8 +401,11 @@ def run(job=None, logger=None, resource=None, **kwargs):
         set_progress("Using the API Key in the resource handler")
         set_progress("Make sure your OAuth account has permission to edit GKE Nodes")
         credentials = Credentials(**json.loads(api_key))
+        credentials_id = 'api_key'
+        credentials_key = api_key
 
-    client = build("container", "v1", credentials=credentials)
+    client = get_service_cache().get(handler.id, credentials_id, credentials_key, lambda: credentials,
+                                     "container")
     cluster_resource = client.projects().zones().clusters()
 
     # Delete cluster
@@ -0,0 +1,185 @@
+"""
+Copy the shared sections of the modules in this directory into every plug-in
+of this repository that carries them.
+
+    python sync_shared_code.py           # rewrite the out of date plug-ins
+    python sync_shared_code.py --check   # exit 1 if a plug-in is out of date
+
+A section starts with a line
+    # BEGIN <name>, synced from "Shared Plug-in Code/<module>.py"
+and ends with the line "# END <name>". A plug-in takes part by carrying the
+marker lines of every section of a shared module; everything between them is
+replaced. Section names are unique across the shared modules.
+
+Running workers keep what the first plug-in they ran registered under a
+*_MODULE name (CLIENT_POOL_MODULE for instance), so a changed section of such a
+module only reaches them under a new name. VERSIONS records the hash of the
+sections released under each name: after changing a section, bump the version
+in its *_MODULE constant and add the hash printed by --check before syncing.
+"""
+import argparse
+import hashlib
+import os
+import re
+import sys
+
+SHARED_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(os.path.dirname(SHARED_DIR))
+PLUGIN_DIRS = ['blueprints', 'aws_ebs_storage']
+
+# sha1 of the sections released under each *_MODULE name, marker lines excluded
+VERSIONS = {
+    'cloudbolt_aws_client_pool_v4': 'e1954e27dcc3659400125f1996bfc0fd9714be7b',
+    'cloudbolt_gcp_service_cache_v2': '603ccafa4fc2dc20e9e4c087cf1d733d7dd95e0a',
+}
+
+SECTION_PATTERN = re.compile(
+    r'^# BEGIN (?P<name>[^,\n]+), synced from "(?P<source>[^"\n]+)"\n(?P<body>.*?)^# END (?P=name)\n', re.M | re.S)
+MODULE_NAME_PATTERN = re.compile(r"^\w+_MODULE = '([^']+)'", re.M)
+
+
+def read(path):
+    """
+    Return the text of path with \\n line endings, whatever the file uses.
+    """
+    with open(path, newline='') as source:
+        return source.read().replace('\r\n', '\n')
+
+
+def write(path, text):
+    with open(path, newline='') as source:
+        newline = '\r\n' if '\r\n' in source.read() else '\n'
+    with open(path, 'w', newline='') as target:
+        target.write(text.replace('\n', newline))
+
+
+def read_sections(text):
+    """
+    Return [(name, source, body)] for every marked section of text, in order.
+    """
+    return [(match.group('name'), match.group('source'), match.group('body'))
+            for match in SECTION_PATTERN.finditer(text)]
+
+
+def render(name, source, body):
+    return '# BEGIN {0}, synced from "{1}"\n{2}# END {0}\n'.format(name, source, body)
+
+
+def shared_modules():
+    """
+    Return {relative path: [(name, source, body)]} for the shared modules.
+    """
+    modules = {}
+    for file_name in sorted(os.listdir(SHARED_DIR)):
+        path = os.path.join(SHARED_DIR, file_name)
+        if file_name.endswith('.py') and path != os.path.abspath(__file__):
+            modules[os.path.relpath(path, os.path.dirname(SHARED_DIR))] = read_sections(read(path))
+    return modules
+
+
+def sections_hash(sections):
+    return hashlib.sha1(''.join(body for _, _, body in sections).encode('utf-8')).hexdigest()
+
+
+def canonical_sections(modules):
+    """
+    Return {section name: (module, marked text)} for the shared modules.
+    """
+    canonical = {}
+    for module, sections in modules.items():
+        for name, _, body in sections:
+            canonical[name] = (module, render(name, module, body))
+    return canonical
+
+
+def shared_code_errors(modules):
+    """
+    Return why the shared modules cannot be synced, as a list of messages.
+    """
+    errors = []
+    seen = {}
+    for module, sections in modules.items():
+        if not sections:
+            errors.append('{0} has no marked section'.format(module))
+        for name, source, _ in sections:
+            if name in seen:
+                errors.append('section "{0}" is defined by both {1} and {2}'.format(name, seen[name], module))
+            seen[name] = module
+            if source != module:
+                errors.append('section "{0}" of {1} says it is synced from "{2}"'.format(name, module, source))
+
+        released = MODULE_NAME_PATTERN.findall(''.join(body for _, _, body in sections))
+        digest = sections_hash(sections)
+        for module_name in released:
+            if VERSIONS.get(module_name) != digest:
+                errors.append('the sections of {0} (sha1 {1}) are not the ones released as {2}: bump the version '
+                              'and record it with this hash in VERSIONS'.format(module, digest, module_name))
+    return errors
+
+
+def plugin_paths():
+    """
+    Return the paths of the plug-ins that carry at least one shared section.
+    """
+    paths = []
+    for plugin_dir in PLUGIN_DIRS:
+        for directory, _, files in os.walk(os.path.join(REPO_ROOT, plugin_dir)):
+            if os.path.abspath(directory) == SHARED_DIR:
+                continue
+            for name in files:
+                path = os.path.join(directory, name)
+                if name.endswith('.py') and read_sections(read(path)):
+                    paths.append(path)
+    return sorted(paths)
+
+
+def plugin_errors(modules, path):
+    """
+    Return why the sections of one plug-in cannot be synced, as a list of messages.
+    """
+    canonical = canonical_sections(modules)
+    names = [name for name, _, _ in read_sections(read(path))]
+    errors = ['carries unknown section "{0}"'.format(name) for name in names if name not in canonical]
+    for module, sections in modules.items():
+        missing = [name for name, _, _ in sections if name not in names]
+        if len(missing) < len(sections) and missing:
+            errors.append('carries only part of {0}, "{1}" is missing'.format(module, '", "'.join(missing)))
+    return [os.path.relpath(path, REPO_ROOT) + ': ' + error for error in errors]
+
+
+def stale_plugins(modules):
+    """
+    Return the paths of the plug-ins whose sections differ from the shared ones.
+    """
+    canonical = canonical_sections(modules)
+    return [path for path in plugin_paths()
+            if any(render(*section) != canonical[section[0]][1] for section in read_sections(read(path)))]
+
+
+def sync(modules, path):
+    canonical = canonical_sections(modules)
+    text = SECTION_PATTERN.sub(lambda match: canonical[match.group('name')][1], read(path))
+    write(path, text)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--check', action='store_true', help='only report the plug-ins that are out of date')
+    args = parser.parse_args()
+
+    modules = shared_modules()
+    errors = shared_code_errors(modules)
+    for path in plugin_paths():
+        errors.extend(plugin_errors(modules, path))
+    if errors:
+        sys.exit('\n'.join(errors))
+
+    stale = stale_plugins(modules)
+    for path in stale:
+        if args.check:
+            print('out of date: {0}'.format(os.path.relpath(path, REPO_ROOT)))
+        else:
+            sync(modules, path)
+            print('synced: {0}'.format(os.path.relpath(path, REPO_ROOT)))
+
+    sys.exit(1 if args.check and stale else 0)
@@ -0,0 +1,37 @@
+import unittest
+from unittest import mock
+
+from plugin_loader import aws_plugin_paths, load_plugin
+
+
+class AWSClientPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.module = load_plugin(aws_plugin_paths()[0])
+        self.handler = mock.Mock(id=1, serviceaccount='key', servicepasswd='secret')
+
+    def test_clients_are_built_by_the_handler_and_shared(self):
+        pool = self.module.AWSClientPool()
+        client = pool.get(self.handler, 'us-east-1', 'rds')
+
+        self.assertIs(client, self.handler.get_boto3_client.return_value)
+        self.assertIs(pool.get(self.handler, 'us-east-1', 'rds'), client)
+        self.handler.get_boto3_client.assert_called_once_with('us-east-1', 'rds')
+
+    def test_resources_are_built_by_the_handler_api_wrapper(self):
+        resource = self.module.AWSClientPool().get(self.handler, 'us-east-1', 'ec2', 'resource')
+
+        wrapper = self.handler.get_api_wrapper.return_value
+        self.assertIs(resource, wrapper.get_boto3_resource.return_value)
+        wrapper.get_boto3_resource.assert_called_once_with('key', 'secret', 'us-east-1', 'ec2')
+
+    def test_rotated_credentials_rebuild_the_client(self):
+        pool = self.module.AWSClientPool()
+        pool.get(self.handler, 'us-east-1', 'rds')
+        self.handler.servicepasswd = 'rotated'
+        pool.get(self.handler, 'us-east-1', 'rds')
+
+        self.assertEqual(self.handler.get_boto3_client.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+import os
+import tempfile
+import unittest
+
+from plugin_loader import REPO_ROOT, aws_plugin_paths, load_plugin
+
+
+class AWSRateLimiterTest(unittest.TestCase):
+    def test_takes_a_token_without_waiting(self):
+        module = load_plugin(aws_plugin_paths()[0])
+        with tempfile.TemporaryDirectory() as directory:
+            limiter = module.AWSRateLimiter(directory=directory)
+            self.assertEqual(limiter.acquire(1, 'us-east-1', 'rds', 'DescribeDBInstances'), 0)
+            self.assertEqual(os.listdir(directory), ['1-us-east-1-rds-read'])
+
+    def test_unusable_bucket_directory_does_not_fail_the_call(self):
+        # the client pool is shared by every AWS plug-in in a process, so the
+        # copy in each of them must degrade instead of raising
+        with tempfile.NamedTemporaryFile() as not_a_directory:
+            for path in aws_plugin_paths():
+                with self.subTest(plugin=os.path.relpath(path, REPO_ROOT)):
+                    module = load_plugin(path)
+                    limiter = module.AWSRateLimiter(directory=os.path.join(not_a_directory.name, 'buckets'))
+                    self.assertEqual(limiter.acquire(1, 'us-east-1', 'rds', 'CreateDBInstance'), 0)
+                    module.logger.warning.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+from plugin_loader import REPO_ROOT, load_plugin
+
+BENCHMARK_DIR = os.path.join(REPO_ROOT, 'benchmarks', 'discovery')
+sys.path.insert(0, BENCHMARK_DIR)
+
+import fakes  # noqa: E402
+import run_discovery_benchmark as benchmark  # noqa: E402
+
+
+def measure(case, stored=None):
+    """
+    Run one AWS case against the fakes and return its records, API calls and
+    the fingerprints it produced.
+    """
+    plugin = benchmark.PLUGINS[case['plugin']]
+    module = load_plugin(os.path.join(REPO_ROOT, plugin['path']))
+    module.set_progress = lambda *args, **kwargs: None
+    counter = fakes.CallCounter(0)
+    benchmark.stub_aws(module, fakes.Estate(case['size'], case['locations'], seed=0), counter)
+    if stored is not None:
+        module.get_stored_fingerprints = lambda: dict(stored)
+    records, fingerprints = benchmark.consume(module, plugin['identifier'])
+    return records, sum(counter.calls.values()), fingerprints
+
+
+class DiscoveryBaselineTest(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(BENCHMARK_DIR, 'baseline.json')) as baseline:
+            self.baseline = json.load(baseline)
+
+    def test_baseline_matches_the_api_calls_of_the_smallest_cases(self):
+        for cold in self.baseline['results']:
+            if cold['size'] != 1000 or cold['phase'] != 'cold':
+                continue
+            with self.subTest(case=benchmark.case_key(cold)):
+                records, api_calls, stored = measure(cold)
+                self.assertEqual((records, api_calls), (cold['records'], cold['api_calls']))
+
+                warm = next(result for result in self.baseline['results']
+                            if benchmark.case_key(result) == benchmark.case_key(dict(cold, phase='warm')))
+                # the fingerprints reach the warm pass through a file, as in the benchmark
+                with tempfile.TemporaryDirectory() as directory:
+                    path = os.path.join(directory, 'fingerprints.json')
+                    benchmark.write_fingerprints(path, stored)
+                    records, api_calls, _ = measure(warm, benchmark.read_fingerprints(path))
+                self.assertEqual((records, api_calls), (warm['records'], warm['api_calls']))
+
+    def test_metrics_missing_from_the_baseline_are_not_compared(self):
+        result = dict(self.baseline['results'][0], wall_seconds=5, orm_queries=10, peak_rss_mb=100)
+        self.assertEqual(benchmark.compare([result], self.baseline), [])
+        self.assertEqual(len(benchmark.compare([dict(result, api_calls=result['api_calls'] + 1)], self.baseline)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import unittest
+from concurrent.futures import Future
+from types import SimpleNamespace
+from unittest import mock
+
+from plugin_loader import REPO_ROOT, load_plugin
+
+DISCOVER_MYSQL = os.path.join(REPO_ROOT, 'blueprints', 'AWS MySQL', 'Discovery Item Discover AWS MySQL',
+                              'Discover AWS MySQL Script.py')
+STOP_MYSQL = os.path.join(REPO_ROOT, 'blueprints', 'AWS MySQL', 'Management Item Stop MySQL Database Instance',
+                          'Hook for Stop MySQL Database Instance',
+                          'Sub File for Hook of Stop MySQL Database Instance Script.py')
+
+
+def db_instance(status):
+    return {'DBInstanceIdentifier': 'db-1', 'Engine': 'mysql', 'DBInstanceStatus': status, 'MasterUsername': 'admin',
+            'PubliclyAccessible': False, 'AvailabilityZone': 'us-east-1a'}
+
+
+class WriteBetweenSyncsTest(unittest.TestCase):
+    def setUp(self):
+        self.discovery = load_plugin(DISCOVER_MYSQL)
+        self.handler = mock.Mock(id=1)
+        self.key = ('1', 'us-east-1', 'db-1')
+
+    def sync(self, status, stored):
+        """
+        Run the discovery of one region reporting db-1 in status and return
+        what it yields for it.
+        """
+        future = Future()
+        future.set_result(([db_instance(status)], None))
+        return next(self.discovery.get_region_records(self.handler, 'us-east-1', future, stored, set()))
+
+    def stop(self, resource):
+        module = load_plugin(STOP_MYSQL)
+        client = mock.Mock()
+        client.describe_db_instances.return_value = {'DBInstances': [db_instance('available')]}
+        client.stop_db_instance.return_value = {'DBInstance': db_instance('stopped')}
+        module.get_aws_client = lambda handler, region, service_name: client
+        module.run(job=mock.Mock(), resource=resource)
+
+    def test_a_database_stopped_and_started_again_is_synced_again(self):
+        fingerprint = self.sync('available', {})['discovery_fingerprint']
+        self.assertIsNone(self.sync('available', {self.key: fingerprint}))
+
+        resource = SimpleNamespace(db_identifier='db-1', aws_rh_id=1, aws_region='us-east-1', db_status='available',
+                                   discovery_fingerprint=fingerprint, save=mock.Mock())
+        self.stop(resource)
+        self.assertEqual((resource.db_status, resource.discovery_fingerprint), ('stopped', ''))
+        resource.save.assert_called_once()
+
+        # started again from the console: AWS is back to the last synced state, the resource is not
+        record = self.sync('available', {self.key: resource.discovery_fingerprint})
+        self.assertEqual(record['db_status'], 'available')
+
+
+if __name__ == '__main__':
+    unittest.main()
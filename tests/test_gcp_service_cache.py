@@ -0,0 +1,52 @@
+import os
+import threading
+import unittest
+from unittest import mock
+
+from plugin_loader import REPO_ROOT, load_plugin
+
+SYNC_GKE = os.path.join(REPO_ROOT, 'blueprints', 'Google Kubernetes Engine Cluster', 'Discovery Item sync gke cluster',
+                        'sync gke cluster Script.py')
+
+
+def in_thread(function):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(function()))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+class GCPServiceCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.module = load_plugin(SYNC_GKE)
+        self.module.build = mock.Mock(side_effect=lambda *args, **kwargs: mock.Mock(http=kwargs['http']))
+        self.cache = self.module.GCPServiceCache()
+
+    def test_threads_share_the_service(self):
+        service = self.cache.get(1, 'api_key', 'secret', mock.Mock, 'container')
+        self.assertIs(in_thread(lambda: self.cache.get(1, 'api_key', 'secret', mock.Mock, 'container')), service)
+        self.module.build.assert_called_once()
+
+    def test_each_thread_gets_its_own_http(self):
+        self.module.AuthorizedHttp = mock.Mock(side_effect=lambda credentials, http: mock.Mock())
+        http = self.module.ThreadLocalHttp(object())
+
+        self.assertIs(http.get_http(), http.get_http())
+        self.assertIsNot(in_thread(http.get_http), http.get_http())
+
+    def test_credentials_of_one_handler_do_not_evict_each_other(self):
+        api = self.cache.get(1, 'api_key', 'api-secret', mock.Mock, 'container')
+        account = self.cache.get(1, 'sa@example.com', 'sa-secret', mock.Mock, 'container')
+
+        self.assertIs(self.cache.get(1, 'api_key', 'api-secret', mock.Mock, 'container'), api)
+        self.assertIs(self.cache.get(1, 'sa@example.com', 'sa-secret', mock.Mock, 'container'), account)
+        self.assertEqual(self.module.build.call_count, 2)
+
+    def test_rotated_credentials_rebuild_the_service(self):
+        service = self.cache.get(1, 'api_key', 'old', mock.Mock, 'container')
+        self.assertIsNot(self.cache.get(1, 'api_key', 'new', mock.Mock, 'container'), service)
+
+
+if __name__ == '__main__':
+    unittest.main()
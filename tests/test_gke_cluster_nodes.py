@@ -0,0 +1,30 @@
+import os
+import unittest
+
+from plugin_loader import REPO_ROOT, load_plugin
+
+SYNC_GKE = os.path.join(REPO_ROOT, 'blueprints', 'Google Kubernetes Engine Cluster', 'Discovery Item sync gke cluster',
+                        'sync gke cluster Script.py')
+
+NODES = {'web': {
+    'europe-west1-b': ['west1-b'],
+    'europe-west1-c': ['west1-c'],
+    'europe-west12-a': ['west12-a'],
+}}
+
+
+class GetClusterNodesTest(unittest.TestCase):
+    def setUp(self):
+        self.module = load_plugin(SYNC_GKE)
+
+    def test_zonal_cluster_matches_its_zone_only(self):
+        cluster = {'name': 'web', 'zone': 'europe-west1-b', 'location': 'europe-west1-b'}
+        self.assertEqual(self.module.get_cluster_nodes(NODES, cluster), ['west1-b'])
+
+    def test_regional_cluster_matches_the_zones_of_its_region_only(self):
+        cluster = {'name': 'web', 'zone': 'europe-west1', 'location': 'europe-west1'}
+        self.assertEqual(sorted(self.module.get_cluster_nodes(NODES, cluster)), ['west1-b', 'west1-c'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import unittest
+from unittest import mock
+
+from plugin_loader import REPO_ROOT, load_plugin
+
+SYNC_GKE = os.path.join(REPO_ROOT, 'blueprints', 'Google Kubernetes Engine Cluster', 'Discovery Item sync gke cluster',
+                        'sync gke cluster Script.py')
+
+
+class MissingZonesTest(unittest.TestCase):
+    def setUp(self):
+        self.module = load_plugin(SYNC_GKE)
+        self.module.get_cluster_resources = mock.Mock(return_value={})
+        self.module.create_servers = mock.Mock(return_value={})
+
+    def retire(self, missing_zones, **previous):
+        """
+        Sync a project that lists no cluster, where previous is
+        {cluster name: gcp_zone} as last synced, and return the clusters
+        marked deleted.
+        """
+        resources = {name: mock.Mock(lifecycle='ACTIVE') for name in previous}
+        zones = {id(resource): previous[name] for name, resource in resources.items()}
+        self.module.get_attribute_values = lambda resource: {'gcp_zone': zones[id(resource)]}
+
+        self.module.sync_project_clusters(mock.Mock(), mock.Mock(), 'project', [], {}, set(), resources,
+                                          missing_zones, mock.Mock(), mock.Mock(), mock.Mock())
+        return sorted(name for name, resource in resources.items() if resource.lifecycle == 'HISTORICAL')
+
+    def test_missing_zones_are_returned_with_the_clusters(self):
+        wrapper = mock.Mock()
+        request = wrapper.projects.return_value.zones.return_value.clusters.return_value.list.return_value
+        request.execute.return_value = {'clusters': [{'name': 'web'}], 'missingZones': ['us-east1-b']}
+
+        self.assertEqual(self.module.list_gke_clusters(wrapper, 'project'), ([{'name': 'web'}], ['us-east1-b']))
+
+    def test_clusters_in_an_unreachable_zone_or_its_region_are_kept(self):
+        retired = self.retire(['us-east1-b'], zonal='us-east1-b', regional='us-east1', elsewhere='europe-west1-b',
+                              unknown=None)
+        self.assertEqual(retired, ['elsewhere'])
+
+    def test_clusters_are_retired_when_every_zone_was_reached(self):
+        self.assertEqual(self.retire([], zonal='us-east1-b', regional='us-east1'), ['regional', 'zonal'])
+
+
+if __name__ == '__main__':
+    unittest.main()
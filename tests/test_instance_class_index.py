@@ -0,0 +1,54 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from plugin_loader import REPO_ROOT, load_plugin
+
+CREATE_PLUGINS = [
+    os.path.join(REPO_ROOT, 'blueprints', 'AWS MySQL', 'Deployment Item 1 Create AWS MySQL Database Service',
+                 'Create AWS MySQL Database Service Script.py'),
+    os.path.join(REPO_ROOT, 'blueprints', 'AWS PostgreSQL', 'Deployment Item 1 Create AWS PostgreSQL Database',
+                 'Create AWS PostgreSQL Database Script.py'),
+]
+BUILT_INDEX = os.path.join(REPO_ROOT, 'blueprints', 'AWS RDS Instance Class Index', 'rds_instance_class_index.bin')
+
+
+class InstanceClassIndexTest(unittest.TestCase):
+    def setUp(self):
+        sys.modules.pop('cloudbolt_plugin_process_state_v1', None)
+        self.addCleanup(sys.modules.pop, 'cloudbolt_plugin_process_state_v1', None)
+        self.proserv = tempfile.TemporaryDirectory()
+        self.addCleanup(self.proserv.cleanup)
+
+    def load(self, path):
+        module = load_plugin(path)
+        module.INSTANCE_CLASS_INDEX_PATH = os.path.join(self.proserv.name, 'rds_instance_class_index.bin')
+        return module
+
+    def test_loads_the_installed_index(self):
+        shutil.copyfile(BUILT_INDEX, os.path.join(self.proserv.name, 'rds_instance_class_index.bin'))
+        for path in CREATE_PLUGINS:
+            with self.subTest(plugin=os.path.basename(path)):
+                sys.modules.pop('cloudbolt_plugin_process_state_v1', None)
+                index = self.load(path).get_instance_class_index()
+                self.assertIsNotNone(index)
+                self.assertGreater(index.count, 0)
+
+    def test_missing_index_is_reported_once_per_process(self):
+        module = self.load(CREATE_PLUGINS[0])
+        self.assertIsNone(module.get_instance_class_index())
+        module.logger.warning.assert_called_once()
+        message = module.logger.warning.call_args.args[0]
+        self.assertIn(module.INSTANCE_CLASS_INDEX_PATH, message)
+        self.assertIn('--install', message)
+
+        # the next render executes the plug-in again
+        module = self.load(CREATE_PLUGINS[0])
+        self.assertIsNone(module.get_instance_class_index())
+        module.logger.warning.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import os
+import sys
+import unittest
+
+from plugin_loader import REPO_ROOT, load_plugin
+
+CREATE_MYSQL = os.path.join(REPO_ROOT, 'blueprints', 'AWS MySQL', 'Deployment Item 1 Create AWS MySQL Database Service',
+                            'Create AWS MySQL Database Service Script.py')
+DISCOVER_MYSQL = os.path.join(REPO_ROOT, 'blueprints', 'AWS MySQL', 'Discovery Item Discover AWS MySQL',
+                              'Discover AWS MySQL Script.py')
+
+
+class ProcessStateTest(unittest.TestCase):
+    def setUp(self):
+        sys.modules.pop('cloudbolt_plugin_process_state_v1', None)
+        self.addCleanup(sys.modules.pop, 'cloudbolt_plugin_process_state_v1', None)
+
+    def test_custom_fields_are_ensured_once_per_process(self):
+        # CloudBolt executes the plug-in file again for every job
+        first_job = load_plugin(DISCOVER_MYSQL)
+        first_job.get_or_create_custom_fields_as_needed()
+        first_job.CustomField.objects.bulk_create.assert_called_once()
+
+        second_job = load_plugin(DISCOVER_MYSQL)
+        second_job.get_or_create_custom_fields_as_needed()
+        second_job.CustomField.objects.filter.assert_not_called()
+        second_job.CustomField.objects.bulk_create.assert_not_called()
+
+    def test_rds_regions_are_read_once_per_process(self):
+        first_job = load_plugin(CREATE_MYSQL)
+        first_job.boto3.session.Session.return_value.get_available_partitions.return_value = ['aws']
+        first_job.boto3.session.Session.return_value.get_available_regions.return_value = ['us-east-1']
+        self.assertEqual(first_job.get_rds_supported_regions(), frozenset(['us-east-1']))
+
+        second_job = load_plugin(CREATE_MYSQL)
+        self.assertEqual(second_job.get_rds_supported_regions(), frozenset(['us-east-1']))
+        second_job.boto3.session.Session.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import unittest
+from unittest import mock
+
+from plugin_loader import REPO_ROOT, load_plugin
+
+BULK_START_STOP = os.path.join(REPO_ROOT, 'blueprints', 'AWS RDS Bulk Start Stop', 'AWS RDS Bulk Start Stop Script.py')
+
+
+class ClientError(Exception):
+    response = {'Error': {'Code': 'AccessDenied'}}
+
+
+def rds_client(statuses):
+    """
+    Return an RDS client describing {identifier: status}, reporting every
+    database as available once it has been started.
+    """
+    client = mock.Mock()
+    started = set()
+
+    def paginate(Filters):
+        return [{'DBInstances': [
+            {'DBInstanceIdentifier': identifier,
+             'DBInstanceStatus': 'available' if identifier in started else statuses[identifier]}
+            for identifier in Filters[0]['Values'] if identifier in statuses
+        ]}]
+
+    client.get_paginator.return_value.paginate.side_effect = paginate
+    client.start_db_instance.side_effect = lambda DBInstanceIdentifier: started.add(DBInstanceIdentifier)
+    return client
+
+
+class BulkStartStopTest(unittest.TestCase):
+    def setUp(self):
+        self.module = load_plugin(BULK_START_STOP)
+        self.module.BULK_ACTION = 'start'
+        self.module.ClientError = ClientError
+        self.module.BotoCoreError = type('BotoCoreError', (Exception,), {})
+        self.module.write_resource_attributes = mock.Mock()
+        self.module.time = mock.Mock(monotonic=mock.Mock(return_value=0))
+
+        self.databases = {'db-east': ('us-east-1', mock.Mock()), 'db-west': ('us-west-2', mock.Mock())}
+        self.module.get_target_resources = mock.Mock(return_value=[resource for _, resource in self.databases.values()])
+        self.module.get_attribute_values = lambda resource: next(
+            {'aws_rh_id': 1, 'aws_region': region, 'db_identifier': identifier}
+            for identifier, (region, candidate) in self.databases.items() if candidate is resource)
+
+    def test_a_failing_region_is_reported_without_failing_the_others(self):
+        west = mock.Mock()
+        west.get_paginator.return_value.paginate.side_effect = ClientError('access denied in us-west-2')
+        clients = {'us-east-1': rds_client({'db-east': 'stopped'}), 'us-west-2': west}
+        self.module.get_aws_client = lambda handler, region, service_name: clients[region]
+
+        status, message, _ = self.module.run(job=mock.Mock())
+
+        self.assertEqual(status, 'WARNING')
+        self.assertEqual(message, 'Start completed for 1 of 2 database(s).')
+        updates = self.module.write_resource_attributes.call_args.args[0]
+        self.assertEqual(updates, {self.databases['db-east'][1]: {'db_status': 'available'}})
+        self.module.set_progress.assert_any_call('db-west (us-west-2): failed: access denied in us-west-2')
+
+    def test_a_failing_poll_is_reported_per_database(self):
+        east = rds_client({'db-east': 'stopped'})
+        describe = east.get_paginator.return_value.paginate.side_effect
+        results = [describe(Filters=[{'Values': ['db-east']}]), ClientError('poll denied')]
+        east.get_paginator.return_value.paginate.side_effect = results
+        self.databases = {'db-east': self.databases['db-east']}
+        self.module.get_target_resources.return_value = [self.databases['db-east'][1]]
+        self.module.get_aws_client = lambda handler, region, service_name: east
+
+        status, _, _ = self.module.run(job=mock.Mock())
+
+        self.assertEqual(status, 'WARNING')
+        self.module.set_progress.assert_any_call('db-east (us-east-1): start issued, polling failed: poll denied')
+
+    def test_a_database_in_a_failed_status_is_not_waited_for(self):
+        east = rds_client({'db-east': 'stopped'})
+        east.start_db_instance.side_effect = None
+        describe = east.get_paginator.return_value.paginate.side_effect
+        failed = [{'DBInstances': [{'DBInstanceIdentifier': 'db-east', 'DBInstanceStatus': 'incompatible-network'}]}]
+        east.get_paginator.return_value.paginate.side_effect = [describe(Filters=[{'Values': ['db-east']}]), failed]
+        self.databases = {'db-east': self.databases['db-east']}
+        self.module.get_target_resources.return_value = [self.databases['db-east'][1]]
+        self.module.get_aws_client = lambda handler, region, service_name: east
+
+        status, _, _ = self.module.run(job=mock.Mock())
+
+        self.assertEqual(status, 'WARNING')
+        self.module.time.sleep.assert_not_called()
+        self.module.set_progress.assert_any_call('db-east (us-east-1): failed, status is incompatible-network')
+        updates = self.module.write_resource_attributes.call_args.args[0]
+        self.assertEqual(updates, {self.databases['db-east'][1]: {'db_status': 'incompatible-network'}})
+
+
+if __name__ == '__main__':
+    unittest.main()
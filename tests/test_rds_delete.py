@@ -0,0 +1,88 @@
+import os
+import unittest
+from unittest import mock
+
+from plugin_loader import REPO_ROOT, load_plugin
+
+DELETE_PLUGINS = [
+    os.path.join(REPO_ROOT, 'blueprints', 'AWS MySQL', 'Teardown Item 2 Delete AWS MySQL Database Service',
+                 'Delete AWS MySQL Database Service Script.py'),
+    os.path.join(REPO_ROOT, 'blueprints', 'AWS PostgreSQL', 'Teardown Item 2 Delete AWS PostgreSQL Database',
+                 'Delete AWS PostgreSQL Database Script.py'),
+]
+
+
+def rds_client():
+    """
+    Return an RDS client that accepts every delete and no longer describes the
+    deleted instances.
+    """
+    client = mock.Mock()
+    client.get_paginator.return_value.paginate.return_value = [{'DBInstances': []}]
+    return client
+
+
+class DeleteDatabasesTest(unittest.TestCase):
+    def load(self, path, databases):
+        """
+        Load the plug-in with databases, a list of (rh_id, region, identifier),
+        and return it with the resources to delete.
+        """
+        module = load_plugin(path)
+        module.ClientError = type('ClientError', (Exception,), {})
+        module.BotoCoreError = type('BotoCoreError', (Exception,), {})
+        resources = [mock.Mock() for _ in databases]
+        values = {id(resource): {'aws_rh_id': rh_id, 'aws_region': region, 'db_identifier': identifier}
+                  for resource, (rh_id, region, identifier) in zip(resources, databases)}
+        module.get_attribute_values = lambda resource: values[id(resource)]
+        module.AWSHandler.objects.filter.side_effect = lambda id: mock.Mock(**{'first.return_value': mock.Mock(id=id)})
+        return module, mock.Mock(**{'prefetch_related.return_value': resources})
+
+    def test_same_identifier_in_two_accounts_is_reported_for_both(self):
+        for path in DELETE_PLUGINS:
+            with self.subTest(plugin=os.path.basename(path)):
+                module, resources = self.load(path, [(1, 'us-east-1', 'db'), (2, 'us-east-1', 'db')])
+                clients = {1: rds_client(), 2: rds_client()}
+                module.get_aws_client = lambda handler, region, service_name: clients[handler.id]
+
+                with mock.patch.object(module.time, 'sleep'):
+                    status, message, _ = module.run(job=mock.Mock(), logger=mock.Mock(), resources=resources)
+
+                self.assertEqual(status, 'SUCCESS')
+                self.assertIn('2 of 2', message)
+                for client in clients.values():
+                    client.delete_db_instance.assert_called_once()
+
+    def test_stragglers_end_with_a_warning_once_the_wait_is_over(self):
+        for path in DELETE_PLUGINS:
+            with self.subTest(plugin=os.path.basename(path)):
+                module, resources = self.load(path, [(1, 'us-east-1', 'db')])
+                module.get_aws_client = lambda handler, region, service_name: rds_client()
+                module.DELETE_TIMEOUT = 0
+
+                with mock.patch.object(module.time, 'sleep'):
+                    status, message, error = module.run(job=mock.Mock(), logger=mock.Mock(), resources=resources)
+
+                self.assertEqual((status, error), ('WARNING', 'Some databases are still being deleted by RDS'))
+                self.assertIn('0 of 1', message)
+
+    def test_a_failing_poll_does_not_lose_the_other_regions(self):
+        for path in DELETE_PLUGINS:
+            with self.subTest(plugin=os.path.basename(path)):
+                module, resources = self.load(path, [(1, 'us-east-1', 'db-east'), (1, 'us-west-2', 'db-west')])
+                west = rds_client()
+                denied = module.ClientError('access denied')
+                denied.response = {'Error': {'Code': 'AccessDenied'}}
+                west.get_paginator.return_value.paginate.side_effect = denied
+                clients = {'us-east-1': rds_client(), 'us-west-2': west}
+                module.get_aws_client = lambda handler, region, service_name: clients[region]
+
+                with mock.patch.object(module.time, 'sleep'):
+                    status, message, error = module.run(job=mock.Mock(), logger=mock.Mock(), resources=resources)
+
+                self.assertEqual((status, error), ('FAILURE', 'deletion could not be confirmed: access denied'))
+                self.assertIn('1 of 2', message)
+
+
+if __name__ == '__main__':
+    unittest.main()
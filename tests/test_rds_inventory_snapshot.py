@@ -0,0 +1,71 @@
+import fcntl
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from plugin_loader import REPO_ROOT, load_plugin
+
+DISCOVERY_PLUGINS = [
+    os.path.join(REPO_ROOT, 'blueprints', 'AWS MySQL', 'Discovery Item Discover AWS MySQL',
+                 'Discover AWS MySQL Script.py'),
+    os.path.join(REPO_ROOT, 'blueprints', 'AWS PostgreSQL', 'Discovery Item Sync AWS PostgreSQL Database',
+                 'Sync AWS PostgreSQL Database Script.py'),
+]
+
+
+class DictCache(dict):
+    def set(self, key, value, timeout=None):
+        self[key] = value
+
+
+class InventorySnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.handler = mock.Mock(id=1)
+
+    def load(self, path):
+        module = load_plugin(path)
+        module.INVENTORY_CACHE_DIR = self.directory.name
+        module.inventory_cache = DictCache()
+        module.describe_region_db_instances = mock.Mock(return_value=(['db-1'], None))
+        return module
+
+    def test_a_fresh_snapshot_is_not_swept_again(self):
+        for path in DISCOVERY_PLUGINS:
+            with self.subTest(plugin=os.path.basename(path)):
+                module = self.load(path)
+                self.assertEqual(module.get_region_db_instances(self.handler, 'us-east-1'), (['db-1'], None))
+                self.assertEqual(module.get_region_db_instances(self.handler, 'us-east-1'), (['db-1'], None))
+                module.describe_region_db_instances.assert_called_once()
+
+    def test_waits_for_the_sweep_another_worker_is_running(self):
+        module = self.load(DISCOVERY_PLUGINS[0])
+        os.makedirs(os.path.join(self.directory.name, 'locks'))
+        other_worker = open(os.path.join(self.directory.name, 'locks', '1-us-east-1'), 'a')
+        fcntl.flock(other_worker, fcntl.LOCK_EX)
+
+        def other_worker_finishes(seconds):
+            module.inventory_cache.set('rds_inventory:1:us-east-1', ['db-2'])
+            other_worker.close()
+
+        with mock.patch.object(module.time, 'sleep', side_effect=other_worker_finishes):
+            self.assertEqual(module.get_region_db_instances(self.handler, 'us-east-1'), (['db-2'], None))
+        module.describe_region_db_instances.assert_not_called()
+
+    def test_sweeps_without_the_lock_when_it_cannot_be_taken(self):
+        for path in DISCOVERY_PLUGINS:
+            with self.subTest(plugin=os.path.basename(path)):
+                module = self.load(path)
+                # a file where the lock directory should be
+                module.INVENTORY_CACHE_DIR = os.path.join(self.directory.name, 'not-a-directory')
+                open(module.INVENTORY_CACHE_DIR, 'w').close()
+
+                self.assertEqual(module.get_region_db_instances(self.handler, 'us-east-1'), (['db-1'], None))
+                module.describe_region_db_instances.assert_called_once()
+                module.logger.warning.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
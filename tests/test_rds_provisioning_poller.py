@@ -0,0 +1,77 @@
+import os
+import unittest
+from unittest import mock
+
+from plugin_loader import REPO_ROOT, load_plugin
+
+PROVISIONING_POLLER = os.path.join(REPO_ROOT, 'blueprints', 'AWS RDS Provisioning Poller',
+                                   'AWS RDS Provisioning Poller Script.py')
+
+
+class ClientError(Exception):
+    pass
+
+
+class ProvisioningPollerTest(unittest.TestCase):
+    def setUp(self):
+        self.module = load_plugin(PROVISIONING_POLLER)
+        self.module.ClientError = ClientError
+        self.module.BotoCoreError = type('BotoCoreError', (Exception,), {})
+        self.module.write_resource_attributes = mock.Mock()
+
+    def pending(self, **databases):
+        """
+        Make {name: (region, db_identifier)} the pending databases and return
+        their resources by name.
+        """
+        resources = {name: mock.Mock(name=name) for name in databases}
+        values = {id(resources[name]): {'aws_rh_id': 1, 'aws_region': region, 'db_identifier': identifier}
+                  for name, (region, identifier) in databases.items()}
+        self.module.Resource.objects.filter.return_value.distinct.return_value.prefetch_related.return_value = \
+            list(resources.values())
+        self.module.get_attribute_values = lambda resource: values[id(resource)]
+        return resources
+
+    def test_a_failing_region_does_not_stop_the_others(self):
+        resources = self.pending(east=('us-east-1', 'db-east'), west=('us-west-2', 'db-west'))
+        east, west = mock.Mock(), mock.Mock()
+        east.get_paginator.return_value.paginate.return_value = [{'DBInstances': [
+            {'DBInstanceIdentifier': 'db-east', 'DBInstanceStatus': 'incompatible-network'}]}]
+        west.get_paginator.return_value.paginate.side_effect = ClientError('access denied')
+        clients = {'us-east-1': east, 'us-west-2': west}
+        self.module.get_aws_client = lambda handler, region, service_name: clients[region]
+
+        status, message, _ = self.module.run()
+
+        self.assertEqual(status, 'WARNING')
+        self.assertEqual(message, '0 RDS database(s) completed, 1 failed. 1 could not be checked.')
+        updates = self.module.write_resource_attributes.call_args.args[0]
+        self.assertEqual(updates, {resources['east']: {'db_status': 'incompatible-network',
+                                                       'db_provisioning_state': 'failed'}})
+
+    def test_databases_without_an_identifier_are_failed_without_a_describe(self):
+        resources = self.pending(blank=('us-east-1', ''), unset=('us-east-1', None))
+        self.module.get_aws_client = mock.Mock()
+
+        status, message, _ = self.module.run()
+
+        self.assertEqual((status, message), ('SUCCESS', '0 RDS database(s) completed, 2 failed.'))
+        self.module.get_aws_client.assert_not_called()
+        updates = self.module.write_resource_attributes.call_args.args[0]
+        self.assertEqual(updates, {resource: {'db_provisioning_state': 'failed'} for resource in resources.values()})
+
+    def test_databases_without_a_handler_or_region_are_reported_unchecked(self):
+        self.pending(orphan=('us-east-1', 'db-orphan'), nowhere=('', 'db-nowhere'))
+        self.module.AWSHandler.objects.filter.return_value.first.side_effect = [None, mock.Mock(id=1)]
+        self.module.get_aws_client = mock.Mock()
+
+        status, message, _ = self.module.run()
+
+        self.assertEqual((status, message),
+                         ('WARNING', '0 RDS database(s) completed, 0 failed. 2 could not be checked.'))
+        self.module.get_aws_client.assert_not_called()
+        self.module.write_resource_attributes.assert_called_once_with({})
+
+
+if __name__ == '__main__':
+    unittest.main()
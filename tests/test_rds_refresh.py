@@ -0,0 +1,104 @@
+import os
+import unittest
+from unittest import mock
+
+from plugin_loader import REPO_ROOT, load_plugin
+
+REFRESH_PLUGINS = [
+    os.path.join(REPO_ROOT, 'blueprints', 'AWS MySQL', 'Management Item Refresh MySQL Database Connection Info',
+                 'Hook for Refresh MySQL Database Connection Info',
+                 'Sub File for Hook of Refresh MySQL Database Connection Info Script.py'),
+    os.path.join(REPO_ROOT, 'blueprints', 'AWS PostgreSQL',
+                 'Management Item Refresh PostgreSQL Database Connection Info',
+                 'Hook for Refresh  PostgreSQL Database Connection Info',
+                 'Sub File for Hook of Refresh  PostgreSQL Database Connection Info Script.py'),
+]
+
+
+class ClientError(Exception):
+    pass
+
+
+def rds_client(*identifiers):
+    """
+    Return an RDS client that describes the given DB instances.
+    """
+    client = mock.Mock()
+    client.get_paginator.return_value.paginate.return_value = [{'DBInstances': [
+        {'DBInstanceIdentifier': identifier, 'Engine': 'mysql', 'DBInstanceStatus': 'available',
+         'MasterUsername': 'admin', 'PubliclyAccessible': False, 'AvailabilityZone': 'us-east-1a'}
+        for identifier in identifiers]}]
+    return client
+
+
+class RefreshFleetTest(unittest.TestCase):
+    def load(self, path, **databases):
+        """
+        Load the plug-in refreshing {name: (region, db_identifier)} and return
+        it with the resources by name.
+        """
+        module = load_plugin(path)
+        module.ClientError = ClientError
+        module.BotoCoreError = type('BotoCoreError', (Exception,), {})
+        module.get_or_create_custom_fields_as_needed = mock.Mock()
+        module.write_resource_attributes = mock.Mock()
+        module.AWSHandler.objects.filter.return_value.first.return_value = mock.Mock(id=1)
+
+        resources = {}
+        values = {}
+        for name, (region, identifier) in databases.items():
+            resources[name] = mock.Mock()
+            resources[name].name = name
+            values[id(resources[name])] = {'aws_rh_id': 1, 'aws_region': region, 'db_identifier': identifier}
+        module.get_target_resources = lambda resource, **kwargs: list(resources.values())
+        module.get_attribute_values = lambda resource: values[id(resource)]
+        return module, resources
+
+    def written(self, module):
+        updates = {}
+        for call in module.write_resource_attributes.call_args_list:
+            updates.update(call.args[0])
+        return updates
+
+    def test_a_failing_region_does_not_stop_the_others(self):
+        for path in REFRESH_PLUGINS:
+            with self.subTest(plugin=os.path.basename(path)):
+                module, resources = self.load(path, east=('us-east-1', 'db-east'), west=('us-west-2', 'db-west'))
+                west = mock.Mock()
+                west.get_paginator.return_value.paginate.side_effect = ClientError('access denied')
+                clients = {'us-east-1': rds_client('db-east'), 'us-west-2': west}
+                module.get_aws_client = lambda handler, region, service_name: clients[region]
+
+                status, message, _ = module.run(job=mock.Mock(), resource=mock.Mock())
+
+                self.assertEqual(status, 'WARNING')
+                self.assertIn('db-west could not be checked', message)
+                self.assertEqual(list(self.written(module)), [resources['east']])
+                self.assertEqual(self.written(module)[resources['east']]['db_status'], 'available')
+
+    def test_each_region_is_written_once_it_is_described(self):
+        module, resources = self.load(REFRESH_PLUGINS[0], east=('us-east-1', 'db-east'), west=('us-west-2', 'db-west'))
+        clients = {'us-east-1': rds_client('db-east'), 'us-west-2': rds_client('db-west')}
+        module.get_aws_client = lambda handler, region, service_name: clients[region]
+
+        status, message, _ = module.run(job=mock.Mock(), resource=mock.Mock())
+
+        self.assertEqual((status, message), ('SUCCESS', '2 MySQL database instance(s) updated successfully.'))
+        self.assertEqual([list(call.args[0]) for call in module.write_resource_attributes.call_args_list],
+                         [[resources['east']], [resources['west']]])
+
+    def test_databases_without_an_identifier_are_not_found_without_a_describe(self):
+        module, resources = self.load(REFRESH_PLUGINS[0], blank=('us-east-1', ''), unset=('us-east-1', None))
+        module.get_aws_client = mock.Mock()
+
+        status, message, _ = module.run(job=mock.Mock(), resource=mock.Mock())
+
+        self.assertEqual(status, 'WARNING')
+        self.assertIn('blank, unset not found', message)
+        module.get_aws_client.assert_not_called()
+        not_found = {resource: {'db_status': 'not-found'} for resource in resources.values()}
+        self.assertEqual(self.written(module), not_found)
+
+
+if __name__ == '__main__':
+    unittest.main()
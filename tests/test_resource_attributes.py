@@ -0,0 +1,129 @@
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from plugin_loader import REPO_ROOT, load_plugin
+
+RESOURCE_ATTRIBUTES = os.path.join(REPO_ROOT, 'blueprints', 'Shared Plug-in Code', 'resource_attributes.py')
+
+
+class FakeCustomFieldValue(object):
+    """
+    A CustomFieldValue whose manager keeps its rows in a list.
+    """
+    COLUMNS = {'STR': 'str_value', 'INT': 'int_value', 'BOOL': 'boolean_value'}
+
+    def __init__(self, field, str_value=None, int_value=None, boolean_value=None):
+        self.id = None
+        self.field = field
+        self.str_value, self.int_value, self.boolean_value = str_value, int_value, boolean_value
+
+    @property
+    def value(self):
+        return getattr(self, self.COLUMNS[self.field.type])
+
+
+class FakeManager(object):
+    def __init__(self):
+        self.rows = []
+
+    def filter(self, field, **lookup):
+        (column, values), = lookup.items()
+        column = column[:-len('__in')]
+        return [row for row in self.rows if row.field is field and getattr(row, column) in values]
+
+    def bulk_create(self, rows):
+        for row in rows:
+            row.id = len(self.rows) + 1
+            self.rows.append(row)
+
+    def get_or_create(self, **kwargs):
+        raise AssertionError('typed values must not be written one at a time')
+
+
+class FakeLink(SimpleNamespace):
+    objects = None
+
+
+class ResourceAttributesTest(unittest.TestCase):
+    def setUp(self):
+        self.module = load_plugin(RESOURCE_ATTRIBUTES)
+        self.module.prefetch_related_objects = mock.Mock()
+        self.values = FakeManager()
+        self.module.CustomFieldValue = FakeCustomFieldValue
+        FakeCustomFieldValue.objects = self.values
+        FakeLink.objects = mock.Mock()
+        self.module.Resource.attributes.through = FakeLink
+        self.fields = {}
+
+    def field(self, name, type):
+        self.fields[name] = SimpleNamespace(name=name, type=type)
+        self.module.CustomField.objects.filter.side_effect = lambda name__in: [
+            self.fields[name] for name in name__in if name in self.fields]
+        return self.fields[name]
+
+    def resource(self, id, *cfvs):
+        return mock.Mock(id=id, **{'attributes.all.return_value': list(cfvs)})
+
+    def added(self):
+        links = FakeLink.objects.bulk_create.call_args.args[0]
+        return {(link.resource_id, link.customfieldvalue_id) for link in links}
+
+    def test_string_values_are_created_once_and_linked_in_bulk(self):
+        self.field('db_status', 'STR')
+        first, second = self.resource(1), self.resource(2)
+
+        self.module.write_resource_attributes({first: {'db_status': 'available'}, second: {'db_status': 'available'}})
+
+        self.assertEqual([(row.str_value, row.id) for row in self.values.rows], [('available', 1)])
+        self.assertEqual(self.added(), {(1, 1), (2, 1)})
+
+    def test_integer_values_use_the_int_column(self):
+        size = self.field('ebs_volume_size', 'INT')
+        existing = FakeCustomFieldValue(size, int_value=20)
+        self.values.bulk_create([existing])
+
+        self.module.write_resource_attributes({self.resource(1): {'ebs_volume_size': '20'},
+                                               self.resource(2): {'ebs_volume_size': 40}})
+
+        self.assertEqual([row.int_value for row in self.values.rows], [20, 40])
+        self.assertEqual(self.added(), {(1, 1), (2, 2)})
+
+    def test_boolean_values_use_the_boolean_column(self):
+        encrypted = self.field('volume_encrypted', 'BOOL')
+        current = FakeCustomFieldValue(encrypted, boolean_value=False)
+        self.values.bulk_create([current])
+
+        self.module.write_resource_attributes({self.resource(1, current): {'volume_encrypted': 'True'},
+                                               self.resource(2, current): {'volume_encrypted': False}})
+
+        self.assertEqual([row.boolean_value for row in self.values.rows], [False, True])
+        self.assertEqual(self.added(), {(1, 2)})
+        FakeLink.objects.filter.return_value.delete.assert_called_once()
+
+    def test_a_change_empties_the_discovery_fingerprint(self):
+        status = self.field('db_status', 'STR')
+        available = FakeCustomFieldValue(status, str_value='available')
+        synced = FakeCustomFieldValue(SimpleNamespace(name='discovery_fingerprint', type='STR'), str_value='0a1b2c')
+        self.values.bulk_create([available, synced])
+
+        self.module.write_resource_attributes({self.resource(1, available, synced): {'db_status': 'stopped'}})
+
+        self.assertEqual([row.str_value for row in self.values.rows], ['available', '0a1b2c', 'stopped', ''])
+        self.assertEqual(self.added(), {(1, 3), (1, 4)})
+
+    def test_an_unchanged_resource_keeps_its_discovery_fingerprint(self):
+        status = self.field('db_status', 'STR')
+        available = FakeCustomFieldValue(status, str_value='available')
+        synced = FakeCustomFieldValue(SimpleNamespace(name='discovery_fingerprint', type='STR'), str_value='0a1b2c')
+        self.values.bulk_create([available, synced])
+
+        self.module.write_resource_attributes({self.resource(1, available, synced): {'db_status': 'available'}})
+
+        self.assertEqual(self.added(), set())
+        FakeLink.objects.filter.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
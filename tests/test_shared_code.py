@@ -0,0 +1,69 @@
+import glob
+import importlib.util
+import os
+import tempfile
+import unittest
+
+from plugin_loader import REPO_ROOT, aws_plugin_paths
+
+SYNC_TOOL_PATH = os.path.join(REPO_ROOT, 'blueprints', 'Shared Plug-in Code', 'sync_shared_code.py')
+
+
+def load_sync_tool():
+    spec = importlib.util.spec_from_file_location('sync_shared_code', SYNC_TOOL_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class SharedCodeSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.sync_tool = load_sync_tool()
+        self.modules = self.sync_tool.shared_modules()
+
+    def test_released_versions_match_the_shared_sections(self):
+        self.assertEqual(self.sync_tool.shared_code_errors(self.modules), [])
+
+    def test_every_plugin_is_in_sync(self):
+        for path in self.sync_tool.plugin_paths():
+            self.assertEqual(self.sync_tool.plugin_errors(self.modules, path), [])
+        self.assertEqual(self.sync_tool.stale_plugins(self.modules), [])
+
+    def assert_carried_by(self, module, paths):
+        sections = {name for name, _, _ in self.modules[module]}
+        for path in paths:
+            if os.path.dirname(path) == self.sync_tool.SHARED_DIR:
+                continue
+            names = {name for name, _, _ in self.sync_tool.read_sections(self.sync_tool.read(path))}
+            self.assertTrue(sections <= names, path)
+
+    def test_every_aws_plugin_carries_the_client_pool(self):
+        self.assert_carried_by('Shared Plug-in Code/aws_client_pool.py', aws_plugin_paths())
+
+    def test_every_gke_plugin_carries_the_service_cache(self):
+        paths = glob.glob(os.path.join(REPO_ROOT, 'blueprints', 'Google Kubernetes Engine Cluster', '**', '*.py'),
+                          recursive=True)
+        paths = [path for path in paths if 'class GCPServiceCache' in self.sync_tool.read(path)]
+        self.assertEqual(len(paths), 3)
+        self.assert_carried_by('Shared Plug-in Code/gcp_service_cache.py', paths)
+
+    def test_crlf_plugins_keep_their_line_endings(self):
+        canonical = self.sync_tool.canonical_sections(self.modules)
+        name, (source, _) = next(iter(canonical.items()))
+        stale = '# BEGIN {0}, synced from "{1}"\nstale = True\n# END {0}\n'.format(name, source)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'plugin.py')
+        with open(path, 'w', newline='') as plugin:
+            plugin.write(('x = 1\n' + stale).replace('\n', '\r\n'))
+        self.sync_tool.sync(self.modules, path)
+
+        with open(path, newline='') as plugin:
+            text = plugin.read()
+        self.assertNotIn('stale = True', text)
+        self.assertEqual(text.count('\n'), text.count('\r\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
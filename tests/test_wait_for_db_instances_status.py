@@ -0,0 +1,93 @@
+import os
+import unittest
+from unittest import mock
+
+from plugin_loader import REPO_ROOT, load_plugin
+
+CREATE_PLUGINS = [
+    os.path.join(REPO_ROOT, 'blueprints', 'AWS MySQL', 'Deployment Item 1 Create AWS MySQL Database Service',
+                 'Create AWS MySQL Database Service Script.py'),
+    os.path.join(REPO_ROOT, 'blueprints', 'AWS PostgreSQL', 'Deployment Item 1 Create AWS PostgreSQL Database',
+                 'Create AWS PostgreSQL Database Script.py'),
+]
+START_STOP_PLUGINS = [
+    os.path.join(REPO_ROOT, 'blueprints', 'AWS MySQL', 'Management Item Start MySQL Database Instance',
+                 'Hook for Start MySQL Database Instance', 'Sub File for Hook of Start MySQL Database Instance Script.py'),
+    os.path.join(REPO_ROOT, 'blueprints', 'AWS MySQL', 'Management Item Stop MySQL Database Instance',
+                 'Hook for Stop MySQL Database Instance', 'Sub File for Hook of Stop MySQL Database Instance Script.py'),
+    os.path.join(REPO_ROOT, 'blueprints', 'AWS PostgreSQL', 'Management Item Start PostgreSQL Database',
+                 'Hook for Start PostgreSQL Database', 'Sub File for Hook of Start PostgreSQL Database Script.py'),
+    os.path.join(REPO_ROOT, 'blueprints', 'AWS PostgreSQL', 'Management Item Stop PostgreSQL Database',
+                 'Hook for Stop PostgreSQL Database', 'Sub File for Hook of Stop PostgreSQL Database Script.py'),
+]
+
+
+def describing(*statuses):
+    """
+    Return an RDS client whose successive describe rounds report statuses for
+    the instance 'db-1'.
+    """
+    client = mock.Mock()
+    client.get_paginator.return_value.paginate.side_effect = [
+        [{'DBInstances': [{'DBInstanceIdentifier': 'db-1', 'DBInstanceStatus': status}]}] for status in statuses
+    ]
+    return client
+
+
+class WaitForDBInstancesStatusTest(unittest.TestCase):
+    def test_failed_status_raises_without_waiting_for_the_timeout(self):
+        for path in CREATE_PLUGINS + START_STOP_PLUGINS:
+            with self.subTest(plugin=os.path.basename(path)):
+                module = load_plugin(path)
+                module.ClientError = type('ClientError', (Exception,), {})
+                client = describing('creating', 'incompatible-parameters')
+                with mock.patch.object(module.time, 'sleep') as sleep:
+                    with self.assertRaisesRegex(RuntimeError, 'db-1 is incompatible-parameters'):
+                        module.wait_for_db_instances_status(client, ['db-1'], 'available', 3000, 60, 120,
+                                                            module.FAILED_STATUSES)
+                self.assertEqual(sleep.call_count, 1)
+
+    def test_returns_the_instance_once_it_reaches_the_target_status(self):
+        module = load_plugin(CREATE_PLUGINS[0])
+        module.ClientError = type('ClientError', (Exception,), {})
+        client = describing('creating', 'available')
+        with mock.patch.object(module.time, 'sleep'):
+            finished = module.wait_for_db_instances_status(client, ['db-1'], 'available', 3000, 60, 120,
+                                                           module.FAILED_STATUSES)
+        self.assertEqual(finished['db-1']['DBInstanceStatus'], 'available')
+
+    def test_jitter_does_not_stretch_polls_beyond_the_longest_delay(self):
+        for path in CREATE_PLUGINS + START_STOP_PLUGINS:
+            with self.subTest(plugin=os.path.basename(path)):
+                module = load_plugin(path)
+                module.ClientError = type('ClientError', (Exception,), {})
+                client = describing(*['pending'] * 10 + ['available'])
+                with mock.patch.object(module.time, 'sleep') as sleep, \
+                        mock.patch.object(module.random, 'uniform', return_value=1.25):
+                    module.wait_for_db_instances_status(client, ['db-1'], 'available', 3600,
+                                                        module.POLL_INITIAL_DELAY, module.POLL_MAX_DELAY)
+                if path in START_STOP_PLUGINS:
+                    self.assertLessEqual(module.POLL_MAX_DELAY, 20)
+                self.assertEqual(max(call.args[0] for call in sleep.call_args_list), module.POLL_MAX_DELAY)
+
+    def test_without_strict_failed_and_missing_instances_are_settled(self):
+        module = load_plugin(CREATE_PLUGINS[0])
+        module.ClientError = type('ClientError', (Exception,), {})
+        client = mock.Mock()
+        client.get_paginator.return_value.paginate.side_effect = [
+            [{'DBInstances': [{'DBInstanceIdentifier': 'db-1', 'DBInstanceStatus': 'starting'},
+                              {'DBInstanceIdentifier': 'db-2', 'DBInstanceStatus': 'starting'},
+                              {'DBInstanceIdentifier': 'db-3', 'DBInstanceStatus': 'starting'}]}],
+            [{'DBInstances': [{'DBInstanceIdentifier': 'db-1', 'DBInstanceStatus': 'available'},
+                              {'DBInstanceIdentifier': 'db-2', 'DBInstanceStatus': 'storage-full'}]}],
+        ]
+        with mock.patch.object(module.time, 'sleep') as sleep:
+            db_instances = module.wait_for_db_instances_status(client, ['db-1', 'db-2', 'db-3'], 'available', 3000,
+                                                               60, 120, module.FAILED_STATUSES, strict=False)
+        statuses = {identifier: db_instance['DBInstanceStatus'] for identifier, db_instance in db_instances.items()}
+        self.assertEqual(statuses, {'db-1': 'available', 'db-2': 'storage-full'})
+        self.assertEqual(sleep.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()